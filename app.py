@@ -5,8 +5,11 @@ import os
 import sys
 from flask import Flask
 from config import cfg
-from sbcutils import PyRibbonClient
 from routes import bp
+import scheduler_service
+import notifications
+import reconcile
+import timing
 
 # Setup logging before anything else
 logfile = os.path.join(os.path.dirname(__file__), "audssoncall.log")
@@ -28,10 +31,21 @@ logging.info("Starting Auds on Call application...")
 
 # --- FLASK APP INITIALIZATION ---
 app = Flask(__name__ , static_url_path="/audssoncall/static")
-app.config.from_object(cfg)
-sbc_client = PyRibbonClient()
+# cfg is deliberately not copied into app.config: nothing reads it there and
+# doing so would decrypt the SBC password during startup
 # This is the ONLY route-related action in app.py
 app.register_blueprint(bp, url_prefix='/audssoncall')
+# Server-Timing header and slow-request log
+timing.init_app(app)
+
+# Runs due schedules at their exact time; replaces the 5 minute APScheduler poll
+if cfg.SCHEDULER_ENABLED:
+    scheduler_service.start()
+# Delivers queued email notifications off the request path
+notifications.start()
+# Alerts when an SBC no longer holds the rota's on-call number
+if cfg.RECONCILE_ENABLED:
+    reconcile.start()
 
 if __name__ == '__main__':
     app.run(debug=True, threaded=True)
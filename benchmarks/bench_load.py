@@ -0,0 +1,419 @@
+#bench_load.py
+"""
+Load test of the whole API: how many concurrent dashboard users and update
+calls the app sustains, and where the time goes per endpoint.
+
+The app is served with waitress (serve.py) on the SQLite stand-in, seeded
+with users and schedules, with its SBCs replaced by FakeSBC instances and
+its mail server by SinkSMTP (see standins.py). --clients keep-alive clients
+then pick operations at random, weighted by --mix, for --seconds. Every
+route in routes.bp has at least one operation; routes without one are
+listed as uncovered.
+
+The report (JSON on stdout) has, per endpoint, throughput, p50/p95/p99
+latency, status counts and the error rate (5xx and connection errors), plus
+what the stand-ins received. --save writes it as a baseline file and
+--compare checks a run against one: an endpoint whose p95 got more than
+--tolerance slower, or whose error rate rose, is a regression (exit 1).
+Endpoints with fewer than --min-requests samples are not judged.
+
+    python benchmarks/bench_load.py --clients 16 --seconds 20 --save benchmarks/baseline.json
+    python benchmarks/bench_load.py --clients 16 --seconds 20 --compare benchmarks/baseline.json
+    python benchmarks/bench_load.py --mix dashboard=10,oncall_update=1 --sbc-latency-ms 50
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+import requests
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_serve import free_port, seed, start_server
+from bench_startup import ROOT, write_config
+from standins import FakeSBC, SinkSMTP
+
+PREFIX = '/audssoncall'
+SEED_USERS = 50
+SEED_SCHEDULES = 200
+
+ROUTES = """
+import json, app
+rules = [[r.rule, m] for r in app.app.url_map.iter_rules() if r.endpoint.startswith('audss_oncall.')
+         for m in sorted(r.methods - {'HEAD', 'OPTIONS'})]
+print("ROUTES=" + json.dumps(rules), flush=True)
+"""
+
+class State:
+    """What the clients create and later read or delete, shared between them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.numbers = itertools.count(1)
+        self.users = []
+        self.schedules = []
+        self.jobs = []
+        self.version = 0
+
+    def mobile(self):
+        with self.lock:
+            return f"+61499{next(self.numbers):06d}"
+
+    def add(self, kind, value):
+        with self.lock:
+            getattr(self, kind).append(value)
+
+    def take(self, kind):
+        """Removes and returns a random item of kind, or None."""
+        with self.lock:
+            items = getattr(self, kind)
+            return items.pop(random.randrange(len(items))) if items else None
+
+    def pick(self, kind):
+        with self.lock:
+            items = getattr(self, kind)
+            return random.choice(items[-20:]) if items else None
+
+def _future(rng):
+    when = datetime.now() + timedelta(days=rng.randint(2, 365), minutes=rng.randint(0, 24 * 60))
+    return when.replace(second=0, microsecond=0).strftime('%d/%m/%Y %H:%M:%S')
+
+def _json(response):
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+# --- OPERATIONS ---
+# name -> (route, method, default weight, function(session, base, state, rng)).
+# A function returns the response, or None when it had nothing to act on
+# (e.g. no user left to delete); that attempt is not counted.
+def op_users_create(s, base, state, rng):
+    response = s.post(f"{base}/api/users", json={'name': f"load-{state.mobile()}", 'mobile': state.mobile()})
+    body = _json(response)
+    if response.status_code == 201 and body and body.get('user'):
+        state.add('users', body['user']['id'])
+    return response
+
+def op_users_update(s, base, state, rng):
+    user_id = state.pick('users') or rng.randint(1, SEED_USERS)
+    return s.put(f"{base}/api/users/{user_id}", json={'mobile': state.mobile()})
+
+def op_users_delete(s, base, state, rng):
+    user_id = state.take('users')
+    return s.delete(f"{base}/api/users/{user_id}") if user_id else None
+
+def op_users_import(s, base, state, rng):
+    rows = [{'name': f"import-{rng.randint(1, 200)}", 'mobile': state.mobile()} for _ in range(5)]
+    return s.post(f"{base}/api/users/import", json=rows)
+
+def op_schedule_create(s, base, state, rng):
+    data = {'user_id': rng.randint(1, SEED_USERS), 'scheduled_datetime': _future(rng), 'allow_conflicts': True}
+    response = s.post(f"{base}/api/schedule", json=data)
+    body = _json(response)
+    if response.status_code == 201 and body and body.get('schedule'):
+        state.add('schedules', body['schedule']['id'])
+    return response
+
+def op_schedule_bulk(s, base, state, rng):
+    rows = [{'user_id': rng.randint(1, SEED_USERS), 'scheduled_datetime': _future(rng)} for _ in range(5)]
+    response = s.post(f"{base}/api/schedule/bulk", json={'schedules': rows, 'allow_conflicts': True})
+    for row in (_json(response) or {}).get('rows', []):
+        if row.get('id'):
+            state.add('schedules', row['id'])
+    return response
+
+def op_schedule_delete(s, base, state, rng):
+    schedule_id = state.take('schedules')
+    return s.delete(f"{base}/api/schedule/{schedule_id}") if schedule_id else None
+
+def op_dashboard(s, base, state, rng):
+    response = s.get(f"{base}/api/dashboard")
+    version = (_json(response) or {}).get('version')
+    if version:
+        state.version = max(state.version, version)
+    return response
+
+def op_changes(s, base, state, rng):
+    return s.get(f"{base}/api/changes", params={'since': state.version})
+
+def op_oncall_set(s, base, state, rng):
+    return s.post(f"{base}/api/oncall", json={'mobile': f"+6140000{rng.randint(0, SEED_USERS - 1):04d}"})
+
+def op_oncall_update(s, base, state, rng):
+    return s.post(f"{base}/api/oncall/update", json={'mobile': f"+6140000{rng.randint(0, SEED_USERS - 1):04d}"})
+
+def op_oncall_update_async(s, base, state, rng):
+    response = s.post(f"{base}/api/oncall/update", params={'async': 1},
+                      json={'mobile': f"+6140000{rng.randint(0, SEED_USERS - 1):04d}"})
+    job_id = (_json(response) or {}).get('job_id')
+    if job_id:
+        state.add('jobs', job_id)
+    return response
+
+def op_job_status(s, base, state, rng):
+    job_id = state.pick('jobs')
+    return s.get(f"{base}/api/jobs/{job_id}") if job_id else None
+
+def op_history(s, base, state, rng):
+    return s.get(f"{base}/api/history", params={'limit': 50})
+
+def op_coverage(s, base, state, rng):
+    return s.get(f"{base}/api/reports/coverage")
+
+def get(path, **params):
+    return lambda s, base, state, rng: s.get(f"{base}{path}", params=params or None)
+
+OPERATIONS = {
+    'index':                ('/', 'GET', 5, get('/')),
+    'users_list':           ('/api/users', 'GET', 10, get('/api/users')),
+    'users_create':         ('/api/users', 'POST', 2, op_users_create),
+    'users_update':         ('/api/users/<int:user_id>', 'PUT', 1, op_users_update),
+    'users_delete':         ('/api/users/<int:user_id>', 'DELETE', 1, op_users_delete),
+    'users_import':         ('/api/users/import', 'POST', 1, op_users_import),
+    'users_export':         ('/api/users/export', 'GET', 2, get('/api/users/export')),
+    'dashboard':            ('/api/dashboard', 'GET', 20, op_dashboard),
+    'changes':              ('/api/changes', 'GET', 10, op_changes),
+    'schedule_list':        ('/api/schedule', 'GET', 10, get('/api/schedule')),
+    'schedule_create':      ('/api/schedule', 'POST', 2, op_schedule_create),
+    'schedule_bulk':        ('/api/schedule/bulk', 'POST', 1, op_schedule_bulk),
+    'schedule_delete':      ('/api/schedule/<int:schedule_id>', 'DELETE', 1, op_schedule_delete),
+    'schedule_ics':         ('/api/schedule.ics', 'GET', 5, get('/api/schedule.ics')),
+    'oncall_check':         ('/api/oncall', 'GET', 5, get('/api/oncall')),
+    'oncall_set':           ('/api/oncall', 'POST', 1, op_oncall_set),
+    'oncall_update':        ('/api/oncall/update', 'POST', 1, op_oncall_update),
+    'oncall_update_async':  ('/api/oncall/update', 'POST', 1, op_oncall_update_async),
+    'job_status':           ('/api/jobs/<job_id>', 'GET', 2, op_job_status),
+    'reconcile':            ('/api/reconcile', 'GET', 1, get('/api/reconcile')),
+    'reconcile_last':       ('/api/reconcile', 'GET', 2, get('/api/reconcile', last=1)),
+    'reconcile_heal':       ('/api/reconcile', 'POST', 1,
+                             lambda s, base, state, rng: s.post(f"{base}/api/reconcile")),
+    'history':              ('/api/history', 'GET', 3, op_history),
+    'coverage':             ('/api/reports/coverage', 'GET', 3, op_coverage),
+    'health':               ('/health', 'GET', 5, get('/health')),
+    'ready':                ('/ready', 'GET', 2, get('/ready')),
+}
+
+def parse_mix(text):
+    """'dashboard=10,oncall_update=1' -> weights; only the named operations run."""
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, expected some of {sorted(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+# --- SETUP ---
+def write_load_config(tmpdir, sbcs, smtp, keep_rate_limits):
+    """write_config, with the stand-ins wired in."""
+    path = write_config(tmpdir)
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    resources = list(config['SBC']['SBC_HOSTS'].values())
+    config['SBC']['SBC_HOSTS'] = {sbc.host: resources[i % len(resources)] for i, sbc in enumerate(sbcs)}
+    config['SBC']['SCHEME'] = 'http'
+    config['SBC']['TIMEOUT_SECONDS'] = 5
+    config['MAIL'].update(SMTP_SERVER='127.0.0.1', SMTP_PORT=smtp.port, STARTTLS=False, POLL_SECONDS=1)
+    config['CACHE'] = dict(config.get('CACHE') or {}, PATH=os.path.join(tmpdir, 'cache.db'))
+    if not keep_rate_limits:
+        # Measure the app, not the limiter
+        config['RATE_LIMIT'] = dict(config.get('RATE_LIMIT') or {}, SBC_PER_MINUTE=1000000, SBC_BURST=100000,
+                                    CLIENT_PER_MINUTE=1000000, CLIENT_BURST=100000)
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return path
+
+def uncovered_routes(env):
+    out = subprocess.run([sys.executable, '-c', ROUTES], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    # The app's background threads may print too, even on the same line
+    text = out.stdout[out.stdout.index("ROUTES=") + len("ROUTES="):]
+    routes = {tuple(route) for route in json.JSONDecoder().raw_decode(text)[0]}
+    covered = {(PREFIX + route if route != '/' else PREFIX + '/', method) for route, method, _, _ in OPERATIONS.values()}
+    return sorted(f"{method} {rule}" for rule, method in routes - covered)
+
+# --- LOAD ---
+def percentile(ordered, fraction):
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+def run_load(port, mix, clients, seconds, warmup, state, seed_value):
+    base = f"http://127.0.0.1:{port}{PREFIX}"
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lock = threading.Lock()
+    start = time.monotonic() + warmup
+    deadline = start + seconds
+
+    def client(n):
+        rng = random.Random(seed_value + n)
+        session = requests.Session()
+        mine = defaultdict(list)
+        codes = defaultdict(Counter)
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            name = rng.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                response = OPERATIONS[name][3](session, base, state, rng)
+                if response is None:
+                    continue
+                code = response.status_code
+            except requests.exceptions.RequestException:
+                code = 'error'
+            elapsed = (time.perf_counter() - t0) * 1000
+            if now >= start:
+                mine[name].append(elapsed)
+                codes[name][code] += 1
+        with lock:
+            for name, values in mine.items():
+                samples[name].extend(values)
+                statuses[name].update(codes[name])
+
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    endpoints = {}
+    for name in names:
+        ms = sorted(samples[name])
+        if not ms:
+            continue
+        codes = statuses[name]
+        errors = sum(count for code, count in codes.items() if code == 'error' or code >= 500)
+        route, method = OPERATIONS[name][:2]
+        endpoints[name] = {
+            'route': f"{method} {PREFIX}{route if route != '/' else '/'}",
+            'requests': len(ms),
+            'req_per_s': round(len(ms) / seconds, 1),
+            'p50_ms': round(percentile(ms, 0.50), 1),
+            'p95_ms': round(percentile(ms, 0.95), 1),
+            'p99_ms': round(percentile(ms, 0.99), 1),
+            'errors': errors,
+            'error_rate': round(errors / len(ms), 4),
+            'statuses': {str(code): count for code, count in sorted(codes.items(), key=str)},
+        }
+    every = sorted(value for values in samples.values() for value in values)
+    total = {
+        'requests': len(every),
+        'req_per_s': round(len(every) / seconds, 1),
+        'p50_ms': round(percentile(every, 0.50), 1) if every else None,
+        'p95_ms': round(percentile(every, 0.95), 1) if every else None,
+        'p99_ms': round(percentile(every, 0.99), 1) if every else None,
+        'errors': sum(entry['errors'] for entry in endpoints.values()),
+    }
+    total['error_rate'] = round(total['errors'] / len(every), 4) if every else None
+    return endpoints, total
+
+# --- BASELINE ---
+def compare(report, baseline, tolerance, floor_ms, min_requests):
+    """
+    Per-endpoint changes against a baseline report; regressions are flagged
+    on endpoints with at least min_requests samples in both runs.
+    """
+    result = {}
+    for name, now in report['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        slower = now['p95_ms'] - before['p95_ms']
+        regression = []
+        judged = min(now['requests'], before['requests']) >= min_requests
+        if judged and slower > floor_ms and now['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regression.append(f"p95 {before['p95_ms']}ms -> {now['p95_ms']}ms")
+        if judged and now['error_rate'] > before['error_rate'] + 0.01:
+            regression.append(f"error rate {before['error_rate']:.2%} -> {now['error_rate']:.2%}")
+        result[name] = {
+            'p95_change': round(now['p95_ms'] / before['p95_ms'] - 1, 3) if before['p95_ms'] else None,
+            'throughput_change': round(now['req_per_s'] / before['req_per_s'] - 1, 3) if before['req_per_s'] else None,
+            'regression': "; ".join(regression) or None,
+            'judged': judged,
+        }
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--warmup', type=float, default=2, help='seconds of load before measuring')
+    parser.add_argument('--threads', type=int, default=8, help='waitress worker threads')
+    parser.add_argument('--mix', type=parse_mix, default=None,
+                        help=f"name=weight,... of: {', '.join(OPERATIONS)} (default: all, built-in weights)")
+    parser.add_argument('--sbcs', type=int, default=2, help='fake SBCs')
+    parser.add_argument('--sbc-latency-ms', type=float, default=5)
+    parser.add_argument('--sbc-fail-rate', type=float, default=0.0)
+    parser.add_argument('--smtp-fail-rate', type=float, default=0.0)
+    parser.add_argument('--keep-rate-limits', action='store_true', help="use config.yaml's RATE_LIMIT values")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', metavar='FILE', help='write the report as a baseline file')
+    parser.add_argument('--compare', metavar='FILE', help='compare with a baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p95 slowdown (default 0.2 = 20%%)')
+    parser.add_argument('--floor-ms', type=float, default=5, help='p95 changes below this are noise')
+    parser.add_argument('--min-requests', type=int, default=50, help='endpoints with fewer samples are not judged')
+    args = parser.parse_args()
+    mix = args.mix or {name: op[2] for name, op in OPERATIONS.items()}
+
+    sbcs = [FakeSBC(latency=args.sbc_latency_ms / 1000, fail_rate=args.sbc_fail_rate, seed=args.seed + i).start()
+            for i in range(args.sbcs)]
+    smtp = SinkSMTP(fail_rate=args.smtp_fail_rate, seed=args.seed).start()
+    report = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ, AUDSSONCALL_CONFIG=write_load_config(tmpdir, sbcs, smtp, args.keep_rate_limits))
+        seed(env, SEED_USERS, SEED_SCHEDULES)
+        uncovered = uncovered_routes(env)
+        if uncovered:
+            print(f"Routes without a load operation: {', '.join(uncovered)}", file=sys.stderr)
+        port = free_port()
+        proc = start_server('waitress', port, env, args.threads)
+        try:
+            endpoints, total = run_load(port, mix, args.clients, args.seconds, args.warmup, State(), args.seed)
+        finally:
+            proc.terminate()
+            proc.wait(30)
+
+    report = {
+        'run': {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'clients': args.clients, 'seconds': args.seconds, 'threads': args.threads,
+            'sbcs': args.sbcs, 'sbc_latency_ms': args.sbc_latency_ms,
+            'sbc_fail_rate': args.sbc_fail_rate, 'smtp_fail_rate': args.smtp_fail_rate, 'mix': mix,
+        },
+        'total': total,
+        'endpoints': endpoints,
+        'uncovered_routes': uncovered,
+        'standins': {
+            'sbc': [dict(sbc.counts, host=sbc.host) for sbc in sbcs],
+            'smtp': dict(smtp.counts),
+        },
+    }
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            report['comparison'] = compare(report, json.load(f), args.tolerance, args.floor_ms, args.min_requests)
+        regressions = [f"{name}: {entry['regression']}" for name, entry in report['comparison'].items() if entry['regression']]
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#bench_serve.py
+"""
+Throughput of the production server (serve.py, waitress) against the
+Werkzeug dev server that `python app.py` runs.
+
+Each server is started in its own process on the SQLite stand-in, seeded
+with some users and schedules, and hit by --clients concurrent keep-alive
+clients for --seconds on the database-backed pages. SBC routes are left out
+so no SBC access is needed.
+
+    python benchmarks/bench_serve.py --clients 16 --seconds 10
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_startup import ROOT, write_config
+
+PATHS = ['/audssoncall/api/users', '/audssoncall/api/schedule', '/audssoncall/']
+
+# The dev server as app.py starts it, minus the reloader and debugger
+DEV_SERVER = "import app; app.app.run(port={port}, threaded=True)"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def seed(env, users=50, schedules=200):
+    code = f"""
+from datetime import datetime, timedelta
+from db import get_db_connection
+conn = get_db_connection()
+cursor = conn.cursor()
+for i in range({users}):
+    cursor.execute("INSERT INTO OnCallUsers (name, mobile) VALUES (?, ?)", (f"user{{i}}", f"6140000{{i:04d}}"))
+start = datetime.now() + timedelta(days=1)
+for i in range({schedules}):
+    cursor.execute("INSERT INTO OnCallSchedules (user_id, scheduled_datetime) VALUES (?, ?)",
+                   (i % {users} + 1, start + timedelta(hours=i)))
+conn.commit()
+conn.close()
+"""
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True)
+
+def start_server(kind, port, env, threads):
+    if kind == 'waitress':
+        cmd = [sys.executable, 'serve.py', '--host', '127.0.0.1', '--port', str(port),
+               '--threads', str(threads), '--no-warm-up']
+    else:
+        cmd = [sys.executable, '-c', DEV_SERVER.format(port=port)]
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/audssoncall/", timeout=1)
+            return proc
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+def load(port, clients, seconds):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client(n):
+        session = requests.Session()
+        mine = []
+        failed = 0
+        i = n
+        while time.monotonic() < deadline:
+            path = PATHS[i % len(PATHS)]
+            i += 1
+            t0 = time.perf_counter()
+            try:
+                ok = session.get(f"http://127.0.0.1:{port}{path}", timeout=10).status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            mine.append(time.perf_counter() - t0)
+            failed += not ok
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    latencies.sort()
+    ms = [value * 1000 for value in latencies]
+    return {
+        'requests': len(ms),
+        'errors': errors[0],
+        'req_per_s': round(len(ms) / seconds, 1),
+        'p50_ms': round(statistics.median(ms), 1),
+        'p95_ms': round(ms[int(len(ms) * 0.95) - 1], 1),
+        'p99_ms': round(ms[int(len(ms) * 0.99) - 1], 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--threads', type=int, default=8, help='waitress worker threads')
+    args = parser.parse_args()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ, AUDSSONCALL_CONFIG=write_config(tmpdir))
+        seed(env)
+        for kind in ('dev', 'waitress'):
+            port = free_port()
+            proc = start_server(kind, port, env, args.threads)
+            try:
+                report[kind] = load(port, args.clients, args.seconds)
+            finally:
+                proc.terminate()
+                proc.wait(30)
+    report['clients'] = args.clients
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#bench_startup.py
+"""
+Cold-start benchmark for the web app.
+
+Starts fresh interpreters (as IIS FastCGI does when it recycles a worker),
+imports app.py and serves the first page, and reports the import time and
+first-request time. Runs against the SQLite stand-in so no SQL Server, SBC or
+SMTP access is needed.
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --importtime      # slowest imports
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+response = app.app.test_client().get('/audssoncall/')
+t2 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'first_request': t2 - t1, 'status': response.status_code}))
+"""
+
+def write_config(tmpdir):
+    """Copies config.yaml with the database pointed at a throwaway SQLite file."""
+    with open(os.path.join(ROOT, 'config.yaml')) as f:
+        config = yaml.safe_load(f)
+    config['DATABASE']['ENGINE'] = 'sqlite'
+    config['DATABASE']['SQLITE_PATH'] = os.path.join(tmpdir, 'bench.db')
+    path = os.path.join(tmpdir, 'config.yaml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return path
+
+def run_probe(env):
+    out = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def import_profile(env, top):
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT,
+                         env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), name[1:].rstrip()))
+    # Only app and its direct imports (deeper ones are further indented),
+    # otherwise every parent repeats the cost of its children
+    direct = [(us, name.strip()) for us, name in rows if len(name) - len(name.lstrip()) <= 2]
+    return sorted(direct, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--importtime', action='store_true', help='show the slowest imports made by app.py')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ, AUDSSONCALL_CONFIG=write_config(tmpdir))
+        if args.importtime:
+            for us, name in import_profile(env, args.top):
+                print(f"{us / 1000:8.1f} ms  {name}")
+            return
+
+        samples = [run_probe(env) for _ in range(args.runs)]
+        report = {}
+        for key in ('import', 'first_request'):
+            values = [sample[key] * 1000 for sample in samples]
+            report[key] = {
+                'median_ms': round(statistics.median(values), 1),
+                'min_ms': round(min(values), 1),
+                'max_ms': round(max(values), 1),
+            }
+        report['runs'] = args.runs
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
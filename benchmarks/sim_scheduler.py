@@ -0,0 +1,315 @@
+#sim_scheduler.py
+"""
+Time-travel simulation of the scheduler: a year of handovers in seconds.
+
+A rota of --schedules handovers over --days is generated in a throwaway
+SQLite database and replayed through the real run_scheduled_updates() and
+email outbox, against FakeSBC and SinkSMTP stand-ins (see standins.py). The
+clock (clock.py, also behind the stand-in's GETDATE()) is set to the
+simulated time, so nothing waits. By default the real SchedulerService
+loop is driven: each tick() runs what is due and says how long to wait, and
+the simulated clock jumps ahead by that much. With --poll-minutes
+run_scheduled_updates() is called at a fixed interval like a scheduled task.
+
+Failures can be injected:
+  --outages / --outage-hours          scheduler down: due handovers pile up
+                                      and are caught up when it returns
+  --sbc-outages / --sbc-outage-hours  one SBC refuses every request
+  --sbc-fail-rate, --smtp-fail-rate   random request / message failures
+
+The report (JSON on stdout) gives handover lateness, the time the SBCs
+showed an out-of-date number, SBC writes and DB queries per run, and the
+mail delivered. --runs-out writes one NDJSON line per run.
+
+The SBC client's session reuse and rate limits run on the real clock, so
+sessions are not kept between runs (SBC.KEEP_SESSIONS off), the rate limits
+are lifted, and pre-staging (which runs on a thread) and the drift
+monitor are not simulated.
+
+    python benchmarks/sim_scheduler.py --schedules 3000 --days 365 --outages 6 --sbc-outages 12
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_load import percentile, write_load_config
+from bench_startup import ROOT
+from standins import FakeSBC, SinkSMTP
+
+sys.path.insert(0, ROOT)
+
+def write_sim_config(tmpdir, sbcs, smtp):
+    path = write_load_config(tmpdir, sbcs, smtp, keep_rate_limits=False)
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    config['SBC']['KEEP_SESSIONS'] = False
+    config['SCHEDULER'] = dict(config.get('SCHEDULER') or {}, ENABLED=False, PRESTAGE_SECONDS=0)
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return path
+
+def windows(rng, count, hours, start, end):
+    """count random (start, end) windows of the given length between start and end, sorted."""
+    span = (end - start).total_seconds() - hours * 3600
+    found = []
+    for _ in range(count):
+        begin = start + timedelta(seconds=rng.uniform(0, max(span, 0)))
+        found.append((begin, begin + timedelta(hours=hours)))
+    return sorted(found)
+
+def within(moment, spans):
+    """The end of the span containing moment, or None."""
+    for begin, end in spans:
+        if begin <= moment < end:
+            return end
+    return None
+
+def seed_rota(users, schedules, start, days, rng):
+    """Inserts the users and a rota of schedules spread evenly (with jitter). Returns the due times."""
+    from db import get_db_connection
+    spacing = days * 86400 / schedules
+    due = []
+    for i in range(schedules):
+        jitter = rng.uniform(-spacing / 4, spacing / 4)
+        due.append((start + timedelta(seconds=i * spacing + spacing / 2 + jitter)).replace(second=0, microsecond=0))
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    cursor.executemany("INSERT INTO OnCallUsers (name, mobile) VALUES (?, ?)",
+                       [(f"sim{i}", f"+61400{i:06d}") for i in range(users)])
+    cursor.executemany("INSERT INTO OnCallSchedules (user_id, scheduled_datetime) VALUES (?, ?)",
+                       [(rng.randrange(users) + 1, when) for when in due])
+    cursor.execute("COMMIT")
+    conn.close()
+    return sorted(due)
+
+def next_pending(cursor):
+    cursor.execute("SELECT MIN(scheduled_datetime) FROM OnCallSchedules WHERE status = 'pending'")
+    value = cursor.fetchone()[0]
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def summary(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {
+        'mean': round(statistics.fmean(ordered), 1),
+        'p50': round(percentile(ordered, 0.50), 1),
+        'p95': round(percentile(ordered, 0.95), 1),
+        'p99': round(percentile(ordered, 0.99), 1),
+        'max': round(ordered[-1], 1),
+    }
+
+def simulate(args, sbcs, smtp, runs_out):
+    import clock
+    import notifications
+    import timing
+    from config import cfg
+    from db import get_db_connection
+    from scheduler_service import SchedulerService
+    from scheduler_task import run_scheduled_updates
+
+    class SimService(SchedulerService):
+        """The real service loop; keeps what each run returned for the report."""
+        ran = None
+
+        def _run_due(self):
+            with timing.traced() as trace:
+                self.ran = run_scheduled_updates(), trace
+
+    rng = random.Random(args.seed)
+    start = datetime.fromisoformat(args.start)
+    end = start + timedelta(days=args.days)
+    seed_rota(args.users, args.schedules, start, args.days, rng)
+    outages = windows(rng, args.outages, args.outage_hours, start, end)
+    sbc_outages = [(begin, finish, rng.randrange(len(sbcs)))
+                   for begin, finish in windows(rng, args.sbc_outages, args.sbc_outage_hours, start, end)]
+    poll = timedelta(minutes=args.poll_minutes) if args.poll_minutes else None
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    runs = []
+    completions = []  # simulated end time of each run that completed a handover
+    idle_runs = 0
+    now = start
+    service = None if poll else SimService()
+    started = time.perf_counter()
+    while now <= end + timedelta(days=1):
+        if poll:
+            due = next_pending(cursor)
+            if due is None:
+                break
+            # The ticks before the due one find nothing to do
+            ticks = max(-((now - due) // poll), 0)
+            idle_runs += ticks
+            now += ticks * poll
+        resumes = within(now, outages)
+        if resumes:
+            if poll:
+                now = now + -((now - resumes) // poll) * poll
+            else:
+                # The restarted process starts with a fresh service
+                now = resumes
+                service = SimService()
+            continue
+
+        for index, sbc in enumerate(sbcs):
+            down = any(begin <= now < finish and host == index for begin, finish, host in sbc_outages)
+            sbc.fail_rate = 1.0 if down else args.sbc_fail_rate
+        run_at = now
+        sbc_posts = sum(sbc.counts['post'] for sbc in sbcs)
+        t0 = time.perf_counter()
+        with clock.frozen(now):
+            if poll:
+                with timing.traced() as trace:
+                    statuses = run_scheduled_updates()
+            else:
+                service.ran = None
+                wait = service.tick()
+                statuses, trace = service.ran or (None, None)
+            with timing.traced() as mail:
+                notifications.flush()
+        elapsed = time.perf_counter() - t0
+        if not poll:
+            if wait is None:
+                break
+            now += timedelta(seconds=wait)
+            if statuses is None:
+                # Woken for a reload or retry without running anything
+                continue
+        counts = trace.counts()
+        run = {
+            'run': len(runs) + 1,
+            'at': run_at.isoformat(sep=' '),
+            'claimed': len(statuses),
+            'statuses': dict(Counter(statuses.values())),
+            'db_queries': counts.get('db.query', 0),
+            'db_connects': counts.get('db.connect', 0),
+            'sbc_writes': sum(sbc.counts['post'] for sbc in sbcs) - sbc_posts,
+            'sbc_logins': counts.get('sbc.login', 0),
+            'mail_sent': mail.counts().get('smtp.send', 0),
+            'wall_ms': round(elapsed * 1000, 1),
+        }
+        runs.append(run)
+        if runs_out:
+            runs_out.write(json.dumps(run) + "\n")
+        if 'completed' in statuses.values():
+            # The SBC update itself took real time; count it as simulated time too
+            completions.append(run_at + timedelta(seconds=elapsed))
+        if poll:
+            now += poll
+    wall = time.perf_counter() - started
+
+    # Mail still waiting on retries is given the simulated time it needs
+    for attempt in range(cfg.MAIL_MAX_ATTEMPTS):
+        with clock.frozen(now + timedelta(seconds=cfg.MAIL_RETRY_MAX * (attempt + 1))):
+            notifications.flush()
+
+    cursor.execute("SELECT id, scheduled_datetime, status FROM OnCallSchedules ORDER BY scheduled_datetime, id")
+    rows = [(row[0], datetime.fromisoformat(row[1]) if isinstance(row[1], str) else row[1], row[2])
+            for row in cursor.fetchall()]
+    cursor.execute("SELECT status, COUNT(*), SUM(attempts) FROM EmailOutbox GROUP BY status")
+    outbox = {row[0]: {'messages': row[1], 'attempts': row[2]} for row in cursor.fetchall()}
+    conn.close()
+
+    # Lateness of completed handovers: due time to the end of the run that pushed them
+    lateness = []
+    stale = 0.0
+    never_live = 0
+    for index, (schedule_id, when, status) in enumerate(rows):
+        following = rows[index + 1][1] if index + 1 < len(rows) else end
+        # The SBCs show this handover (or a later one) from the first
+        # successful run at or after it was due
+        position = bisect.bisect_left(completions, when)
+        live = completions[position] if position < len(completions) else None
+        if status == 'completed' and live is not None:
+            lateness.append((live - when).total_seconds())
+        shown = min(live, following) if live else following
+        stale += max((shown - when).total_seconds(), 0)
+        if live is None or live >= following:
+            never_live += 1
+
+    db_queries = [run['db_queries'] for run in runs]
+    writes = [run['sbc_writes'] for run in runs]
+    simulated = (end - start).total_seconds()
+    return {
+        'simulation': {
+            'start': start.isoformat(sep=' '), 'days': args.days, 'schedules': args.schedules, 'users': args.users,
+            'mode': f"poll every {args.poll_minutes} min" if poll else 'scheduler service (run at due time)',
+            'outages': len(outages), 'outage_hours': args.outage_hours,
+            'sbc_outages': len(sbc_outages), 'sbc_outage_hours': args.sbc_outage_hours,
+            'sbc_fail_rate': args.sbc_fail_rate, 'smtp_fail_rate': args.smtp_fail_rate, 'seed': args.seed,
+        },
+        'wall_seconds': round(wall, 2),
+        'simulated_days_per_wall_second': round(args.days / wall, 1) if wall else None,
+        'schedules': dict(Counter(status for _, _, status in rows)),
+        'runs': {
+            'count': len(runs),
+            'catch_up_runs': sum(1 for run in runs if run['claimed'] > 1),
+            'idle_runs_skipped': idle_runs,
+            'wall_ms': summary([run['wall_ms'] for run in runs]),
+        },
+        'lateness_seconds': summary(lateness),
+        'stale_hours': round(stale / 3600, 1),
+        'stale_percent': round(100 * stale / simulated, 3) if simulated else None,
+        'handovers_never_live': never_live,
+        'sbc': {
+            'writes': sum(writes),
+            'writes_per_run': summary(writes),
+            'logins': sum(sbc.counts['login'] for sbc in sbcs),
+            'failed_requests': sum(sbc.counts['failed'] for sbc in sbcs),
+        },
+        'db_queries': {'total': sum(db_queries), 'per_run': summary(db_queries)},
+        'mail': {'received': smtp.counts['messages'], 'refused': smtp.counts['failed'], 'outbox': outbox},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schedules', type=int, default=3000)
+    parser.add_argument('--days', type=float, default=365)
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--start', default='2030-01-01 00:00:00', help='simulated start time (ISO)')
+    parser.add_argument('--poll-minutes', type=float, default=0, help='run at a fixed interval instead of at due times')
+    parser.add_argument('--outages', type=int, default=0, help='scheduler outages')
+    parser.add_argument('--outage-hours', type=float, default=4)
+    parser.add_argument('--sbc-outages', type=int, default=0, help='single-SBC outages')
+    parser.add_argument('--sbc-outage-hours', type=float, default=2)
+    parser.add_argument('--sbc-fail-rate', type=float, default=0.0, help='chance an SBC request fails')
+    parser.add_argument('--smtp-fail-rate', type=float, default=0.0, help='chance a message is refused')
+    parser.add_argument('--sbcs', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--runs-out', metavar='FILE', help='write one NDJSON line per run')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the app log on stderr')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL, stream=sys.stderr,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+
+    sbcs = [FakeSBC(seed=args.seed + i).start() for i in range(args.sbcs)]
+    smtp = SinkSMTP(fail_rate=args.smtp_fail_rate, seed=args.seed).start()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.environ['AUDSSONCALL_CONFIG'] = write_sim_config(tmpdir, sbcs, smtp)
+        runs_out = open(args.runs_out, 'w') if args.runs_out else None
+        try:
+            # The SBC client and the scheduler print progress; keep stdout for the report
+            with open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+                report = simulate(args, sbcs, smtp, runs_out)
+        finally:
+            if runs_out:
+                runs_out.close()
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
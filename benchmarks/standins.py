@@ -0,0 +1,192 @@
+#standins.py
+"""
+Local stand-ins for the SBCs and the SMTP server, for the benchmarks.
+
+FakeSBC answers the Ribbon REST calls the app makes (login, logout, GET and
+POST of the on-call transformation entry, system backup) over plain HTTP, so
+the app has to run with SBC.SCHEME: http. SinkSMTP accepts and counts mail
+without STARTTLS. Both run on a background thread, count what they receive
+and can inject latency and failures.
+
+    sbc = FakeSBC(latency=0.005).start()      # sbc.host -> '127.0.0.1:<port>'
+    smtp = SinkSMTP().start()                 # smtp.port
+"""
+
+import random
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+XML_OK = '<?xml version="1.0"?><root><status><http_code>200</http_code></status></root>'
+XML_ENTRY = ('<?xml version="1.0"?><root><status><http_code>200</http_code></status>'
+             '<transformationentry href="{path}"><OutputFieldValue>{number}</OutputFieldValue>'
+             '</transformationentry></root>')
+XML_ERROR = ('<?xml version="1.0"?><root><status><http_code>500</http_code><app_status><app_status_entry '
+             'code="-1" /></app_status></status></root>')
+
+class _Server:
+    """Start/stop on a daemon thread, shared by both stand-ins."""
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def _fails(self):
+        with self.lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                return True
+        return self.fail_rate and self.random.random() < self.fail_rate
+
+# --- SBC ---
+class FakeSBC(_Server):
+    """
+    One SBC. latency is added to every request; with probability fail_rate
+    (or for the next fail_next requests) a request gets an HTTP 500 instead.
+    counts has one entry per call kind: login, logout, get, post, backup,
+    failed.
+    """
+
+    def __init__(self, number='+61400000000', latency=0.0, fail_rate=0.0, seed=None):
+        self.number = number
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_next = 0
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        sbc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are separate writes; without this each
+            # reply can stall on Nagle + delayed ACK (~40ms)
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, content_type='application/xml'):
+                data = body if isinstance(body, bytes) else body.encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self, method):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode() if length else ''
+                url = urlsplit(self.path)
+                path = url.path[len('/rest/'):] if url.path.startswith('/rest/') else url.path
+                if sbc.latency:
+                    time.sleep(sbc.latency)
+                if path == 'login':
+                    kind = 'login'
+                elif path == 'logout':
+                    kind = 'logout'
+                elif path == 'system' and parse_qs(url.query).get('action') == ['backup']:
+                    kind = 'backup'
+                else:
+                    kind = method.lower()
+                if sbc._fails():
+                    with sbc.lock:
+                        sbc.counts['failed'] += 1
+                    return self._reply(500, XML_ERROR)
+                with sbc.lock:
+                    sbc.counts[kind] += 1
+                    if kind == 'post':
+                        value = parse_qs(body).get('OutputFieldValue')
+                        if value:
+                            sbc.number = value[0]
+                    number = sbc.number
+                if kind in ('login', 'logout'):
+                    return self._reply(200, XML_OK)
+                if kind == 'backup':
+                    return self._reply(200, b'\x1f\x8b' + b'\0' * 1024, 'application/octet-stream')
+                return self._reply(200, XML_ENTRY.format(path=path, number=number))
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def host(self):
+        """The SBC.SBC_HOSTS key for this stand-in."""
+        return f"127.0.0.1:{self.port}"
+
+# --- SMTP ---
+class SinkSMTP(_Server):
+    """
+    Minimal SMTP server that accepts every message and keeps a count (and
+    the last `keep` messages). With probability fail_rate a message is
+    refused with 451 after DATA.
+    """
+
+    def __init__(self, fail_rate=0.0, keep=50, seed=None):
+        self.fail_rate = fail_rate
+        self.fail_next = 0
+        self.counts = Counter()
+        self.messages = []
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def _send(self, line):
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def handle(self):
+                self._send("220 sink ESMTP")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    verb = line.decode('utf-8', 'replace').strip().split(' ', 1)[0].upper()
+                    if verb in ('EHLO', 'HELO'):
+                        self._send("250 sink")
+                    elif verb == 'DATA':
+                        self._send("354 End data with <CR><LF>.<CR><LF>")
+                        lines = []
+                        for data in self.rfile:
+                            if data in (b".\r\n", b".\n"):
+                                break
+                            lines.append(data)
+                        if sink._fails():
+                            with sink.lock:
+                                sink.counts['failed'] += 1
+                            self._send("451 Try again later")
+                            continue
+                        with sink.lock:
+                            sink.counts['messages'] += 1
+                            sink.messages = (sink.messages + [b"".join(lines)])[-sink.keep:]
+                        self._send("250 OK")
+                    elif verb == 'QUIT':
+                        self._send("221 Bye")
+                        return
+                    elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                        self._send("250 OK")
+                    else:
+                        self._send("502 Command not implemented")
+
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
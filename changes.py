@@ -0,0 +1,108 @@
+#changes.py
+
+import logging
+from db import is_sqlite
+
+# ChangeLog: one row per user or schedule that was inserted, updated or
+# deleted. Its id doubles as the change version the UI keeps: after loading
+# the page it asks GET /api/changes?since=<version> for what changed since,
+# instead of reloading whole tables after every action.
+#
+# Versions do not always become visible in order: the user import and bulk
+# schedule insert log their rows inside a transaction, so a lower id can
+# commit after a higher one is already visible. A client that moved past the
+# higher id would never see the lower one. The feed therefore only hands
+# out versions up to the first id still missing while later rows are under
+# SETTLE_SECONDS old (see settled_version). A missing id followed only by
+# older rows is taken to be a rolled-back insert, not a pending one.
+
+ENTITIES = ('user', 'schedule')
+# Beyond this many changed entities the client is told to reload instead
+MAX_CHANGES = 500
+# Rows per INSERT, well under SQL Server's 2100 parameter limit
+_BATCH = 500
+# Longer than any transaction takes between logging its changes and committing
+SETTLE_SECONDS = 30
+# How far below the newest id current_version() looks for missing ids
+_RECENT_IDS = 10000
+
+def record(cursor, entity, action, ids):
+    """
+    Logs action ('insert', 'update' or 'delete') for each entity id and
+    returns the new version. Never raises: a failure is logged and None is
+    returned, which makes clients fall back to a full reload.
+    """
+    ids = list(ids)
+    if not ids:
+        return None
+    version = None
+    try:
+        for start in range(0, len(ids), _BATCH):
+            chunk = ids[start:start + _BATCH]
+            values = ", ".join("(?, ?, ?)" for _ in chunk)
+            params = [value for entity_id in chunk for value in (entity, entity_id, action)]
+            if is_sqlite():
+                cursor.execute(f"INSERT INTO ChangeLog (entity, entity_id, action) VALUES {values} RETURNING id", params)
+            else:
+                cursor.execute(f"INSERT INTO ChangeLog (entity, entity_id, action) OUTPUT inserted.id VALUES {values}", params)
+            version = max(row[0] for row in cursor.fetchall())
+        return version
+    except Exception as e:
+        logging.error(f"Could not record {entity} {action} for {ids}: {e}")
+        return None
+
+def settled_version(cursor, after):
+    """
+    The highest version clients may move to, looking at ids above after:
+    MAX(id), or the last id before the first missing one that has a row
+    under SETTLE_SECONDS old after it (its transaction may still commit).
+    """
+    if is_sqlite():
+        recent = "strftime('%Y-%m-%d %H:%M:%f', GETDATE(), ?)"
+        settle = f"-{SETTLE_SECONDS} seconds"
+    else:
+        recent = "DATEADD(second, -?, GETDATE())"
+        settle = SETTLE_SECONDS
+    cursor.execute(f"SELECT id FROM ChangeLog WHERE id > ? AND changed_at > {recent} ORDER BY id", (after, settle))
+    young = [row[0] for row in cursor.fetchall()]
+    if young:
+        cursor.execute("SELECT MAX(id) FROM ChangeLog WHERE id < ?", (young[0],))
+        previous = cursor.fetchone()[0] or 0
+        for change_id in young:
+            if change_id != previous + 1:
+                return max(previous, after)
+            previous = change_id
+    cursor.execute("SELECT MAX(id) FROM ChangeLog")
+    return cursor.fetchone()[0] or 0
+
+def current_version(cursor):
+    """The version to start following the feed from after loading the lists."""
+    cursor.execute("SELECT MAX(id) FROM ChangeLog")
+    latest = cursor.fetchone()[0] or 0
+    return settled_version(cursor, max(latest - _RECENT_IDS, 0))
+
+def changed_since(cursor, since):
+    """
+    The entities changed after version since, up to settled_version(), as
+    (version, entity, id, action) tuples oldest first, with only the latest
+    change per entity. Returns (version, changes), or (version, None) when
+    the client has to reload: since is ahead of the log (database restored)
+    or more than MAX_CHANGES entities changed.
+    """
+    cursor.execute("SELECT MAX(id) FROM ChangeLog")
+    if since > (cursor.fetchone()[0] or 0):
+        return current_version(cursor), None
+    version = settled_version(cursor, since)
+    cursor.execute("""
+        SELECT c.id, c.entity, c.entity_id, c.action
+        FROM ChangeLog c
+        JOIN (
+            SELECT MAX(id) AS id FROM ChangeLog WHERE id > ? AND id <= ?
+            GROUP BY entity, entity_id
+        ) latest ON latest.id = c.id
+        ORDER BY c.id
+    """, (since, version))
+    rows = cursor.fetchmany(MAX_CHANGES + 1)
+    if len(rows) > MAX_CHANGES:
+        return version, None
+    return version, [tuple(row) for row in rows]
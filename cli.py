@@ -0,0 +1,244 @@
+#cli.py
+"""
+Command-line interface for ops scripts: the same SBC client, scheduler and
+import code as the web app, without going through HTTP and Flask.
+
+    python cli.py oncall check [--hosts H1,H2]
+    python cli.py oncall update MOBILE [--hosts H1,H2] [--wait SECONDS]
+    python cli.py scheduler run-once
+    python cli.py scheduler daemon
+    python cli.py sbc snapshot [--hosts H1,H2] [--out DIR]
+    python cli.py sbc backup [--hosts H1,H2] [--out DIR]
+    python cli.py import-schedules FILE [--allow-conflicts] [--dry-run]
+
+Every command prints one JSON document on stdout; logging and progress go to
+stderr. The exit status is 0 if everything succeeded, 1 otherwise.
+--concurrency caps the SBC calls made at once (8 by default).
+"""
+import argparse
+import csv
+import getpass
+import io
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+from config import cfg
+from ratelimit import RateLimited
+import sbcutils
+
+def parse_hosts(value):
+    """--hosts: comma-separated subset of SBC.HOSTS."""
+    hosts = [host.strip() for host in value.split(',') if host.strip()]
+    unknown = [host for host in hosts if host not in cfg.SBC_HOSTS]
+    if unknown or not hosts:
+        raise argparse.ArgumentTypeError(f"unknown SBC host(s) {unknown}, expected some of {cfg.SBC_HOSTS}")
+    return hosts
+
+def all_ok(results):
+    return all(result.get('status') == 'success' for result in results)
+
+# --- ONCALL ---
+def oncall_check(args):
+    results = sbcutils.get_sbc_client().check_hosts(args.hosts)
+    return {'results': results}, all_ok(results)
+
+def oncall_update(args):
+    import history
+    hosts = args.hosts or cfg.SBC_HOSTS
+    try:
+        results = sbcutils.get_sbc_client().update_hosts(args.mobile, hosts, wait=args.wait)
+    except RateLimited as e:
+        return {'error': str(e), 'retry_after': round(e.retry_after, 1)}, False
+    history.record_changes(results, 'cli', changed_by=f"cli:{getpass.getuser()}")
+    return {'results': results}, all_ok(results)
+
+# --- SCHEDULER ---
+def scheduler_run_once(args):
+    import notifications
+    from scheduler_task import run_scheduled_updates
+    statuses = run_scheduled_updates()
+    # No background sender in a one-off run, so deliver the queue now
+    notifications.flush()
+    return {'statuses': statuses}, all(status != 'failed' for status in statuses.values())
+
+def scheduler_daemon(args):
+    """Runs the scheduler service (and the mail sender) until Ctrl+C / SIGTERM."""
+    import notifications
+    import scheduler_service
+    stopping = threading.Event()
+
+    def handle_signal(signum, frame):
+        logging.info(f"Received signal {signum}, stopping the scheduler")
+        stopping.set()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    if hasattr(signal, 'SIGBREAK'):
+        signal.signal(signal.SIGBREAK, handle_signal)
+
+    started = datetime.now()
+    scheduler_service.start()
+    notifications.start()
+    logging.info("Scheduler daemon running")
+    # Short waits so the signal handler runs promptly on Windows too
+    while not stopping.wait(1):
+        pass
+    scheduler_service.stop(cfg.SERVER_DRAIN_SECONDS)
+    remaining = sbcutils.get_sbc_client().drain(cfg.SERVER_DRAIN_SECONDS)
+    notifications.stop(cfg.SERVER_DRAIN_SECONDS)
+    return {'started': started, 'stopped': datetime.now(), 'unfinished_sbc_operations': remaining}, not remaining
+
+# --- SBC CONFIG ---
+def sbc_download(args):
+    """sbc snapshot / sbc backup: one file per host in --out."""
+    hosts = args.hosts or cfg.SBC_HOSTS
+    try:
+        results = sbcutils.get_sbc_client().download_hosts(args.kind, hosts, wait=args.wait)
+    except RateLimited as e:
+        return {'error': str(e), 'retry_after': round(e.retry_after, 1)}, False
+    os.makedirs(args.out, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+    extension = 'xml' if args.kind == 'snapshot' else 'tar.gz'
+    for result in results:
+        content = result.pop('content', None)
+        if content is None:
+            continue
+        path = os.path.join(args.out, f"{result['host']}-{args.kind}-{stamp}.{extension}")
+        with open(path, 'wb') as f:
+            f.write(content)
+        result.update(path=os.path.abspath(path), bytes=len(content))
+    return {'results': results}, all_ok(results)
+
+# --- IMPORT ---
+def read_schedule_rows(path):
+    """
+    Rows of {user_id, scheduled_datetime} from a JSON list (or {"schedules":
+    [...]}) or a CSV file with that header, '-' for stdin.
+    """
+    if path == '-':
+        text = sys.stdin.read()
+    else:
+        with open(path, encoding='utf-8-sig') as f:
+            text = f.read()
+    if text.lstrip().startswith(('[', '{')):
+        rows = json.loads(text)
+        if isinstance(rows, dict):
+            rows = rows.get('schedules')
+        if not isinstance(rows, list):
+            raise ValueError("Expected a list of schedules")
+        return rows
+    return list(csv.DictReader(io.StringIO(text)))
+
+def import_schedules(args):
+    """Bulk-creates schedules with the checks of POST /api/schedule/bulk, without its row limit."""
+    from db import get_db_connection
+    import notifications
+    import scheduler_service
+    import schedules
+    try:
+        rows = read_schedule_rows(args.file)
+    except (OSError, ValueError, csv.Error) as e:
+        return {'error': f'Could not read the import: {e}'}, False
+    if not rows:
+        return {'error': 'No schedules to import'}, False
+
+    conn = get_db_connection()
+    if conn is None:
+        return {'error': 'Database connection failed'}, False
+    try:
+        cursor = conn.cursor()
+        valid, report = schedules.check_bulk(cursor, rows, args.allow_conflicts)
+        ids, version = {}, None
+        if valid and not args.dry_run:
+            ids, version = schedules.insert_bulk(conn, valid, report, args.allow_conflicts)
+            for row_no, _, when, name, mobile in valid:
+                if row_no in ids:
+                    notifications.notify_schedule_created(name, mobile, when, cursor=cursor)
+    except Exception as e:
+        logging.error(f"Schedule import failed: {e}")
+        return {'error': f'Import failed, nothing was created: {e}'}, False
+    finally:
+        conn.close()
+    if ids:
+        scheduler_service.notify()
+        notifications.flush()
+    for row in report:
+        if row['status'] == 'created':
+            if args.dry_run:
+                row['status'] = 'valid'
+            else:
+                row['id'] = ids[row['row']]
+    rejected = sum(1 for row in report if row['status'] == 'rejected')
+    summary = {'created': len(ids), 'rejected': rejected, 'dry_run': args.dry_run, 'version': version, 'rows': report}
+    return summary, not rejected
+
+# --- MAIN ---
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description="AUDSSONCALL command-line tools (JSON on stdout)")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="SBC calls made at once (default 8)")
+    parser.add_argument('--indent', type=int, default=None, help="pretty-print the JSON output")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log at INFO level on stderr")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    oncall = commands.add_parser('oncall', help="check or update the on-call number on the SBCs")
+    oncall_commands = oncall.add_subparsers(dest='action', required=True)
+    check = oncall_commands.add_parser('check', help="read the current on-call number")
+    check.add_argument('--hosts', type=parse_hosts, help="comma-separated SBCs (default all)")
+    check.set_defaults(func=oncall_check, name='oncall check')
+    update = oncall_commands.add_parser('update', help="set the on-call number")
+    update.add_argument('mobile')
+    update.add_argument('--hosts', type=parse_hosts, help="comma-separated SBCs (default all)")
+    update.add_argument('--wait', type=float, default=None, help="seconds to wait for the SBC rate limit")
+    update.set_defaults(func=oncall_update, name='oncall update')
+
+    scheduler = commands.add_parser('scheduler', help="run the scheduled handovers")
+    scheduler_commands = scheduler.add_subparsers(dest='action', required=True)
+    scheduler_commands.add_parser('run-once', help="run the handovers due now and exit").set_defaults(func=scheduler_run_once, name='scheduler run-once')
+    scheduler_commands.add_parser('daemon', help="run handovers at their due time until stopped").set_defaults(func=scheduler_daemon, name='scheduler daemon')
+
+    sbc = commands.add_parser('sbc', help="download SBC configuration")
+    sbc_commands = sbc.add_subparsers(dest='kind', required=True)
+    for kind, help_text in (('snapshot', "save the on-call transformation entry as XML"),
+                            ('backup', "save the SBC's full configuration backup")):
+        download = sbc_commands.add_parser(kind, help=help_text)
+        download.add_argument('--hosts', type=parse_hosts, help="comma-separated SBCs (default all)")
+        download.add_argument('--out', default='.', help="directory for the files (default current)")
+        download.add_argument('--wait', type=float, default=None, help="seconds to wait for the SBC rate limit")
+        download.set_defaults(func=sbc_download, name=f'sbc {kind}')
+
+    schedule_import = commands.add_parser('import-schedules', help="bulk-create schedules from CSV or JSON")
+    schedule_import.add_argument('file', help="CSV (user_id,scheduled_datetime) or JSON file, - for stdin")
+    schedule_import.add_argument('--allow-conflicts', action='store_true', help="only flag rows close to other handovers")
+    schedule_import.add_argument('--dry-run', action='store_true', help="check the rows without creating anything")
+    schedule_import.set_defaults(func=import_schedules, name='import-schedules')
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        stream=sys.stderr,
+    )
+    if args.concurrency is not None:
+        sbcutils.set_concurrency(max(args.concurrency, 1))
+
+    started = time.perf_counter()
+    # Older SBC client and scheduler code still prints progress; keep stdout for the JSON
+    with redirect_stdout(sys.stderr):
+        output, ok = args.func(args)
+    output = dict({'command': args.name, 'ok': ok, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)}, **output)
+    json.dump(output, sys.stdout, indent=args.indent, default=str)
+    sys.stdout.write("\n")
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
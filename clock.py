@@ -0,0 +1,30 @@
+#clock.py
+
+from contextlib import contextmanager
+from datetime import datetime
+
+# The current time as the scheduler, the email outbox and the SQLite
+# stand-in's GETDATE() see it. Always datetime.now() in the app; the
+# scheduler simulation (benchmarks/sim_scheduler.py) swaps in a simulated
+# clock to replay months of handovers in seconds. On SQL Server GETDATE()
+# stays the server's clock; claim_due_jobs uses it unless given a `now`.
+
+_now = datetime.now
+
+def now():
+    return _now()
+
+def set_clock(func):
+    """Makes func() the current time for now(); None restores datetime.now."""
+    global _now
+    _now = func or datetime.now
+
+@contextmanager
+def frozen(moment):
+    """now() returns moment inside the block."""
+    previous = _now
+    set_clock(lambda: moment)
+    try:
+        yield
+    finally:
+        set_clock(previous)
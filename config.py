@@ -1,27 +1,77 @@
 #config.py
 
+import hashlib
+import logging
 import os
+import threading
+import time
 import yaml
-from dotenv import load_dotenv
-from cryptography.fernet import Fernet
 from io import StringIO  
 
-# Load environment variables from .env file
-load_dotenv()
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Looked up next to this file rather than in the working directory, which is
+# not the app folder under IIS FastCGI. AUDSSONCALL_CONFIG overrides it.
+CONFIG_PATH = os.environ.get('AUDSSONCALL_CONFIG', os.path.join(BASE_DIR, 'config.yaml'))
+
+# Seconds between checks of config.yaml for changes (see ConfigWatcher)
+CHECK_INTERVAL = 2
+
+REQUIRED_KEYS = {
+    'DATABASE': ['DRIVER', 'SERVER', 'DATABASE', 'TRUSTEDCONNECTION'],
+    'SBC': ['SBC_USER', 'SBC_HOSTS'],
+    'MAIL': ['SMTP_SERVER', 'SMTP_PORT', 'TO_PERSON', 'FROM_PERSON', 'EMAIL_SUBJECT'],
+}
 
 #Read Config File
-with open("config.yaml", "r") as f:
-    config = yaml.safe_load(f)
+def load_config_file(path=CONFIG_PATH):
+    with open(path, "r") as f:
+        return validate_config(yaml.safe_load(f))
+
+def validate_config(config):
+    """Raises ValueError listing every problem in a parsed config.yaml; returns it unchanged otherwise."""
+    if not isinstance(config, dict):
+        raise ValueError("config.yaml must contain a mapping")
+    problems = []
+    for section, keys in REQUIRED_KEYS.items():
+        if not isinstance(config.get(section), dict):
+            problems.append(f"missing section {section}")
+            continue
+        problems.extend(f"missing {section}.{key}" for key in keys if key not in config[section])
+    if not problems:
+        hosts = config['SBC']['SBC_HOSTS']
+        if not isinstance(hosts, dict) or not hosts:
+            problems.append("SBC.SBC_HOSTS must map each SBC host to its transformation entry")
+        if not isinstance(config['MAIL']['SMTP_PORT'], int):
+            problems.append("MAIL.SMTP_PORT must be a number")
+        if config['DATABASE'].get('ENGINE', 'mssql') not in ('mssql', 'sqlite'):
+            problems.append("DATABASE.ENGINE must be mssql or sqlite")
+    if problems:
+        raise ValueError("; ".join(problems))
+    return config
+
+# The SBC password is decrypted at most once per process, on first use
+_password_lock = threading.Lock()
+_password_loaded = False
+_password = None
 
 class Config:
+    """
+    One immutable snapshot of config.yaml. Code that needs several values for
+    one operation should take a snapshot with get_config() so a reload cannot
+    change them half way through.
+    """
         
-    def __init__(self):
-        self._password = self._getpassword()
+    def __init__(self, config=None):
+        if config is None:
+            config = load_config_file()
         # # Database Configuration (using pyodbc)
         self.DB_DRIVER = config['DATABASE']['DRIVER']
         self.DB_SERVER = config['DATABASE']['SERVER']
         self.DB_NAME = config['DATABASE']['DATABASE']
         self.DB_TRUSTEDCONNECTION = config['DATABASE']['TRUSTEDCONNECTION']
+        # 'mssql' (default) or 'sqlite' for the local stand-in (see db.py)
+        self.DB_ENGINE = config['DATABASE'].get('ENGINE', 'mssql')
+        self.DB_SQLITE_PATH = config['DATABASE'].get('SQLITE_PATH', 'audssoncall.db')
 
         # # pyodbc connection string
         # SQLALCHEMY_DATABASE_URI = (
@@ -32,9 +82,16 @@ class Config:
         # SBC Configuration
 
         self.SBC_USER = config['SBC']['SBC_USER']
-        #self.SBC_HOSTS = config['SBC']['SBC_HOST']
-        self.SBC_HOSTS = ['pernetgw01.transalta.org', 'parnetgw01.transalta.org']
-        self.SBC_PASS = self.password
+        # host -> REST resource of the on-call transformation entry on that SBC
+        self.SBC_RESOURCES = dict(config['SBC']['SBC_HOSTS'])
+        self.SBC_HOSTS = list(self.SBC_RESOURCES)
+        # Seconds before an SBC REST call is abandoned
+        self.SBC_TIMEOUT = config['SBC'].get('TIMEOUT_SECONDS', 15)
+        # Keep logged-in sessions between calls, re-logging in after this many idle seconds
+        self.SBC_KEEP_SESSIONS = config['SBC'].get('KEEP_SESSIONS', True)
+        self.SBC_SESSION_IDLE = config['SBC'].get('SESSION_IDLE_SECONDS', 240)
+        # 'http' only for local stand-ins (see benchmarks/bench_load.py)
+        self.SBC_SCHEME = config['SBC'].get('SCHEME', 'https')
         # Email Configuration
 
         self.SMTP_SERVER = config['MAIL']['SMTP_SERVER']
@@ -42,19 +99,120 @@ class Config:
         self.TO_PERSON = config['MAIL']['TO_PERSON']
         self.FROM_PERSON = config['MAIL']['FROM_PERSON']
         self.EMAIL_SUBJECT = config['MAIL']['EMAIL_SUBJECT']
+        self.SMTP_STARTTLS = config['MAIL'].get('STARTTLS', True)
+        self.MAIL_TIMEOUT = config['MAIL'].get('TIMEOUT_SECONDS', 30)
+        # Email outbox (see notifications.py)
+        self.MAIL_BATCH_SIZE = config['MAIL'].get('BATCH_SIZE', 20)
+        self.MAIL_POLL_SECONDS = config['MAIL'].get('POLL_SECONDS', 30)
+        self.MAIL_IDLE_SECONDS = config['MAIL'].get('IDLE_SECONDS', 60)
+        self.MAIL_MAX_ATTEMPTS = config['MAIL'].get('MAX_ATTEMPTS', 8)
+        self.MAIL_RETRY_BASE = config['MAIL'].get('RETRY_BASE_SECONDS', 30)
+        self.MAIL_RETRY_MAX = config['MAIL'].get('RETRY_MAX_SECONDS', 3600)
+        self.MAIL_SEND_LEASE = config['MAIL'].get('SEND_LEASE_SECONDS', 300)
+
+        # Scheduler Service Configuration
+        scheduler = config.get('SCHEDULER', {})
+        self.SCHEDULER_ENABLED = scheduler.get('ENABLED', True)
+        self.SCHEDULER_SAFETY_POLL = scheduler.get('SAFETY_POLL_SECONDS', 900)
+        self.SCHEDULER_SIGNAL_INTERVAL = scheduler.get('SIGNAL_CHECK_SECONDS', 5)
+        self.SCHEDULER_RETRY_DELAY = scheduler.get('RETRY_DELAY_SECONDS', 60)
+        self.SCHEDULER_LEASE_SECONDS = scheduler.get('LEASE_SECONDS', 300)
+        # Log in to the SBCs and read them this long before a handover (0 = off)
+        self.SCHEDULER_PRESTAGE_SECONDS = scheduler.get('PRESTAGE_SECONDS', 120)
+
+        # Background on-call update jobs (see jobs.py)
+        jobs = config.get('JOBS', {})
+        self.JOBS_MAX_ATTEMPTS = jobs.get('MAX_ATTEMPTS', 3)
+        self.JOBS_RETRY_DELAY = jobs.get('RETRY_DELAY_SECONDS', 10)
+        self.JOBS_STALE_SECONDS = jobs.get('STALE_SECONDS', 300)
+
+        # Rate limits (see ratelimit.py): per SBC host inside PyRibbonClient,
+        # and per client on the SBC-facing routes, shared by the processes
+        # on this machine
+        rate_limit = config.get('RATE_LIMIT', {})
+        self.RATE_LIMIT_SBC_PER_MINUTE = rate_limit.get('SBC_PER_MINUTE', 30)
+        self.RATE_LIMIT_SBC_BURST = rate_limit.get('SBC_BURST', 10)
+        self.RATE_LIMIT_SBC_MAX_WAIT = rate_limit.get('SBC_MAX_WAIT_SECONDS', 30)
+        self.RATE_LIMIT_CLIENT_PER_MINUTE = rate_limit.get('CLIENT_PER_MINUTE', 30)
+        self.RATE_LIMIT_CLIENT_BURST = rate_limit.get('CLIENT_BURST', 10)
+        # Reverse proxies in front of the app whose X-Forwarded-For is trusted
+        self.RATE_LIMIT_TRUSTED_PROXIES = rate_limit.get('TRUSTED_PROXIES', 0)
+
+        # Dashboard Configuration (GET /api/dashboard)
+        dashboard = config.get('DASHBOARD', {})
+        self.DASHBOARD_TIMEOUT = dashboard.get('TIMEOUT_SECONDS', 8)
+        self.DASHBOARD_STATUS_MAX_AGE = dashboard.get('STATUS_MAX_AGE_SECONDS', 60)
+
+        # Users: numbers without a country code are taken to be in this one
+        users = config.get('USERS', {})
+        self.USERS_DEFAULT_COUNTRY_CODE = users.get('DEFAULT_COUNTRY_CODE', '61')
+        self.USERS_INDEX_TTL = users.get('INDEX_TTL_SECONDS', 60)
+        self.USERS_IMPORT_MAX_ROWS = users.get('IMPORT_MAX_ROWS', 5000)
+
+        # Drift detection between the rota and the SBCs (see reconcile.py)
+        reconcile = config.get('RECONCILE', {})
+        self.RECONCILE_ENABLED = reconcile.get('ENABLED', True)
+        self.RECONCILE_INTERVAL = reconcile.get('INTERVAL_SECONDS', 300)
+        self.RECONCILE_MAX_AGE = reconcile.get('MAX_AGE_SECONDS', 60)
+        self.RECONCILE_SELF_HEAL = reconcile.get('SELF_HEAL', False)
+        self.RECONCILE_REALERT_MINUTES = reconcile.get('REALERT_MINUTES', 60)
+
+        # Coverage report (GET /api/reports/coverage, see reports.py)
+        reports = config.get('REPORTS', {})
+        self.REPORTS_MAX_SHIFT_HOURS = reports.get('MAX_SHIFT_HOURS', 168)
+        self.REPORTS_MIN_HANDOVER_MINUTES = reports.get('MIN_HANDOVER_MINUTES', 60)
+        self.REPORTS_OVERLOAD_FACTOR = reports.get('OVERLOAD_FACTOR', 1.5)
+        self.REPORTS_DEFAULT_DAYS = reports.get('DEFAULT_DAYS', 90)
+
+        # Cache shared by the worker processes on this machine (see sharedcache.py)
+        cache = config.get('CACHE', {})
+        self.CACHE_ENABLED = cache.get('ENABLED', True)
+        self.CACHE_PATH = cache.get('PATH', '.shared_cache.db')
+        self.CACHE_USERS_TTL = cache.get('USERS_TTL_SECONDS', 300)
+
+        # Calendar feed (GET /api/schedule.ics, see ical.py)
+        ical = config.get('ICAL', {})
+        self.ICAL_VERSION_CHECK = ical.get('VERSION_CHECK_SECONDS', 30)
+        self.ICAL_REFRESH_MINUTES = ical.get('REFRESH_MINUTES', 60)
+
+        # Request timing (Server-Timing header, see timing.py)
+        timing = config.get('TIMING', {})
+        self.TIMING_ENABLED = timing.get('ENABLED', True)
+        self.TIMING_SLOW_REQUEST_MS = timing.get('SLOW_REQUEST_MS', 2000)
+
+        # Readiness probes (GET /ready, see health.py)
+        health = config.get('HEALTH', {})
+        self.HEALTH_TIMEOUT = health.get('TIMEOUT_SECONDS', 3)
+        self.HEALTH_CACHE_SECONDS = health.get('CACHE_SECONDS', 5)
+
+        # Production server (serve.py); IIS FastCGI ignores these
+        server = config.get('SERVER', {})
+        self.SERVER_HOST = server.get('HOST', '0.0.0.0')
+        self.SERVER_PORT = server.get('PORT', 8080)
+        self.SERVER_THREADS = server.get('THREADS', 8)
+        self.SERVER_CONNECTION_LIMIT = server.get('CONNECTION_LIMIT', 100)
+        self.SERVER_CHANNEL_TIMEOUT = server.get('CHANNEL_TIMEOUT_SECONDS', 120)
+        self.SERVER_DRAIN_SECONDS = server.get('DRAIN_SECONDS', 30)
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f"Config is read-only; edit config.yaml instead ({name})")
+        super().__setattr__(name, value)
         
     def _decryptFile(self):
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        self.key_path = os.path.join(script_dir, 'filekey.key')
-        self.env_path = os.path.join(script_dir, '.env')
+        # Imported here: cryptography is slow to import and only needed once
+        from cryptography.fernet import Fernet
+        key_path = os.path.join(BASE_DIR, 'filekey.key')
+        env_path = os.path.join(BASE_DIR, '.env')
         # Open the keyfile
         #dir = os.path.dirname(__file__)
         #filekey = os.path.join(dir, 'filekey.key')
         try:
-            with open(self.key_path, 'rb') as file:
+            with open(key_path, 'rb') as file:
                 keyfile = file.read()
             # Open the envfile
-            with open(self.env_path, 'rb') as file:
+            with open(env_path, 'rb') as file:
                 encfile = file.read()
             # Create the decrypt object
             f_enc=Fernet(keyfile)
@@ -67,10 +225,10 @@ class Config:
 
     def _getpassword(self):
         try:
+            from dotenv import dotenv_values
             decode = self._decryptFile().decode(encoding='cp1252')
             strIO = StringIO(decode)
-            load_dotenv(stream=strIO)
-            cred = os.environ.get('cred') 
+            cred = dotenv_values(stream=strIO).get('cred')
             return cred          
         except Exception as e: 
            print("Opening Secure Connection", f"Decrpt Error: {e}" )
@@ -78,8 +236,92 @@ class Config:
            
     @property
     def password(self):
-        return self._password
- 
-cfg = Config() 
-    
+        global _password, _password_loaded
+        if not _password_loaded:
+            with _password_lock:
+                if not _password_loaded:
+                    _password = self._getpassword()
+                    _password_loaded = True
+        return _password
+
+    @property
+    def SBC_PASS(self):
+        return self.password
+
+class ConfigWatcher:
+    """
+    Holds the live Config snapshot and swaps in a new one when config.yaml changes.
+
+    The file's mtime is checked on access, at most every `interval` seconds,
+    and its content hash decides whether anything really changed. A new file
+    is validated before the swap; if it is invalid the error is logged and the
+    previous snapshot stays live. Consumers read cfg on each operation, so the
+    DB layer, SBC client and mailer pick up new values on their next call while
+    work already in progress finishes on the snapshot it started with.
+    """
+
+    def __init__(self, path=CONFIG_PATH, interval=CHECK_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._current = None
+        self._stamp = None
+        self._digest = None
+        self._next_check = 0
+
+    def current(self):
+        if self._current is None or time.monotonic() >= self._next_check:
+            self.check()
+        return self._current
+
+    def check(self):
+        """Reloads config.yaml if it changed. Returns True if a new snapshot was swapped in."""
+        with self._lock:
+            now = time.monotonic()
+            if self._current is not None and now < self._next_check:
+                return False
+            self._next_check = now + self.interval
+            try:
+                stat = os.stat(self.path)
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                if stamp == self._stamp:
+                    return False
+                with open(self.path, 'rb') as f:
+                    raw = f.read()
+                self._stamp = stamp
+                digest = hashlib.sha256(raw).hexdigest()
+                if digest == self._digest:
+                    return False
+                snapshot = Config(validate_config(yaml.safe_load(raw)))
+            except Exception as e:
+                # Without a previous snapshot there is nothing to fall back on
+                if self._current is None:
+                    raise
+                logging.error(f"Ignoring changed {self.path}, keeping previous config: {e}")
+                return False
+            reloaded = self._current is not None
+            self._current = snapshot
+            self._digest = digest
+        if reloaded:
+            logging.info(f"Reloaded configuration from {self.path}")
+        return reloaded
+
+_watcher = ConfigWatcher()
+
+def get_config():
+    """Returns the current Config snapshot, reloading config.yaml if it has changed."""
+    return _watcher.current()
+
+class _LazyConfig:
+    """
+    Forwards attribute reads to the current snapshot, so importing this
+    module does no I/O and every read sees the latest config.yaml.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_config(), name)
+
+    def __dir__(self):
+        return dir(get_config())
 
+cfg = _LazyConfig()
@@ -0,0 +1,184 @@
+#db.py
+
+import logging
+import os
+import sqlite3
+import zlib
+from datetime import datetime
+from config import cfg, get_config
+import clock
+import timing
+
+# Schema for the SQLite stand-in (DATABASE.ENGINE: sqlite in config.yaml), used
+# for local development and testing without SQL Server. Keep it in step with
+# the scripts in sql/.
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS OnCallUsers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    mobile TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS OnCallSchedules (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL REFERENCES OnCallUsers(id),
+    scheduled_datetime DATETIME NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    claimed_by TEXT NULL,
+    lease_expires DATETIME NULL
+);
+CREATE INDEX IF NOT EXISTS IX_OnCallSchedules_status_due ON OnCallSchedules (status, scheduled_datetime);
+CREATE TABLE IF NOT EXISTS EmailOutbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    to_addr TEXT NOT NULL,
+    cc_addr TEXT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NOT NULL,
+    last_error TEXT NULL,
+    created_at DATETIME NOT NULL DEFAULT (GETDATE()),
+    sent_at DATETIME NULL
+);
+CREATE INDEX IF NOT EXISTS IX_EmailOutbox_status_next ON EmailOutbox (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS OnCallJobs (
+    id TEXT PRIMARY KEY,
+    action TEXT NOT NULL,
+    mobile TEXT NOT NULL,
+    status TEXT NOT NULL,
+    results TEXT NOT NULL,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+CREATE TABLE IF NOT EXISTS OnCallHistory (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    changed_at DATETIME NOT NULL DEFAULT (GETDATE()),
+    host TEXT NOT NULL,
+    number TEXT NOT NULL,
+    source TEXT NOT NULL,
+    schedule_id INTEGER NULL,
+    job_id TEXT NULL,
+    changed_by TEXT NULL
+);
+CREATE INDEX IF NOT EXISTS IX_OnCallHistory_changed_at ON OnCallHistory (changed_at, id);
+CREATE INDEX IF NOT EXISTS IX_OnCallHistory_host_changed_at ON OnCallHistory (host, changed_at, id);
+CREATE TRIGGER IF NOT EXISTS TR_OnCallHistory_NoUpdate BEFORE UPDATE ON OnCallHistory
+BEGIN SELECT RAISE(ABORT, 'OnCallHistory is append-only'); END;
+CREATE TRIGGER IF NOT EXISTS TR_OnCallHistory_NoDelete BEFORE DELETE ON OnCallHistory
+BEGIN SELECT RAISE(ABORT, 'OnCallHistory is append-only'); END;
+CREATE TABLE IF NOT EXISTS ChangeLog (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    changed_at DATETIME NOT NULL DEFAULT (GETDATE()),
+    entity TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    action TEXT NOT NULL
+);
+"""
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+
+def is_sqlite():
+    """True when running against the SQLite stand-in instead of SQL Server."""
+    return cfg.DB_ENGINE == 'sqlite'
+
+def _sqlite_getdate():
+    return clock.now().isoformat(" ")
+
+def _sqlite_checksum(*values):
+    # Stand-in for SQL Server's CHECKSUM(): a signed 32 bit hash of the values
+    return zlib.crc32(repr(values).encode()) - 2 ** 31
+
+class _SqliteChecksumAgg:
+    # Stand-in for SQL Server's CHECKSUM_AGG(): order-independent XOR of the inputs
+    def __init__(self):
+        self.value = 0
+
+    def step(self, value):
+        if value is not None:
+            self.value ^= value
+
+    def finalize(self):
+        return self.value
+
+def _sqlite_connection(conf):
+    path = conf.DB_SQLITE_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    # isolation_level=None gives the same autocommit behaviour as pyodbc below
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                           detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.create_function("GETDATE", 0, _sqlite_getdate)
+    conn.create_function("CHECKSUM", -1, _sqlite_checksum)
+    conn.create_aggregate("CHECKSUM_AGG", 1, _SqliteChecksumAgg)
+    conn.executescript(SQLITE_SCHEMA)
+    return conn
+
+def get_db_connection():
+    """Establishes a connection to the MS SQL database (or the SQLite stand-in)."""
+
+    # One snapshot for the whole connection string, in case config.yaml is
+    # reloaded meanwhile. Pooled connections to an old target simply age out.
+    with timing.span('db.connect'):
+        conn = _connect(get_config())
+    # Time each query too while a request is being traced
+    if conn is not None and timing.active():
+        return timing.TimedConnection(conn)
+    return conn
+
+def _connect(conf):
+    if conf.DB_ENGINE == 'sqlite':
+        try:
+            return _sqlite_connection(conf)
+        except sqlite3.Error as ex:
+            logging.error(f"Database connection error: {ex}")
+            return None
+
+    import pyodbc
+    logging.info(f"Establishing database connection...{conf.DB_SERVER} ")
+    try:
+        conn = pyodbc.connect(
+            f'DRIVER={conf.DB_DRIVER};'
+            f'SERVER={conf.DB_SERVER};'
+            f'DATABASE={conf.DB_NAME};'
+            f'TRUSTED_CONNECTION={conf.DB_TRUSTEDCONNECTION};'
+        )
+        conn.autocommit = True
+        return conn
+    except pyodbc.Error as ex:
+        logging.error(f"Database connection error: {ex}")
+        return None
+
+def schedule_version(cursor):
+    """
+    Cheap fingerprint of the rota: changes whenever a schedule or user is
+    added, removed or edited, or history is appended. Used as a cache key by
+    the reports, so they are only recomputed after a change.
+    """
+    cursor.execute("""
+        SELECT
+            (SELECT COUNT(*) FROM OnCallSchedules),
+            (SELECT CHECKSUM_AGG(CHECKSUM(id, user_id, scheduled_datetime, status)) FROM OnCallSchedules),
+            (SELECT COUNT(*) FROM OnCallUsers),
+            (SELECT CHECKSUM_AGG(CHECKSUM(id, name, mobile)) FROM OnCallUsers),
+            (SELECT MAX(id) FROM OnCallHistory)
+    """)
+    return tuple(cursor.fetchone())
+
+def prewarm():
+    """
+    Opens, uses and closes one connection before the first request, so that
+    request does not pay for loading the driver and logging in (pyodbc keeps
+    the closed connection in its pool). Returns False if the database is down.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return False
+    try:
+        conn.cursor().execute("SELECT 1")
+        return True
+    except Exception as e:
+        logging.error(f"Database pre-warm failed: {e}")
+        return False
+    finally:
+        conn.close()
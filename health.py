@@ -0,0 +1,109 @@
+#health.py
+
+import logging
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from functools import partial
+from config import cfg
+from db import get_db_connection
+from sbcutils import get_sbc_client
+import timing
+
+# Readiness = the database answers SELECT 1, every SBC accepts a TLS
+# connection and the SMTP server answers NOOP. None of the probes logs in to
+# an SBC or sends mail, and the combined result is cached for
+# HEALTH.CACHE_SECONDS so frequent polling barely reaches the dependencies.
+
+_probe_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="health")
+_cache = None  # (monotonic time, report)
+_cache_lock = threading.Lock()
+
+# --- PROBES ---
+def check_db():
+    conn = get_db_connection()
+    if conn is None:
+        raise ConnectionError('Database connection failed')
+    try:
+        conn.cursor().execute("SELECT 1").fetchone()
+    finally:
+        conn.close()
+
+def check_smtp(timeout):
+    if not cfg.SMTP_SERVER:
+        return {'status': 'skipped', 'message': 'SMTP server not configured'}
+    with timing.span('smtp.connect'):
+        smtp = smtplib.SMTP(cfg.SMTP_SERVER, cfg.SMTP_PORT, timeout=timeout)
+    try:
+        with timing.span('smtp.noop'):
+            code, message = smtp.noop()
+        if code != 250:
+            raise smtplib.SMTPResponseException(code, message)
+    finally:
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+
+def _run_check(func):
+    """Runs one probe and returns its entry for the report."""
+    started = time.perf_counter()
+    try:
+        result = func() or {}
+        status = result.pop('status', 'ok')
+        entry = dict(result, status=status)
+    except Exception as e:
+        entry = {'status': 'error', 'error': str(e)}
+    entry['ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return entry
+
+# --- REPORTS ---
+def _probe_all():
+    budget = cfg.HEALTH_TIMEOUT
+    checks = {'database': check_db}
+    for host in cfg.SBC_HOSTS:
+        checks[f'sbc:{host}'] = partial(get_sbc_client().probe, host, budget)
+    checks['smtp'] = partial(check_smtp, budget)
+
+    futures = {name: timing.submit(_probe_pool, _run_check, func) for name, func in checks.items()}
+    done, _ = wait(futures.values(), timeout=budget)
+    results = {}
+    for name, future in futures.items():
+        if future in done:
+            results[name] = future.result()
+        else:
+            results[name] = {'status': 'error', 'error': f'Timed out after {budget}s', 'ms': budget * 1000}
+
+    ready = all(entry['status'] in ('ok', 'skipped') for entry in results.values())
+    report = {'checks': results, 'checked_at': datetime.now().isoformat(timespec='seconds')}
+    if get_sbc_client().draining:
+        # serve.py is shutting down: take this instance out of rotation
+        ready = False
+        report['draining'] = True
+    report['status'] = 'ready' if ready else 'not ready'
+    if not ready:
+        failed = {name: entry.get('error') for name, entry in results.items() if entry['status'] == 'error'}
+        logging.warning(f"Readiness check failed: {failed}")
+    return report
+
+def readiness():
+    """
+    Returns (ready, report). The probes run concurrently within
+    HEALTH.TIMEOUT_SECONDS; the report is reused for HEALTH.CACHE_SECONDS, and
+    requests arriving while a probe is running wait for its result.
+    """
+    global _cache
+    with _cache_lock:
+        now = time.monotonic()
+        if _cache is None or now - _cache[0] >= cfg.HEALTH_CACHE_SECONDS:
+            report = _probe_all()
+            now = time.monotonic()
+            _cache = (now, report)
+        checked, report = _cache
+    return report['status'] == 'ready', dict(report, age=round(now - checked, 1))
+
+def liveness():
+    """The process is up and serving requests; no dependency is contacted."""
+    return {'status': 'ok', 'time': datetime.now().isoformat(timespec='seconds')}
@@ -0,0 +1,135 @@
+#history.py
+
+import csv
+import io
+import json
+import logging
+from db import get_db_connection, is_sqlite
+
+# OnCallHistory is append-only: one row per SBC that confirmed a new on-call
+# number, whoever triggered it. source is 'scheduler', 'manual' (the
+# synchronous update routes), 'job' (background update jobs) or 'reconcile'
+# (drift self-heal, see reconcile.py).
+
+COLUMNS = ('id', 'changed_at', 'host', 'number', 'source', 'schedule_id', 'job_id', 'changed_by')
+EXPORT_BATCH_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+# --- WRITING ---
+def record_changes(results, source, schedule_id=None, job_id=None, changed_by=None, cursor=None):
+    """
+    Appends a history row for every successful result of an SBC update.
+    Never raises: a failure is logged and the update itself stands. Pass the
+    caller's cursor to avoid opening a second DB connection. Returns the
+    number of rows written.
+    """
+    rows = [
+        (result['host'], result['number'], source, schedule_id, job_id, changed_by)
+        for result in results
+        if result.get('status') == 'success' and result.get('number')
+    ]
+    if not rows:
+        return 0
+    conn = None
+    try:
+        if cursor is None:
+            conn = get_db_connection()
+            if conn is None:
+                logging.error(f"Could not record on-call history {rows}: database connection failed")
+                return 0
+            cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO OnCallHistory (host, number, source, schedule_id, job_id, changed_by) VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+        return len(rows)
+    except Exception as e:
+        logging.error(f"Could not record on-call history {rows}: {e}")
+        return 0
+    finally:
+        if conn is not None:
+            conn.close()
+
+# --- READING ---
+def _filters(start, end, host):
+    clauses, params = [], []
+    if start:
+        clauses.append("changed_at >= ?")
+        params.append(start)
+    if end:
+        clauses.append("changed_at < ?")
+        params.append(end)
+    if host:
+        clauses.append("host = ?")
+        params.append(host)
+    return clauses, params
+
+def _as_dict(row):
+    entry = dict(zip(COLUMNS, row))
+    entry['changed_at'] = entry['changed_at'].isoformat(sep=' ', timespec='seconds')
+    return entry
+
+def fetch_page(cursor, start=None, end=None, host=None, before_id=None, limit=100):
+    """
+    One page of history, newest first. Keyset pagination: pass the returned
+    next_before as before_id for the following page, so deep pages cost the
+    same as the first one.
+    """
+    clauses, params = _filters(start, end, host)
+    if before_id is not None:
+        clauses.append("id < ?")
+        params.append(before_id)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    columns = ", ".join(COLUMNS)
+    if is_sqlite():
+        cursor.execute(f"SELECT {columns} FROM OnCallHistory {where} ORDER BY id DESC LIMIT ?", params + [limit])
+    else:
+        cursor.execute(f"SELECT TOP (?) {columns} FROM OnCallHistory {where} ORDER BY id DESC", [limit] + params)
+    items = [_as_dict(row) for row in cursor.fetchall()]
+    next_before = items[-1]['id'] if len(items) == limit else None
+    return {'items': items, 'next_before': next_before}
+
+def _stream(conn, cursor, fmt):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    try:
+        if fmt == 'csv':
+            writer.writerow(COLUMNS)
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                entry = _as_dict(row)
+                if fmt == 'csv':
+                    writer.writerow(entry.values())
+                else:
+                    buffer.write(json.dumps(entry) + "\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        # Also runs when the client disconnects half way
+        conn.close()
+
+def export(fmt, start=None, end=None, host=None):
+    """
+    Returns a generator of CSV or NDJSON chunks covering the whole range,
+    oldest first, or None if the database is unreachable. Rows are fetched
+    EXPORT_BATCH_SIZE at a time from a forward-only cursor, so memory use does
+    not grow with the size of the export.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return None
+    clauses, params = _filters(start, end, host)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {', '.join(COLUMNS)} FROM OnCallHistory {where} ORDER BY id", params)
+    except Exception:
+        conn.close()
+        raise
+    return _stream(conn, cursor, fmt)
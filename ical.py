@@ -0,0 +1,140 @@
+#ical.py
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from config import cfg
+from db import get_db_connection, schedule_version
+
+# The rota as an iCalendar feed (GET /api/schedule.ics) for Outlook and other
+# calendar clients, which poll it. Feeds are rendered once per
+# schedule_version() and kept with their ETag and Last-Modified; the version
+# itself is read at most every ICAL.VERSION_CHECK_SECONDS, so in between a
+# poll is answered from memory, usually with a 304.
+
+CACHE_ENTRIES = 64
+
+_cache = OrderedDict()  # user_id (None for everyone) -> (etag, last_modified, body)
+_lock = threading.Lock()
+_version = None
+_checked = 0.0
+
+def _escape(text):
+    return str(text).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def _fold(line):
+    """Splits a content line into 75-octet pieces (RFC 5545 3.1)."""
+    data = line.encode('utf-8')
+    if len(data) <= 75:
+        return line
+    pieces, start = [], 0
+    while start < len(data):
+        end = min(start + (75 if not pieces else 74), len(data))
+        # Do not cut a UTF-8 sequence in half
+        while end < len(data) and (data[end] & 0xC0) == 0x80:
+            end -= 1
+        pieces.append(data[start:end].decode('utf-8'))
+        start = end
+    return "\r\n ".join(pieces)
+
+def _utc(value):
+    # Schedule times are local to the server (see scheduler_service.py)
+    return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+def render(rows, user_id=None, stamp=None):
+    """
+    iCalendar text for rows of (id, user_id, name, mobile, scheduled_datetime),
+    in time order. Each handover is an event lasting until the next one; the
+    last has no end. With user_id only that user's shifts are included.
+    """
+    stamp = _utc(stamp or datetime.now())
+    name = "AUDSS On-Call"
+    if user_id is not None:
+        names = {row[2] for row in rows if row[1] == user_id}
+        if names:
+            name += f" - {names.pop()}"
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//TransAlta//AUDSSONCALL//EN",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(name)}",
+        f"REFRESH-INTERVAL;VALUE=DURATION:PT{max(int(cfg.ICAL_REFRESH_MINUTES), 1)}M",
+        f"X-PUBLISHED-TTL:PT{max(int(cfg.ICAL_REFRESH_MINUTES), 1)}M",
+    ]
+    for index, (schedule_id, owner, owner_name, mobile, start) in enumerate(rows):
+        if user_id is not None and owner != user_id:
+            continue
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:schedule-{schedule_id}@audssoncall",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{_utc(start)}",
+        ]
+        if index + 1 < len(rows):
+            lines.append(f"DTEND:{_utc(rows[index + 1][4])}")
+        lines += [
+            f"SUMMARY:{_escape(f'AUDSS on call: {owner_name}')}",
+            f"DESCRIPTION:{_escape(f'{owner_name} is on call, mobile {mobile}')}",
+            "TRANSP:TRANSPARENT",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_fold(line) for line in lines) + "\r\n"
+
+def _load(cursor):
+    cursor.execute("""
+        SELECT s.id, s.user_id, u.name, u.mobile, s.scheduled_datetime
+        FROM OnCallSchedules s
+        JOIN OnCallUsers u ON s.user_id = u.id
+        WHERE s.scheduled_datetime >= GETDATE() AND s.status = 'pending'
+        ORDER BY s.scheduled_datetime, s.id
+    """)
+    return [tuple(row) for row in cursor.fetchall()]
+
+def feed(user_id=None):
+    """
+    (etag, last_modified, body) of the feed, from the cache unless the rota
+    changed. If the database is unreachable the last rendering is served;
+    None if there is none.
+    """
+    global _version, _checked
+    with _lock:
+        cached = _cache.get(user_id)
+        if cached is not None and time.monotonic() - _checked < cfg.ICAL_VERSION_CHECK:
+            _cache.move_to_end(user_id)
+            return cached
+
+    conn = get_db_connection()
+    if conn is None:
+        logging.error("Calendar feed: database connection failed, serving the last rendering")
+        return cached
+    try:
+        cursor = conn.cursor()
+        version = schedule_version(cursor)
+        with _lock:
+            if version != _version:
+                _cache.clear()
+                _version = version
+            _checked = time.monotonic()
+            cached = _cache.get(user_id)
+            if cached is not None:
+                return cached
+        rows = _load(cursor)
+    finally:
+        conn.close()
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    body = render(rows, user_id, now)
+    etag = hashlib.sha1(f"{version}:{user_id}".encode()).hexdigest()
+    entry = (etag, now, body)
+    with _lock:
+        if version == _version:
+            _cache[user_id] = entry
+            while len(_cache) > CACHE_ENTRIES:
+                _cache.popitem(last=False)
+    return entry
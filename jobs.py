@@ -0,0 +1,167 @@
+#jobs.py
+
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from config import cfg
+from db import get_db_connection
+from sbcutils import get_sbc_client
+from ratelimit import RateLimited
+import history
+import clock
+
+# Background on-call updates for POST /api/oncall and /api/oncall/update in
+# async mode. Job state lives in OnCallJobs rather than in memory, so
+# GET /api/jobs/<id> works whichever FastCGI worker process answers it.
+#
+# OnCallJobs.status: queued -> running -> completed | partial | failed
+# Each host in 'results' goes pending -> running -> success | error, and
+# failed hosts are retried (JOBS.MAX_ATTEMPTS, JOBS.RETRY_DELAY_SECONDS).
+# The work runs in this process only, so a job whose process was recycled
+# mid-run stops being updated; get_job fails it after JOBS.STALE_SECONDS.
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="oncall-job")
+
+class UpdateJob:
+    """Runs one on-call update across all SBCs and records per-host progress."""
+
+    def __init__(self, job_id, mobile, hosts):
+        self.job_id = job_id
+        self.mobile = mobile
+        self.hosts = list(hosts)
+        self.results = {host: {'host': host, 'status': 'pending', 'attempts': 0} for host in self.hosts}
+        self._lock = threading.Lock()
+
+    def run(self):
+        self._save('running')
+        client = get_sbc_client()
+        remaining = self.hosts
+        for attempt in range(1, cfg.JOBS_MAX_ATTEMPTS + 1):
+            with self._lock:
+                for host in remaining:
+                    self.results[host] = {'host': host, 'status': 'running', 'attempts': attempt}
+            self._save('running')
+            try:
+                client.update_hosts(self.mobile, remaining, on_result=self._host_done)
+            except RateLimited as e:
+                for host in remaining:
+                    self._host_done(host, {'status': 'error', 'message': str(e)})
+            remaining = [host for host in remaining if self.results[host]['status'] != 'success']
+            if not remaining or attempt == cfg.JOBS_MAX_ATTEMPTS:
+                break
+            logging.warning(f"Job {self.job_id}: retrying {remaining} in {cfg.JOBS_RETRY_DELAY}s")
+            time.sleep(cfg.JOBS_RETRY_DELAY)
+
+        if not remaining:
+            status = 'completed'
+        elif len(remaining) < len(self.hosts):
+            status = 'partial'
+        else:
+            status = 'failed'
+        self._save(status)
+        logging.info(f"Job {self.job_id} finished: {status}")
+        return status
+
+    def _host_done(self, host, result):
+        with self._lock:
+            self.results[host].update(result)
+        history.record_changes([dict(result, host=host)], 'job', job_id=self.job_id)
+        self._save('running')
+
+    def _save(self, status):
+        with self._lock:
+            results = json.dumps([self.results[host] for host in self.hosts])
+        conn = get_db_connection()
+        if conn is None:
+            logging.error(f"Job {self.job_id}: could not record status {status}")
+            return
+        try:
+            conn.cursor().execute(
+                "UPDATE OnCallJobs SET status = ?, results = ?, updated_at = ? WHERE id = ?",
+                (status, results, clock.now(), self.job_id)
+            )
+        finally:
+            conn.close()
+
+def _run_job(job):
+    try:
+        job.run()
+    except Exception as e:
+        logging.error(f"Job {job.job_id} crashed: {e}")
+        job._save('failed')
+
+def submit_update(mobile):
+    """
+    Records an on-call update job and queues it. Returns the job id, or None
+    if the job could not be stored.
+    """
+    job = UpdateJob(uuid.uuid4().hex, mobile, cfg.SBC_HOSTS)
+    conn = get_db_connection()
+    if conn is None:
+        return None
+    try:
+        now = clock.now()
+        conn.cursor().execute(
+            "INSERT INTO OnCallJobs (id, action, mobile, status, results, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job.job_id, 'update', mobile, 'queued', json.dumps(list(job.results.values())), now, now)
+        )
+    except Exception as e:
+        logging.error(f"Could not record on-call update job for {mobile}: {e}")
+        return None
+    finally:
+        conn.close()
+    _executor.submit(_run_job, job)
+    logging.info(f"Queued on-call update job {job.job_id} for {mobile}")
+    return job.job_id
+
+def _abandon(cursor, job_id, results, cutoff):
+    """
+    Fails a job whose process went away before finishing it: unfinished
+    hosts become errors. Returns (status, results, updated_at), or None if
+    the job was updated in the meantime after all.
+    """
+    for result in results:
+        if result['status'] not in ('success', 'error'):
+            result.update(status='error', message='Job was interrupted (worker process stopped)')
+    status = 'partial' if any(result['status'] == 'success' for result in results) else 'failed'
+    now = clock.now()
+    cursor.execute(
+        "UPDATE OnCallJobs SET status = ?, results = ?, updated_at = ? "
+        "WHERE id = ? AND status IN ('queued', 'running') AND updated_at < ?",
+        (status, json.dumps(results), now, job_id, cutoff)
+    )
+    if cursor.rowcount != 1:
+        return None
+    logging.warning(f"Job {job_id} stopped being updated, marked {status}")
+    return status, results, now
+
+def get_job(job_id):
+    """Returns the job as a dict, or None if there is no such job."""
+    conn = get_db_connection()
+    if conn is None:
+        raise ConnectionError('Database connection failed')
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, action, mobile, status, results, created_at, updated_at FROM OnCallJobs WHERE id = ?",
+            (job_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        status, results, updated_at = row[3], json.loads(row[4]), row[6]
+        cutoff = clock.now() - timedelta(seconds=cfg.JOBS_STALE_SECONDS)
+        if status in ('queued', 'running') and updated_at < cutoff:
+            status, results, updated_at = _abandon(cursor, job_id, results, cutoff) or (status, results, updated_at)
+    finally:
+        conn.close()
+    return {
+        'id': row[0], 'action': row[1], 'mobile': row[2], 'status': status,
+        'results': results,
+        'done': status in ('completed', 'partial', 'failed'),
+        'created_at': row[5].isoformat(), 'updated_at': updated_at.isoformat(),
+    }
@@ -0,0 +1,296 @@
+#notifications.py
+
+import logging
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+from config import cfg, get_config
+from db import get_db_connection, is_sqlite
+import timing
+
+# EmailOutbox.status values: pending -> sending -> sent, or back to pending
+# with a later next_attempt_at on failure, or dead once MAX_ATTEMPTS is hit.
+# A 'sending' row whose next_attempt_at has passed belongs to a sender that
+# died mid-batch and is picked up again.
+
+# --- MESSAGE BUILDERS ---
+def notify_schedule_created(user_name, mobile, scheduled_date, cursor=None):
+    """Queues the email for a newly created schedule."""
+    body = (
+        f"A new on-call schedule has been created:\n\n"
+        f"User: {user_name}\n"
+        f"Mobile: {mobile}\n"
+        f"Date: {scheduled_date.strftime('%Y-%m-%d %H:%M')}\n"
+    )
+    return enqueue_email(user_name + "@transalta.com", 'New On-Call Schedule Created', body, cursor=cursor)
+
+def notify_oncall_started(user_name, mobile, scheduled_date, cursor=None):
+    """Queues the email sent when a schedule has been executed."""
+    body = (
+        f"Hi you have been set as AUDSS on-call :\n\n"
+        f"User: {user_name}\n"
+        f"Mobile: {mobile}\n"
+        f"Start of on Call Date: {scheduled_date.strftime('%Y-%m-%d %H:%M')}\n"
+    )
+    return enqueue_email(user_name + "@transalta.com", 'You are on Call for AUDSS', body,
+                         cc=cfg.TO_PERSON, cursor=cursor)
+
+# --- OUTBOX ---
+def already_queued(cursor, subject, body, since):
+    """True if the same message was queued after since (by any worker process)."""
+    cursor.execute(
+        "SELECT COUNT(*) FROM EmailOutbox WHERE subject = ? AND body = ? AND created_at >= ?",
+        (subject, body, since)
+    )
+    return cursor.fetchone()[0] > 0
+
+def enqueue_email(to, subject, body, cc=None, cursor=None):
+    """
+    Adds a message to the outbox. Returns False if it could not be stored.
+    Pass the caller's cursor to avoid opening a second DB connection.
+    """
+    if not cfg.SMTP_SERVER:
+        logging.warning("SMTP server not configured. Skipping email notification.")
+        return False
+
+    conn = None
+    try:
+        if cursor is None:
+            conn = get_db_connection()
+            if conn is None:
+                logging.error(f"Could not queue email to {to}: database connection failed")
+                return False
+            cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO EmailOutbox (to_addr, cc_addr, subject, body, next_attempt_at) VALUES (?, ?, ?, ?, GETDATE())",
+            (to, cc, subject, body)
+        )
+        logging.info(f"Queued email to {to}: {subject}")
+    except Exception as e:
+        logging.error(f"Could not queue email to {to}: {e}")
+        return False
+    finally:
+        if conn is not None:
+            conn.close()
+    _sender.wake()
+    return True
+
+def db_time_after(seconds, now=None):
+    """SQL for GETDATE() (or the bound `now`) plus seconds, and its parameters."""
+    current, now_params = ("GETDATE()", []) if now is None else ("?", [now])
+    if is_sqlite():
+        # No DATEADD in SQLite; keep the stand-in's 'YYYY-MM-DD HH:MM:SS.fff' text format
+        return f"strftime('%Y-%m-%d %H:%M:%f', {current}, ?)", now_params + [f"+{seconds} seconds"]
+    return f"DATEADD(second, ?, {current})", [int(seconds)] + now_params
+
+def claim_batch(cursor, batch_size, now=None):
+    """
+    Atomically marks up to batch_size due messages as 'sending' and returns them.
+
+    Due times and the sending lease are judged on the database's GETDATE(),
+    as in claim_due_jobs, so a sender on a server whose clock runs ahead
+    does not take over messages another server is still sending. Pass
+    `now` only to override it.
+    """
+    current, now_params = ("GETDATE()", []) if now is None else ("?", [now])
+    lease, lease_params = db_time_after(cfg.MAIL_SEND_LEASE, now)
+    due = f"(status = 'pending' OR status = 'sending') AND next_attempt_at <= {current}"
+    if is_sqlite():
+        cursor.execute(f"""
+            UPDATE EmailOutbox SET status = 'sending', next_attempt_at = {lease}
+            WHERE id IN (SELECT id FROM EmailOutbox WHERE {due} ORDER BY id LIMIT ?)
+            RETURNING id, to_addr, cc_addr, subject, body, attempts
+        """, lease_params + now_params + [batch_size])
+    else:
+        cursor.execute(f"""
+            UPDATE TOP (?) EmailOutbox SET status = 'sending', next_attempt_at = {lease}
+            OUTPUT inserted.id, inserted.to_addr, inserted.cc_addr, inserted.subject, inserted.body, inserted.attempts
+            WHERE {due}
+        """, [batch_size] + lease_params + now_params)
+    return cursor.fetchall()
+
+def backoff_delay(attempts):
+    """Seconds to wait before retry number `attempts` (exponential, capped)."""
+    return min(cfg.MAIL_RETRY_BASE * (2 ** (attempts - 1)), cfg.MAIL_RETRY_MAX)
+
+class OutboxSender:
+    """
+    Drains EmailOutbox in the background over one reused SMTP connection.
+
+    Messages are claimed in batches, so several processes can run a sender.
+    The connection is kept open while there is work and closed after
+    MAIL.IDLE_SECONDS without any. Failed messages are retried with
+    exponential backoff and dead-lettered after MAIL.MAX_ATTEMPTS.
+    """
+
+    def __init__(self):
+        self._smtp = None
+        self._smtp_target = None
+        self._smtp_used = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="email-outbox", daemon=True)
+        self._thread.start()
+        logging.info("Email outbox sender started")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def flush(self):
+        """Sends everything currently due, then closes the connection. Returns the number sent."""
+        sent = 0
+        while True:
+            batch_sent, claimed = self.drain_batch()
+            sent += batch_sent
+            if claimed < cfg.MAIL_BATCH_SIZE:
+                break
+        self._disconnect()
+        return sent
+
+    def drain_batch(self):
+        """Claims and sends one batch. Returns (sent, claimed)."""
+        with self._lock:
+            conn = get_db_connection()
+            if conn is None:
+                return 0, 0
+            try:
+                cursor = conn.cursor()
+                batch = claim_batch(cursor, cfg.MAIL_BATCH_SIZE)
+                if not batch:
+                    return 0, 0
+                sent = 0
+                for message_id, to, cc, subject, body, attempts in batch:
+                    try:
+                        self._send(to, cc, subject, body)
+                    except Exception as e:
+                        # After a timeout, TLS error or error mid-DATA the
+                        # session is out of step; only a refused recipient
+                        # leaves it usable for the rest of the batch
+                        if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                            self._disconnect(broken=True)
+                        self._record_failure(cursor, message_id, attempts + 1, e)
+                        continue
+                    # Recorded per message: if the batch fails later on, a
+                    # delivered message must not be left 'sending' and be
+                    # mailed again when its lease runs out
+                    cursor.execute(
+                        "UPDATE EmailOutbox SET status = 'sent', sent_at = GETDATE(), attempts = attempts + 1 WHERE id = ?",
+                        (message_id,)
+                    )
+                    sent += 1
+                if sent:
+                    logging.info(f"Sent {sent} queued email(s)")
+                return sent, len(batch)
+            except Exception as e:
+                logging.error(f"Email outbox drain failed: {e}")
+                return 0, 0
+            finally:
+                conn.close()
+
+    def _record_failure(self, cursor, message_id, attempts, error):
+        if attempts >= cfg.MAIL_MAX_ATTEMPTS:
+            logging.error(f"Email {message_id} dead-lettered after {attempts} attempts: {error}")
+            cursor.execute(
+                "UPDATE EmailOutbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                (attempts, str(error)[:500], message_id)
+            )
+        else:
+            delay = backoff_delay(attempts)
+            retry_at, retry_params = db_time_after(delay)
+            logging.warning(f"Email {message_id} failed (attempt {attempts}), retrying in {delay}s: {error}")
+            cursor.execute(
+                f"UPDATE EmailOutbox SET status = 'pending', attempts = ?, last_error = ?, next_attempt_at = {retry_at} WHERE id = ?",
+                [attempts, str(error)[:500]] + retry_params + [message_id]
+            )
+
+    def _send(self, to, cc, subject, body):
+        msg = EmailMessage()
+        msg.set_content(body)
+        msg['Subject'] = subject
+        msg['From'] = cfg.FROM_PERSON
+        msg['To'] = to
+        if cc:
+            msg['Cc'] = cc
+        logging.info(f"Emailing {to}")
+        try:
+            with timing.span('smtp.send', to):
+                self._connection().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped the idle connection; reconnect once
+            self._disconnect(broken=True)
+            with timing.span('smtp.send', to):
+                self._connection().send_message(msg)
+        self._smtp_used = time.monotonic()
+
+    def _connection(self):
+        conf = get_config()
+        target = (conf.SMTP_SERVER, conf.SMTP_PORT, conf.SMTP_STARTTLS)
+        # After a config reload the old connection is closed between messages
+        if self._smtp is not None and self._smtp_target != target:
+            logging.info(f"SMTP settings changed, reconnecting to {conf.SMTP_SERVER}:{conf.SMTP_PORT}")
+            self._disconnect()
+        if self._smtp is None:
+            with timing.span('smtp.connect'):
+                smtp = smtplib.SMTP(conf.SMTP_SERVER, conf.SMTP_PORT, timeout=conf.MAIL_TIMEOUT)
+                if conf.SMTP_STARTTLS:
+                    smtp.starttls()
+            self._smtp = smtp
+            self._smtp_target = target
+        return self._smtp
+
+    def _disconnect(self, broken=False):
+        """Closes the connection; a broken one is dropped without QUIT, which could block until the timeout."""
+        if self._smtp is not None:
+            try:
+                if broken:
+                    self._smtp.close()
+                else:
+                    self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            sent, claimed = self.drain_batch()
+            if claimed >= cfg.MAIL_BATCH_SIZE:
+                continue
+            if self._smtp is not None and time.monotonic() - self._smtp_used >= cfg.MAIL_IDLE_SECONDS:
+                with self._lock:
+                    self._disconnect()
+            # Woken straight away by enqueue_email in this process; the poll
+            # picks up retries and messages queued by other processes.
+            timeout = cfg.MAIL_POLL_SECONDS
+            if self._smtp is not None:
+                timeout = min(timeout, cfg.MAIL_IDLE_SECONDS)
+            self._wake.wait(timeout)
+            self._wake.clear()
+        with self._lock:
+            self._disconnect()
+
+_sender = OutboxSender()
+
+def start():
+    """Starts the process-wide background sender."""
+    _sender.start()
+
+def stop(timeout=None):
+    _sender.stop(timeout)
+
+def flush():
+    """Sends all due messages synchronously (used by the standalone scheduler)."""
+    return _sender.flush()
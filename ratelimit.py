@@ -0,0 +1,175 @@
+#ratelimit.py
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from config import cfg
+import sharedcache
+
+class RateLimited(Exception):
+    """Raised when a call is refused because its token bucket is empty."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens and refills at `rate`
+    tokens per second. Each call takes one token.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def configure(self, rate, capacity):
+        """Applies new limits (after a config reload) without resetting the tokens."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.capacity = capacity
+            self._tokens = min(self._tokens, capacity)
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Takes a token. Returns 0 on success, otherwise the seconds until one is available."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate if self.rate > 0 else math.inf
+
+    def acquire(self, timeout=0):
+        """Like try_acquire, but waits up to timeout seconds for a token."""
+        deadline = time.monotonic() + timeout
+        while True:
+            retry_after = self.try_acquire()
+            remaining = deadline - time.monotonic()
+            if not retry_after or retry_after > remaining:
+                return retry_after
+            time.sleep(retry_after)
+
+    def refund(self):
+        """Gives back a token taken for a call that did not go ahead."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+class SharedTokenBucket(TokenBucket):
+    """
+    A TokenBucket kept in the shared cache (sharedcache.take_token), so the
+    IIS worker processes, the scheduler daemon and the CLI on this machine
+    all draw from the same tokens. Falls back to the tokens in this process
+    while the cache file cannot be used.
+    """
+
+    def __init__(self, key, rate, capacity):
+        super().__init__(rate, capacity)
+        self.key = key
+
+    def try_acquire(self):
+        retry_after = sharedcache.take_token(self.key, self.rate, self.capacity)
+        if retry_after is None:
+            return super().try_acquire()
+        return retry_after
+
+    def refund(self):
+        if not sharedcache.refund_token(self.key, self.capacity):
+            super().refund()
+
+class KeyedLimiter:
+    """
+    One TokenBucket per key (e.g. client address), keeping at most max_keys of
+    them. With a namespace the buckets are SharedTokenBucket, keyed
+    '<namespace>:<key>' in the shared cache.
+    """
+
+    def __init__(self, max_keys=10000, namespace=None):
+        self.max_keys = max_keys
+        self.namespace = namespace
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _new_bucket(self, key, rate, capacity):
+        if self.namespace is None:
+            return TokenBucket(rate, capacity)
+        parts = key if isinstance(key, tuple) else (key,)
+        return SharedTokenBucket(":".join(str(part) for part in (self.namespace,) + parts), rate, capacity)
+
+    def bucket(self, key, rate, capacity):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._new_bucket(key, rate, capacity)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        if (bucket.rate, bucket.capacity) != (rate, capacity):
+            bucket.configure(rate, capacity)
+        return bucket
+
+_client_limiter = KeyedLimiter(namespace='client')
+
+def too_many_requests(retry_after, message='Too many requests, please retry later.'):
+    # Flask is imported here so the SBC client can use the buckets without it
+    from flask import jsonify
+    retry_after = max(1, math.ceil(retry_after))
+    response = jsonify({'status': 'error', 'message': message, 'retry_after': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def client_id(request):
+    """
+    Who a request is from, for the per-client limits: the user IIS
+    authenticated, else the address the front proxy forwarded (with
+    RATE_LIMIT.TRUSTED_PROXIES set), else the connecting address. Behind a
+    proxy the connecting address is the proxy's, the same for every user.
+    """
+    user = request.remote_user or request.environ.get('AUTH_USER') or request.environ.get('LOGON_USER')
+    if user:
+        return f"user:{user.lower()}"
+    hops = cfg.RATE_LIMIT_TRUSTED_PROXIES
+    if hops:
+        # Each proxy appends the address it received from; anything further
+        # left was supplied by the client and cannot be trusted
+        forwarded = [address.strip() for address in request.headers.get('X-Forwarded-For', '').split(',')]
+        forwarded = [address for address in forwarded if address]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.remote_addr
+
+def limit_per_client(fallback=None):
+    """
+    Route decorator applying RATE_LIMIT.CLIENT_PER_MINUTE / CLIENT_BURST per
+    client (see client_id). A request over the limit gets 429 with Retry-After,
+    unless fallback() returns a response to serve instead (it may return None
+    to decline).
+    """
+    from flask import request
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            bucket = _client_limiter.bucket(
+                (view.__name__, client_id(request)),
+                cfg.RATE_LIMIT_CLIENT_PER_MINUTE / 60.0,
+                cfg.RATE_LIMIT_CLIENT_BURST
+            )
+            retry_after = bucket.try_acquire()
+            if retry_after:
+                response = fallback() if fallback else None
+                return response if response is not None else too_many_requests(retry_after)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
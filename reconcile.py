@@ -0,0 +1,166 @@
+#reconcile.py
+
+import logging
+import threading
+from datetime import timedelta
+from config import cfg
+from db import get_db_connection, is_sqlite
+from sbcutils import get_sbc_client
+from ratelimit import RateLimited
+import history
+import notifications
+import clock
+from users import same_number
+
+# Drift detection: compares the number every SBC holds with the one the rota
+# says should be on call, every RECONCILE.INTERVAL_SECONDS.
+#
+# The expected number is the mobile of the user in the latest completed
+# schedule, unless a manual or job update (OnCallHistory) came after it. The
+# SBCs are read with the ordinary status check - a GET over the client's
+# kept-alive session, reusing a result up to RECONCILE.MAX_AGE_SECONDS old -
+# so checking adds at most one read per SBC per interval. A mismatch is
+# emailed (the same alert at most once per REALERT_MINUTES, across all
+# worker processes) and, with SELF_HEAL, the expected number is pushed back.
+
+ALERT_SUBJECT = 'AUDSSONCALL: SBC on-call number drift detected'
+
+def expected_number(cursor):
+    """
+    The number that should be on call now, as {'number', 'source', 'since',
+    'schedule_id'}, or None if no schedule has completed yet. Returns
+    {'busy': True} while a handover is in progress.
+    """
+    cursor.execute("SELECT COUNT(*) FROM OnCallSchedules WHERE status = 'in_progress'")
+    if cursor.fetchone()[0]:
+        return {'busy': True}
+
+    top, limit = ("TOP 1", "") if not is_sqlite() else ("", "LIMIT 1")
+    cursor.execute(f"""
+        SELECT {top} s.id, s.scheduled_datetime, u.mobile
+        FROM OnCallSchedules s
+        JOIN OnCallUsers u ON s.user_id = u.id
+        WHERE s.status = 'completed'
+        ORDER BY s.scheduled_datetime DESC, s.id DESC {limit}
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    expected = {'number': row[2], 'source': 'schedule', 'since': row[1], 'schedule_id': row[0]}
+
+    # A manual change made after the handover overrides the rota until the next one
+    cursor.execute(f"""
+        SELECT {top} number, changed_at FROM OnCallHistory
+        WHERE source NOT IN ('scheduler', 'reconcile') AND changed_at > ?
+        ORDER BY id DESC {limit}
+    """, (row[1],))
+    override = cursor.fetchone()
+    if override is not None:
+        expected.update({'number': override[0], 'source': 'manual', 'since': override[1]})
+    return expected
+
+def _alert(cursor, expected, drifted):
+    lines = [f"{result['host']}: holds {result['actual']}, expected {expected['number']}" for result in drifted]
+    body = (
+        "The on-call number on these SBCs does not match the rota:\n\n"
+        + "\n".join(lines)
+        + f"\n\nExpected number set by {expected['source']} at {expected['since']:%Y-%m-%d %H:%M}.\n"
+    )
+    since = clock.now() - timedelta(minutes=cfg.RECONCILE_REALERT_MINUTES)
+    if notifications.already_queued(cursor, ALERT_SUBJECT, body, since):
+        logging.info("Drift alert already sent recently, not repeating it")
+        return False
+    return notifications.enqueue_email(cfg.TO_PERSON, ALERT_SUBJECT, body, cursor=cursor)
+
+def reconcile(heal=None):
+    """
+    Runs one drift check and returns its report. heal overrides
+    RECONCILE.SELF_HEAL.
+    """
+    heal = cfg.RECONCILE_SELF_HEAL if heal is None else heal
+    report = {'checked_at': clock.now().isoformat(timespec='seconds'), 'drift': False, 'hosts': []}
+    conn = get_db_connection()
+    if conn is None:
+        report['error'] = 'Database connection failed'
+        return report
+    try:
+        cursor = conn.cursor()
+        expected = expected_number(cursor)
+        if expected is None or expected.get('busy'):
+            report['skipped'] = 'handover in progress' if expected else 'no completed schedule yet'
+            return report
+        report['expected'] = dict(expected, since=expected['since'].isoformat(sep=' ', timespec='seconds'))
+
+        client = get_sbc_client()
+        for result in client.cached_status(cfg.RECONCILE_MAX_AGE):
+            entry = {'host': result['host'], 'actual': result.get('number')}
+            if result.get('status') != 'success' or result.get('stale'):
+                # Unreachable or rate limited: nothing to compare against this time
+                entry.update(status='unknown', message=result.get('message', 'stale status'))
+            elif same_number(entry['actual'], expected['number']):
+                entry['status'] = 'ok'
+            else:
+                entry['status'] = 'drift'
+            report['hosts'].append(entry)
+
+        drifted = [entry for entry in report['hosts'] if entry['status'] == 'drift']
+        if not drifted:
+            return report
+        report['drift'] = True
+        logging.warning(f"On-call drift detected, expected {expected['number']}: {drifted}")
+        report['alerted'] = _alert(cursor, expected, drifted)
+
+        if heal:
+            hosts = [entry['host'] for entry in drifted]
+            try:
+                results = client.update_hosts(expected['number'], hosts, wait=0)
+            except RateLimited as e:
+                report['healed'] = []
+                report['heal_error'] = str(e)
+                return report
+            history.record_changes(results, 'reconcile', changed_by='reconcile', cursor=cursor)
+            report['healed'] = [result['host'] for result in results if result.get('status') == 'success']
+            logging.info(f"Drift self-heal restored {expected['number']} on {report['healed']}")
+        return report
+    except Exception as e:
+        logging.error(f"Drift check failed: {e}")
+        report['error'] = str(e)
+        return report
+    finally:
+        conn.close()
+
+class DriftMonitor:
+    """Runs reconcile() every RECONCILE.INTERVAL_SECONDS on a background thread."""
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_report = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="drift-monitor", daemon=True)
+        self._thread.start()
+        logging.info(f"Drift monitor started (every {cfg.RECONCILE_INTERVAL}s)")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(cfg.RECONCILE_INTERVAL):
+            self.last_report = reconcile()
+
+_monitor = DriftMonitor()
+
+def start():
+    _monitor.start()
+
+def stop(timeout=None):
+    _monitor.stop(timeout)
+
+def last_report():
+    return _monitor.last_report
@@ -0,0 +1,173 @@
+#reports.py
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from config import cfg
+from db import schedule_version
+
+# The SBCs carry a single on-call entry, so the rota is a sequence of
+# handovers: each schedule puts its user on call until the next one. From
+# that the report derives
+#   intervals - who is on call when (capped at REPORTS.MAX_SHIFT_HOURS)
+#   gaps      - stretches past the cap, or before the first handover
+#   overlaps  - handovers closer than REPORTS.MIN_HANDOVER_MINUTES
+#   users     - on-call hours per user, flagged above OVERLOAD_FACTOR x fair share
+#   actual    - hours per number on each SBC, from OnCallHistory
+# Skipped and failed schedules never took effect and are left out.
+
+ACTIVE_STATUSES = ('pending', 'in_progress', 'completed')
+COLUMNS = ['kind', 'id', 'at', 'user_id', 'name', 'mobile', 'status', 'host']
+
+_cache = OrderedDict()  # (version, start, end) -> report
+_cache_lock = threading.Lock()
+CACHE_ENTRIES = 32
+
+def load_frame(cursor, end):
+    """Schedules and history up to `end` in one query, as one DataFrame (kind = 'schedule' or 'history')."""
+    # pandas is only needed here; importing it lazily keeps it off the app's startup path
+    import pandas as pd
+    cursor.execute("""
+        SELECT 'schedule', s.id, s.scheduled_datetime, s.user_id, u.name, u.mobile, s.status, NULL
+        FROM OnCallSchedules s
+        JOIN OnCallUsers u ON s.user_id = u.id
+        WHERE s.scheduled_datetime < ?
+        UNION ALL
+        SELECT 'history', h.id, h.changed_at, NULL, NULL, h.number, h.source, h.host
+        FROM OnCallHistory h
+        WHERE h.changed_at < ?
+    """, (end, end))
+    frame = pd.DataFrame.from_records([tuple(row) for row in cursor.fetchall()], columns=COLUMNS)
+    frame['at'] = pd.to_datetime(frame['at'])
+    return frame
+
+def _iso(value):
+    return value.isoformat(sep=' ', timespec='minutes')
+
+def _records(frame, columns):
+    """DataFrame -> list of JSON-ready dicts."""
+    out = frame[columns].copy()
+    for column in columns:
+        if str(out[column].dtype).startswith('datetime64'):
+            out[column] = out[column].map(_iso)
+        elif out[column].dtype.kind == 'f':
+            out[column] = out[column].round(2)
+    return out.astype(object).where(out.notna(), None).to_dict('records')
+
+def compute(frame, start, end):
+    """Builds the coverage report for [start, end) from load_frame() output."""
+    import pandas as pd
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    max_shift = pd.Timedelta(hours=cfg.REPORTS_MAX_SHIFT_HOURS)
+    min_handover = pd.Timedelta(minutes=cfg.REPORTS_MIN_HANDOVER_MINUTES)
+    window_hours = (end - start) / pd.Timedelta(hours=1)
+
+    schedules = frame[(frame['kind'] == 'schedule') & frame['status'].isin(ACTIVE_STATUSES)]
+    # user_id is only nullable because of the history rows
+    schedules = schedules.astype({'id': 'int64', 'user_id': 'int64'}).sort_values(['at', 'id']).reset_index(drop=True)
+    next_at = schedules['at'].shift(-1)
+
+    # Overlaps: a handover followed too closely by the next one
+    apart = next_at - schedules['at']
+    close = apart < min_handover
+    overlaps = pd.DataFrame({
+        'schedule_id': schedules['id'][close],
+        'next_schedule_id': schedules['id'].shift(-1).astype('Int64')[close],
+        'at': schedules['at'][close],
+        'minutes_apart': apart[close] / pd.Timedelta(minutes=1),
+    })
+    overlaps = overlaps[(overlaps['at'] >= start) & (overlaps['at'] < end)]
+
+    # Intervals: on call from the handover until the next one, capped at max_shift
+    handover_end = next_at.fillna(end)
+    covered_end = handover_end.where(handover_end - schedules['at'] <= max_shift, schedules['at'] + max_shift)
+    intervals = schedules.assign(
+        start=schedules['at'].clip(lower=start),
+        end=covered_end.clip(upper=end),
+    )
+    intervals = intervals[intervals['end'] > intervals['start']]
+    intervals = intervals.assign(hours=(intervals['end'] - intervals['start']) / pd.Timedelta(hours=1))
+
+    # Gaps: after a capped shift until the next handover, and before the first handover
+    gaps = pd.DataFrame({
+        'after_schedule_id': schedules['id'].astype(object),
+        'start': covered_end.clip(lower=start),
+        'end': handover_end.clip(upper=end),
+    })
+    first = schedules['at'].min() if len(schedules) else end
+    if first > start:
+        leading = pd.DataFrame({'after_schedule_id': [None], 'start': [start], 'end': [min(first, end)]})
+        gaps = pd.concat([leading, gaps], ignore_index=True)
+    gaps = gaps[gaps['end'] > gaps['start']]
+    gaps = gaps.assign(hours=(gaps['end'] - gaps['start']) / pd.Timedelta(hours=1))
+
+    # Per-user load
+    users = intervals.groupby(['user_id', 'name'], as_index=False).agg(
+        hours=('hours', 'sum'), shifts=('id', 'count'))
+    total_hours = users['hours'].sum()
+    users['weeks'] = users['hours'] / 168
+    users['share'] = users['hours'] / total_hours if total_hours else 0.0
+    fair_share = 1 / len(users) if len(users) else 0
+    users['overloaded'] = users['share'] > fair_share * cfg.REPORTS_OVERLOAD_FACTOR
+    users = users.sort_values('hours', ascending=False)
+
+    # What the SBCs actually held, per host, from the change history
+    changes = frame[frame['kind'] == 'history'].sort_values(['host', 'at', 'id'])
+    changes = changes.assign(until=changes.groupby('host')['at'].shift(-1).fillna(end))
+    changes = changes.assign(from_=changes['at'].clip(lower=start), until=changes['until'].clip(upper=end))
+    changes = changes[changes['until'] > changes['from_']]
+    actual = changes.assign(hours=(changes['until'] - changes['from_']) / pd.Timedelta(hours=1)) \
+        .groupby(['host', 'mobile'], as_index=False)['hours'].sum() \
+        .rename(columns={'mobile': 'number'})
+
+    covered_hours = intervals['hours'].sum()
+    return {
+        'window': {'from': _iso(start), 'to': _iso(end), 'hours': round(window_hours, 2)},
+        'coverage_pct': round(100 * covered_hours / window_hours, 2) if window_hours else None,
+        'intervals': _records(intervals.rename(columns={'id': 'schedule_id'}),
+                              ['schedule_id', 'user_id', 'name', 'status', 'start', 'end', 'hours']),
+        'gaps': _records(gaps, ['after_schedule_id', 'start', 'end', 'hours']),
+        'overlaps': _records(overlaps, ['schedule_id', 'next_schedule_id', 'at', 'minutes_apart']),
+        'users': _records(users, ['user_id', 'name', 'hours', 'weeks', 'shifts', 'share', 'overloaded']),
+        'actual': _records(actual, ['host', 'number', 'hours']),
+    }
+
+def report_window(start=None, end=None):
+    """
+    Fills in a missing bound: REPORTS.DEFAULT_DAYS either side of now, or,
+    when that would not leave a window after `start` (before `end`),
+    DEFAULT_DAYS from the bound that was given. Raises ValueError if start
+    is not before end.
+    """
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    days = timedelta(days=cfg.REPORTS_DEFAULT_DAYS)
+    if start is None and end is None:
+        start, end = now - days, now + days
+    elif end is None:
+        end = max(now + days, start + days)
+    elif start is None:
+        start = min(now - days, end - days)
+    if start >= end:
+        raise ValueError("'from' must be before 'to'")
+    return start, end
+
+def coverage_report(cursor, start=None, end=None):
+    """
+    Coverage for [start, end) (see report_window for the defaults). Reports
+    are cached per window and recomputed only when schedule_version()
+    changes.
+    """
+    start, end = report_window(start, end)
+    key = (schedule_version(cursor), start, end)
+    with _cache_lock:
+        report = _cache.get(key)
+        if report is not None:
+            _cache.move_to_end(key)
+            return dict(report, cached=True)
+
+    report = compute(load_frame(cursor, end), start, end)
+    with _cache_lock:
+        _cache[key] = report
+        while len(_cache) > CACHE_ENTRIES:
+            _cache.popitem(last=False)
+    return dict(report, cached=False)
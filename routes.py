@@ -1,59 +1,115 @@
+import csv
+import io
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from math import log
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, Response, render_template, request, jsonify, url_for
 from datetime import datetime
-import pyodbc
-import smtplib
-from email.message import EmailMessage
 from config import cfg
-from sbcutils import PyRibbonClient
+from sbcutils import get_sbc_client
+from db import get_db_connection, is_sqlite
+import scheduler_service
+import notifications
+import jobs
+import changes
+import health
+import history
+import ical
+import reports
+import schedules
+import sharedcache
+import reconcile
+import users
+import timing
+from ratelimit import RateLimited, limit_per_client, too_many_requests
 
 bp = Blueprint('audss_oncall', __name__)
-sbc_client = PyRibbonClient()
+
+# Fetches the dashboard sections concurrently (see dashboard())
+_dashboard_pool = ThreadPoolExecutor(max_workers=12, thread_name_prefix="dashboard")
 
 # --- UTILITY FUNCTIONS (MOVED FROM app.py) ---
-def get_db_connection():
-    """Establishes a connection to the MS SQL database."""
+def _id_filter(column, ids):
+    """SQL condition and params restricting column to ids (no restriction for None)."""
+    if ids is None:
+        return "", []
+    return f" AND {column} IN ({', '.join('?' for _ in ids) or 'NULL'})", list(ids)
+
+def fetch_users(cursor, ids=None):
+    condition, params = _id_filter("id", ids)
+    cursor.execute(f"SELECT id, name, mobile FROM OnCallUsers WHERE 1 = 1{condition} ORDER BY name", params)
+    return [{'id': row[0], 'name': row[1], 'mobile': row[2]} for row in cursor.fetchall()]
+
+def fetch_upcoming_schedules(cursor, ids=None):
+    condition, params = _id_filter("s.id", ids)
+    sql = f"""
+        SELECT s.id, u.name, u.mobile, s.scheduled_datetime, s.status, s.user_id
+        FROM OnCallSchedules s
+        JOIN OnCallUsers u ON s.user_id = u.id
+        WHERE s.scheduled_datetime >= GETDATE() AND s.status = 'pending'{condition}
+        ORDER BY s.scheduled_datetime
+    """
+    cursor.execute(sql, params)
+    return [
+        {
+            'id': row[0], 'name': row[1], 'mobile': row[2], 
+            'scheduled_datetime': row[3].strftime('%d/%m/%Y %H:%M:%S'), 'status': row[4],
+            'user_id': row[5]
+        } for row in cursor.fetchall()
+    ]
 
-    logging.info(f"Establishing database connection...{cfg.DB_SERVER} ")
+def cached_users():
+    """
+    The user list, shared by the worker processes for CACHE.USERS_TTL_SECONDS
+    and dropped everywhere by users.invalidate().
+    """
+    key = f"users:list:{sharedcache.generation('users')}"
+    user_list = sharedcache.get(key)
+    if user_list is None:
+        user_list = with_db_cursor(fetch_users)
+        sharedcache.put(key, user_list, cfg.CACHE_USERS_TTL)
+    return user_list
+
+def with_db_cursor(func):
+    """Runs func(cursor) on a connection of its own, so callers can run in parallel."""
+    conn = get_db_connection()
+    if conn is None:
+        raise ConnectionError('Database connection failed')
     try:
-        conn = pyodbc.connect(
-            'DRIVER={ODBC Driver 17 for SQL Server};'
-            f'SERVER={cfg.DB_SERVER};'
-            f'DATABASE={cfg.DB_NAME};'
-            f'TRUSTED_CONNECTION={cfg.DB_TRUSTEDCONNECTION};'
-        )
-        conn.autocommit = True
-        return conn
-    except pyodbc.Error as ex:
-        logging.error(f"Database connection error: {ex}")
-        return None
+        return func(conn.cursor())
+    finally:
+        conn.close()
+
+def wants_async():
+    """Job mode is requested with ?async=1 or a 'Prefer: respond-async' header."""
+    return request.args.get('async') in ('1', 'true') or 'respond-async' in request.headers.get('Prefer', '')
 
-def send_email_notification(user_name, mobile, scheduled_date):
-    """Sends an email notification for a new schedule."""
-    if not cfg.SMTP_SERVER:
-        logging.warning("SMTP server not configured. Skipping email notification.")
-        return
-
-    msg = EmailMessage()
-    msg.set_content(
-        f"A new on-call schedule has been created:\n\n"
-        f"User: {user_name}\n"
-        f"Mobile: {mobile}\n"
-        f"Date: {scheduled_date.strftime('%Y-%m-%d %H:%M')}\n"
-    )
-    msg['Subject'] = 'New On-Call Schedule Created'
-    msg['From'] = cfg.FROM_PERSON
-    msg['To'] = user_name + "@transalta.com"
-    logging.info(f"Emailing {msg['To']}")
+def accept_update_job(mobile):
+    """Queues an on-call update and answers 202 with where to poll for it."""
+    job_id = jobs.submit_update(mobile)
+    if job_id is None:
+        return jsonify({'error': 'Could not record the update job'}), 500
+    status_url = url_for('.get_job_status', job_id=job_id)
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
 
+def last_known_oncall():
+    """Over-limit GET /api/oncall requests are answered from the last known status."""
+    if request.method != 'GET':
+        return None
+    statuses = get_sbc_client().last_known_status()
+    return jsonify(users.annotate(statuses)) if statuses is not None else None
+
+def _timed(func):
+    """Returns (result, error, elapsed milliseconds) for func()."""
+    started = time.perf_counter()
     try:
-        with smtplib.SMTP(cfg.SMTP_SERVER, cfg.SMTP_PORT) as s:
-            s.starttls()
-            s.send_message(msg)
-        logging.info("Email notification sent successfully.")
+        result, error = func(), None
     except Exception as e:
-        logging.error(f"Failed to send email: {e}")
+        result, error = None, str(e)
+    return result, error, round((time.perf_counter() - started) * 1000, 1)
 
 # --- WEB PAGE ROUTE ---
 @bp.route('/')
@@ -65,65 +121,210 @@ def index():
 @bp.route('/api/users', methods=['GET', 'POST'])
 def manage_users():
     print("Received request for /audssoncall/api/users")
+    if request.method == 'GET':
+        try:
+            return jsonify(cached_users())
+        except ConnectionError as e:
+            return jsonify({'error': str(e)}), 500
+
     conn = get_db_connection()
     if conn is None:
         return jsonify({'error': 'Database connection failed'}), 500
     cursor = conn.cursor()
 
-    if request.method == 'GET':
-        cursor.execute("SELECT id, name, mobile FROM OnCallUsers ORDER BY name")
-        users = [{'id': row[0], 'name': row[1], 'mobile': row[2]} for row in cursor.fetchall()]
-        conn.close()
-        return jsonify(users)
-
     if request.method == 'POST':
         data = request.get_json()
         if not data or 'name' not in data or 'mobile' not in data:
             conn.close()
             return jsonify({'error': 'Name and mobile are required'}), 400
+        try:
+            mobile = users.normalize_mobile(data['mobile'])
+        except ValueError as e:
+            conn.close()
+            return jsonify({'error': str(e)}), 400
         
-        sql = "INSERT INTO OnCallUsers (name, mobile) VALUES (?, ?)"
-        cursor.execute(sql, data['name'], data['mobile'])
+        if is_sqlite():
+            cursor.execute("INSERT INTO OnCallUsers (name, mobile) VALUES (?, ?) RETURNING id", (data['name'], mobile))
+        else:
+            cursor.execute("INSERT INTO OnCallUsers (name, mobile) OUTPUT inserted.id VALUES (?, ?)", (data['name'], mobile))
+        user_id = cursor.fetchone()[0]
+        version = changes.record(cursor, 'user', 'insert', [user_id])
         conn.close()
+        users.invalidate()
         logging.info(f"User added: {data['name']}")
-        return jsonify({'message': 'User added successfully'}), 201
+        return jsonify({
+            'message': 'User added successfully',
+            'user': {'id': user_id, 'name': data['name'], 'mobile': mobile},
+            'version': version,
+        }), 201
+
+@bp.route('/api/users/import', methods=['POST'])
+def import_users():
+    """
+    Adds or updates users in bulk, matched by name. Accepts a JSON list of
+    {name, mobile} (or {"users": [...]}), or CSV with a name,mobile header as
+    the request body or an uploaded 'file'. Valid rows are upserted in one
+    transaction; the response reports the outcome of every row. 207 if some
+    rows were rejected.
+    """
+    try:
+        if request.is_json:
+            rows = request.get_json()
+            if isinstance(rows, dict):
+                rows = rows.get('users')
+            if not isinstance(rows, list):
+                return jsonify({'error': 'Expected a list of users'}), 400
+        else:
+            upload = request.files.get('file')
+            text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+            rows = list(csv.DictReader(io.StringIO(text)))
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'error': f'Could not read the import: {e}'}), 400
+    if not rows:
+        return jsonify({'error': 'No users to import'}), 400
+    if len(rows) > cfg.USERS_IMPORT_MAX_ROWS:
+        return jsonify({'error': f'At most {cfg.USERS_IMPORT_MAX_ROWS} users per import'}), 413
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        report = users.import_users(conn, rows)
+    except Exception as e:
+        logging.error(f"User import failed: {e}")
+        return jsonify({'error': f'Import failed, nothing was changed: {e}'}), 500
+    finally:
+        conn.close()
+    return jsonify(report), 207 if report['errors'] else 200
+
+@bp.route('/api/users/export', methods=['GET'])
+def export_users():
+    """Streams all users as CSV (default) or ?format=ndjson."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    response = Response(users.export_users(conn, fmt), mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=oncall_users.{fmt}'
+    return response
 
 @bp.route('/api/users/<int:user_id>', methods=['PUT'])
 def update_user(user_id):
     data = request.get_json()
     if not data or 'mobile' not in data:
         return jsonify({'error': 'Mobile number is required'}), 400
+    try:
+        mobile = users.normalize_mobile(data['mobile'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
         
     conn = get_db_connection()
     if conn is None:
         return jsonify({'error': 'Database connection failed'}), 500
     cursor = conn.cursor()
     sql = "UPDATE OnCallUsers SET mobile = ? WHERE id = ?"
-    cursor.execute(sql, (data['mobile'], user_id))
+    cursor.execute(sql, (mobile, user_id))
     
     if cursor.rowcount == 0:
         conn.close()
         return jsonify({'error': 'User not found'}), 404
-        
+
+    version = changes.record(cursor, 'user', 'update', [user_id])
+    user = fetch_users(cursor, [user_id])
     conn.close()
-    logging.info(f"User updated: {data['mobile']}")
-    return jsonify({'message': 'User updated successfully'})
+    users.invalidate()
+    logging.info(f"User updated: {mobile}")
+    return jsonify({'message': 'User updated successfully', 'user': user[0] if user else None, 'version': version})
 
 @bp.route('/api/oncall', methods=['GET', 'POST'])
+@limit_per_client(fallback=last_known_oncall)
 def manage_oncall():
+    sbc_client = get_sbc_client()
     print(f"sbc_client instance: {sbc_client}")
     if request.method == 'GET':
         statuses = sbc_client.sbc_interaction(action="check")
-        return jsonify(statuses)
+        return jsonify(users.annotate(statuses))
     
     if request.method == 'POST':
         data = request.get_json()
-        mobile = data.get('mobile', '').replace(" ", "")
-        if not mobile:
+        if not data.get('mobile'):
             return jsonify({'error': 'Mobile number is required for update'}), 400
-        statuses = sbc_client.sbc_interaction(mobile=mobile, action="update")
+        try:
+            mobile = users.normalize_mobile(data['mobile'])
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if wants_async():
+            return accept_update_job(mobile)
+        try:
+            statuses = sbc_client.sbc_interaction(mobile=mobile, action="update", wait=0)
+        except RateLimited as e:
+            return too_many_requests(e.retry_after, str(e))
+        history.record_changes(statuses, 'manual', changed_by=request.remote_addr)
         logging.info(f"On-call status updated for mobile: {mobile}")
-        return jsonify(statuses)
+        return jsonify(users.annotate(statuses))
+
+@bp.route('/api/dashboard', methods=['GET'])
+def dashboard():
+    """
+    Users, upcoming schedules and SBC status in one response, with the
+    change version they are current as of (see GET /api/changes).
+
+    The three sources are fetched concurrently, so the response takes as long
+    as the slowest one. SBC status is served from the client's cache when it
+    is younger than DASHBOARD.STATUS_MAX_AGE_SECONDS (?live=1 forces a fresh
+    check). A section that fails, or is still running after
+    DASHBOARD.TIMEOUT_SECONDS, comes back as null with an entry in 'errors'.
+    """
+    started = time.perf_counter()
+    max_age = 0 if request.args.get('live') == '1' else cfg.DASHBOARD_STATUS_MAX_AGE
+    # Read before the lists, so changes made while they load are replayed by
+    # GET /api/changes?since=<version> rather than missed
+    version, version_error, _ = _timed(lambda: with_db_cursor(changes.current_version))
+    loaders = {
+        'users': cached_users,
+        'schedules': lambda: with_db_cursor(fetch_upcoming_schedules),
+        'sbc_status': lambda: users.annotate(get_sbc_client().cached_status(max_age)),
+    }
+    futures = {name: timing.submit(_dashboard_pool, _timed, loader) for name, loader in loaders.items()}
+    timeout = cfg.DASHBOARD_TIMEOUT
+    done, _ = wait(futures.values(), timeout=timeout)
+
+    response = {'errors': {}, 'timings': {}, 'version': version}
+    if version_error:
+        response['errors']['version'] = version_error
+    for name, future in futures.items():
+        if future in done:
+            response[name], error, elapsed = future.result()
+            response['timings'][name] = elapsed
+            if error:
+                response['errors'][name] = error
+        else:
+            response[name] = None
+            response['timings'][name] = timeout * 1000
+            response['errors'][name] = f'Timed out after {timeout}s'
+    response['partial'] = bool(response['errors'])
+    response['timings']['total'] = round((time.perf_counter() - started) * 1000, 1)
+    if response['partial']:
+        logging.warning(f"Dashboard returned partial data: {response['errors']}")
+    return jsonify(response)
+
+# --- HEALTH ---
+@bp.route('/health', methods=['GET'])
+def health_check():
+    """Liveness: answers as long as the app can serve requests."""
+    response = jsonify(health.liveness())
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@bp.route('/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: 200 if the database, SBCs and SMTP server are reachable, else 503."""
+    ready, report = health.readiness()
+    response = jsonify(report)
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 200 if ready else 503
 
 @bp.route('/api/schedule', methods=['GET', 'POST'])
 def manage_schedules():
@@ -133,23 +334,10 @@ def manage_schedules():
     cursor = conn.cursor()
     
     if request.method == 'GET':
-        sql = """
-            SELECT s.id, u.name, u.mobile, s.scheduled_datetime, s.status
-            FROM OnCallSchedules s
-            JOIN OnCallUsers u ON s.user_id = u.id
-            WHERE s.scheduled_datetime >= GETDATE() AND s.status = 'pending'
-            ORDER BY s.scheduled_datetime
-        """
-        cursor.execute(sql)
-        schedules = [
-            {
-                'id': row[0], 'name': row[1], 'mobile': row[2], 
-                'scheduled_datetime': row[3].strftime('%d/%m/%Y %H:%M:%S'), 'status': row[4]
-            } for row in cursor.fetchall()
-        ]
+        schedule_list = fetch_upcoming_schedules(cursor)
         conn.close()
-        logging.info(f"Fetched schedules: {schedules}")
-        return jsonify(schedules)
+        logging.info(f"Fetched schedules: {schedule_list}")
+        return jsonify(schedule_list)
 
     if request.method == 'POST':
         data = request.get_json()
@@ -165,30 +353,169 @@ def manage_schedules():
             return jsonify({'error': 'User ID and schedule datetime are required'}), 400
         
         try:
-            scheduled_datetime = datetime.strptime(scheduled_datetime_str, '%d/%m/%Y %H:%M:%S')
+            scheduled_datetime = schedules.parse_datetime(scheduled_datetime_str)
         except ValueError:
             conn.close()
             return jsonify({'error': 'Invalid datetime format'}), 400
-        
-        sql = "INSERT INTO OnCallSchedules (user_id, scheduled_datetime) VALUES (?, ?)"
-        cursor.execute(sql, (user_id, scheduled_datetime))
-        
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            conn.close()
+            return jsonify({'error': 'Invalid user ID'}), 400
+
+        def conflict_response(conflicts, duplicate):
+            described = ", ".join(f"{c['name']} at {c['scheduled_datetime']}" for c in conflicts)
+            return jsonify({
+                'error': f"{'Already scheduled' if duplicate else 'Too close to other handovers'}: {described}",
+                'conflicts': conflicts,
+            }), 409
+
+        # Handovers too close together would overwrite each other; refused
+        # unless the caller insists with "allow_conflicts": true
+        allow_conflicts = bool(data.get('allow_conflicts'))
+        conflicts = schedules.find_conflicts(cursor, scheduled_datetime)
+        duplicate = schedules.is_duplicate(conflicts, user_id, scheduled_datetime)
+        if conflicts and (duplicate or not allow_conflicts):
+            conn.close()
+            return conflict_response(conflicts, duplicate)
+
         cursor.execute("SELECT name, mobile FROM OnCallUsers WHERE id = ?", (user_id,))
         user = cursor.fetchone()
+        if user is None:
+            conn.close()
+            return jsonify({'error': 'User not found'}), 404
 
+        # Inserted like a one-row bulk create, so the conflict check is
+        # repeated under a lock in case another request got there first
+        report = [{'row': 1, 'status': 'created', 'conflicts': conflicts}]
         try:
-            if user:
-                logging.info(f"Sending email to {user[0]} at {user[1]} for schedule on {scheduled_datetime}")
-                send_email_notification(user[0], user[1], scheduled_datetime)
-                logging.info("Email notification sent.")
+            ids, version = schedules.insert_bulk(
+                conn, [(1, user_id, scheduled_datetime, user[0], user[1])], report, allow_conflicts)
         except Exception as e:
-            logging.error(f"Error sending email notification: {e}")
-            pass
+            conn.close()
+            logging.error(f"Failed to create schedule: {e}")
+            return jsonify({'error': f'Failed to create schedule: {e}'}), 500
+        if not ids:
+            conn.close()
+            conflicts = report[0]['conflicts']
+            return conflict_response(conflicts, schedules.is_duplicate(conflicts, user_id, scheduled_datetime))
+        schedule_id = ids[1]
+        conflicts = report[0]['conflicts']
+        scheduler_service.notify()
+
+        logging.info(f"Queueing email to {user[0]} at {user[1]} for schedule on {scheduled_datetime}")
+        notifications.notify_schedule_created(user[0], user[1], scheduled_datetime, cursor=cursor)
 
+        # Empty when the time is already past: it will not show as upcoming
+        schedule = fetch_upcoming_schedules(cursor, [schedule_id])
         conn.close()
-        return jsonify({'message': 'Schedule created successfully'}), 201
+        return jsonify({
+            'message': 'Schedule created successfully',
+            'schedule': schedule[0] if schedule else None,
+            'conflicts': conflicts,
+            'version': version,
+        }), 201
+
+@bp.route('/api/schedule.ics', methods=['GET'])
+def schedule_calendar():
+    """
+    Upcoming handovers as an iCalendar feed to subscribe to in Outlook, for
+    everyone or ?user_id=<id>. Supports If-None-Match / If-Modified-Since.
+    """
+    user_id = request.args.get('user_id', type=int)
+    entry = ical.feed(user_id)
+    if entry is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    etag, last_modified, body = entry
+    response = Response(body, mimetype='text/calendar')
+    response.headers['Content-Disposition'] = 'inline; filename=audssoncall.ics'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.max_age = cfg.ICAL_VERSION_CHECK
+    return response.make_conditional(request)
+
+@bp.route('/api/schedule/bulk', methods=['POST'])
+def create_schedules_bulk():
+    """
+    Creates many schedules at once from a JSON list of {user_id,
+    scheduled_datetime}, or {"schedules": [...], "allow_conflicts": bool}.
+    Every row is checked against the pending schedules and the rows before
+    it; conflicting rows are rejected (or only flagged with allow_conflicts)
+    and the rest are inserted in one transaction. 207 if some rows were
+    rejected.
+    """
+    data = request.get_json(silent=True)
+    allow_conflicts = False
+    if isinstance(data, dict):
+        allow_conflicts = bool(data.get('allow_conflicts'))
+        data = data.get('schedules')
+    if not isinstance(data, list) or not data:
+        return jsonify({'error': 'Expected a list of schedules'}), 400
+    if len(data) > schedules.BULK_MAX_ROWS:
+        return jsonify({'error': f'At most {schedules.BULK_MAX_ROWS} schedules per request'}), 413
+
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = conn.cursor()
+        valid, rows = schedules.check_bulk(cursor, data, allow_conflicts)
+        ids, version = schedules.insert_bulk(conn, valid, rows, allow_conflicts) if valid else ({}, None)
+        for row_no, _, when, name, mobile in valid:
+            if row_no in ids:
+                notifications.notify_schedule_created(name, mobile, when, cursor=cursor)
+    except Exception as e:
+        logging.error(f"Bulk schedule creation failed: {e}")
+        return jsonify({'error': f'Bulk creation failed, nothing was created: {e}'}), 500
+    finally:
+        conn.close()
+    if ids:
+        scheduler_service.notify()
+    for row in rows:
+        if row['status'] == 'created':
+            row['id'] = ids[row['row']]
+    rejected = sum(1 for row in rows if row['status'] == 'rejected')
+    logging.info(f"Bulk schedules: {len(ids)} created, {rejected} rejected")
+    report = {'created': len(ids), 'rejected': rejected, 'rows': rows, 'version': version}
+    return jsonify(report), 207 if rejected else 201
+
+@bp.route('/api/changes', methods=['GET'])
+def get_changes():
+    """
+    Users and upcoming schedules changed since ?since=<version>, oldest
+    first, one entry per entity: inserts and updates carry the entity as it
+    is now, deletes only its id (a schedule that is no longer upcoming counts
+    as deleted). Without since, just the current version. 'reset': true
+    means the client has to reload the lists instead.
+    """
+    since = request.args.get('since', type=int)
+
+    def load(cursor):
+        if since is None:
+            return {'version': changes.current_version(cursor), 'reset': False, 'changes': []}
+        version, changed = changes.changed_since(cursor, since)
+        if changed is None:
+            return {'version': version, 'reset': True, 'changes': []}
+        current = {}
+        for entity, fetch in (('user', fetch_users), ('schedule', fetch_upcoming_schedules)):
+            ids = [entity_id for _, kind, entity_id, action in changed if kind == entity and action != 'delete']
+            if ids:
+                current[entity] = {item['id']: item for item in fetch(cursor, ids)}
+        feed = []
+        for change_version, entity, entity_id, action in changed:
+            data = current.get(entity, {}).get(entity_id)
+            if data is None:
+                action = 'delete'
+            feed.append({'version': change_version, 'entity': entity, 'id': entity_id, 'action': action, 'data': data})
+        return {'version': version, 'reset': False, 'changes': feed}
+
+    try:
+        return jsonify(with_db_cursor(load))
+    except ConnectionError as e:
+        return jsonify({'error': str(e)}), 500
 
 @bp.route('/api/oncall/update', methods=['POST'])
+@limit_per_client()
 def update_oncall_api():
     """
     API endpoint to trigger an on-call number update on all SBCs.
@@ -199,8 +526,20 @@ def update_oncall_api():
 
         if not mobile_number:
             return jsonify({'status': 'error', 'message': 'Mobile number is required.'}), 400
+        try:
+            mobile_number = users.normalize_mobile(mobile_number)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        if wants_async():
+            return accept_update_job(mobile_number)
 
-        results = sbc_client.sbc_interaction(action='update', mobile=mobile_number)
+        try:
+            results = get_sbc_client().sbc_interaction(action='update', mobile=mobile_number, wait=0)
+        except RateLimited as e:
+            return too_many_requests(e.retry_after, str(e))
+        history.record_changes(results, 'manual', changed_by=request.remote_addr)
+        results = users.annotate(results)
         all_successful = all(result['status'] == 'success' for result in results)
         
         if all_successful:
@@ -220,6 +559,86 @@ def update_oncall_api():
         logging.error(f"Error in update_oncall_api: {e}")
         return jsonify({'status': 'error', 'message': 'An internal server error occurred.'}), 500
     
+@bp.route('/api/reconcile', methods=['GET', 'POST'])
+@limit_per_client()
+def reconcile_oncall():
+    """
+    GET runs a drift check between the rota and the SBCs and returns the
+    report (?last=1 returns the background monitor's latest one instead).
+    POST also restores the expected number on drifted SBCs.
+    """
+    if request.method == 'GET' and request.args.get('last') == '1':
+        return jsonify(reconcile.last_report())
+    return jsonify(reconcile.reconcile(heal=True if request.method == 'POST' else None))
+
+@bp.route('/api/history', methods=['GET'])
+def get_history():
+    """
+    On-call change history, newest first, optionally filtered by ?from= and
+    ?to= (ISO dates/times) and ?host=. Returns ?limit= rows (default 100,
+    max 1000) and next_before; pass it back as ?before= for the next page.
+    ?format=csv or ?format=ndjson streams the whole range instead, oldest first.
+    """
+    try:
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+        before_id = request.args.get('before', type=int)
+        limit = min(request.args.get('limit', 100, type=int), history.MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameter: {e}'}), 400
+    host = request.args.get('host')
+    fmt = request.args.get('format', 'json')
+
+    if fmt in ('csv', 'ndjson'):
+        chunks = history.export(fmt, start, end, host)
+        if chunks is None:
+            return jsonify({'error': 'Database connection failed'}), 500
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        response = Response(chunks, mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=oncall_history.{fmt}'
+        return response
+    if fmt != 'json':
+        return jsonify({'error': 'format must be json, csv or ndjson'}), 400
+
+    try:
+        page = with_db_cursor(lambda cursor: history.fetch_page(cursor, start, end, host, before_id, max(limit, 1)))
+    except ConnectionError as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(page)
+
+@bp.route('/api/reports/coverage', methods=['GET'])
+def coverage_report():
+    """
+    Rota coverage between ?from= and ?to= (ISO dates, a missing one is
+    derived as in reports.report_window): intervals, gaps, overlapping
+    handovers and on-call hours per user.
+    """
+    try:
+        start = datetime.fromisoformat(request.args['from']) if request.args.get('from') else None
+        end = datetime.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameter: {e}'}), 400
+    # Checked after the defaults are applied: a lone bound can be on the wrong side of them
+    try:
+        start, end = reports.report_window(start, end)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        return jsonify(with_db_cursor(lambda cursor: reports.coverage_report(cursor, start, end)))
+    except ConnectionError as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """API endpoint to poll a background on-call update job."""
+    try:
+        job = jobs.get_job(job_id)
+    except ConnectionError as e:
+        return jsonify({'error': str(e)}), 500
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    return jsonify(job)
+
 @bp.route('/api/users/<int:user_id>', methods=['DELETE'])
 def delete_user(user_id):
     """
@@ -232,6 +651,8 @@ def delete_user(user_id):
     cursor = conn.cursor()
     
     try:
+        cursor.execute("SELECT id FROM OnCallSchedules WHERE user_id = ?", (user_id,))
+        schedule_ids = [row[0] for row in cursor.fetchall()]
         sql_schedules = "DELETE FROM OnCallSchedules WHERE user_id = ?"
         cursor.execute(sql_schedules, (user_id,))
         
@@ -241,9 +662,17 @@ def delete_user(user_id):
         conn.commit()
         
         if cursor.rowcount > 0:
+            changes.record(cursor, 'schedule', 'delete', schedule_ids)
+            version = changes.record(cursor, 'user', 'delete', [user_id])
             conn.close()
+            scheduler_service.notify()
+            users.invalidate()
             logging.info(f"User and schedules deleted for user_id: {user_id}")
-            return jsonify({'message': 'User and associated schedules deleted successfully.'}), 200
+            return jsonify({
+                'message': 'User and associated schedules deleted successfully.',
+                'deleted_schedules': schedule_ids,
+                'version': version,
+            }), 200
         else:
             conn.close()
             logging.warning(f"User not found: {user_id}")
@@ -272,10 +701,12 @@ def delete_schedule(schedule_id):
             conn.close()
             logging.warning(f"Schedule not found: {schedule_id}")
             return jsonify({'error': 'Schedule not found.'}), 404
-        
+
+        version = changes.record(cursor, 'schedule', 'delete', [schedule_id])
         conn.close()
+        scheduler_service.notify()
         logging.info(f"Scheduled job deleted: {schedule_id}")
-        return jsonify({'message': 'Scheduled job deleted successfully.'}), 200
+        return jsonify({'message': 'Scheduled job deleted successfully.', 'version': version}), 200
         
     except Exception as e:
         conn.close()
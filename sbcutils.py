@@ -1,33 +1,139 @@
 # sbc_utils.py
+import logging
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
 import requests
 import urllib3
 import xml.etree.ElementTree as ET
 
 from config import cfg
+from ratelimit import KeyedLimiter, RateLimited
+from users import normalize_mobile
+import sharedcache
+import timing
 
 # Disable SSL warnings globally
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Runs the per-host calls of sbc_interaction concurrently
+_host_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="sbc")
+
+# Last successful result per host, shared with the other worker processes
+STATUS_TTL = 24 * 3600
+
+def _status_key(host):
+    return f"sbc:status:{host}"
+
+def _base_url(host):
+    return f"{cfg.SBC_SCHEME}://{host}/rest"
+
+def set_concurrency(workers):
+    """Sets how many per-host calls run at once (the CLI's --concurrency)."""
+    global _host_pool
+    old, _host_pool = _host_pool, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sbc")
+    old.shutdown(wait=False)
+
 class PyRibbonClient:
-    # ... (Your existing __init__, login, and close methods) ...
+    """
+    REST client for the Ribbon SBCs.
+
+    Each host gets its own requests.Session and lock: calls to different SBCs
+    run in parallel, calls to the same SBC are serialised so one thread's
+    logout cannot end another's login. The last result per host is kept for
+    callers happy with a slightly stale status (see cached_status). That
+    result is also put in the shared cache, so a status read by one worker
+    process serves all of them, and when it goes stale only one process
+    reads the SBC again while the others wait for its result.
+
+    With SBC.KEEP_SESSIONS the session stays logged in between calls and is
+    only logged in again after SBC.SESSION_IDLE_SECONDS without use, or when
+    the SBC turns out to have expired it. warm() logs in ahead of traffic and
+    drain() lets the calls in flight finish before logging out on shutdown.
+    prestage() does the same ahead of a scheduled handover, holding the
+    session open for the update even without KEEP_SESSIONS.
+
+    Every call to an SBC takes a token from that host's bucket
+    (RATE_LIMIT.SBC_PER_MINUTE / SBC_BURST), which caps the management-plane
+    load however much traffic reaches the app. The buckets are kept in the
+    shared cache, so the cap is for all processes on the machine together,
+    not per worker. A status check over the limit
+    is answered from the last known status; an update waits for a token up to
+    its `wait` budget and then raises RateLimited.
+    """
+
     def __init__(self):
-        self.host = cfg.SBC_HOSTS
-        self.username = cfg.SBC_USER
-        self.password = cfg.SBC_PASS
-        self.session = requests.Session()
-        self.session.verify = False
-        self.session.headers.update({
-            'Accept': 'application/vnd.ribbon.elements+xml' 
-        })
+        self._sessions = {}
+        self._host_locks = {}
+        self._lock = threading.Lock()
+        self._last_status = {}
+        # Shared with the other processes on this machine, so the cap holds however many run
+        self._limiter = KeyedLimiter(namespace='sbc')
+        # host -> monotonic time the logged-in session was last used
+        self._logged_in = {}
+        # host -> monotonic time until which a pre-staged session is kept for the next update
+        self._held = {}
+        self._inflight = 0
+        self._idle = threading.Condition(self._lock)
+        self._closing = False
+
+    def _session(self, host):
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.verify = False
+                session.headers.update({
+                    'Accept': 'application/vnd.ribbon.elements+xml' 
+                })
+                self._sessions[host] = session
+            return session
+
+    def _bucket(self, host):
+        return self._limiter.bucket(host, cfg.RATE_LIMIT_SBC_PER_MINUTE / 60.0, cfg.RATE_LIMIT_SBC_BURST)
+
+    def _acquire_hosts(self, hosts, wait):
+        """Takes one token per host, or none at all: raises RateLimited if any host is over its limit."""
+        taken = []
+        for host in hosts:
+            retry_after = self._bucket(host).acquire(wait)
+            if retry_after:
+                for acquired in taken:
+                    self._bucket(acquired).refund()
+                raise RateLimited(f"SBC {host} rate limit reached, retry in {retry_after:.0f}s", retry_after)
+            taken.append(host)
+
+    def _host_lock(self, host):
+        with self._lock:
+            return self._host_locks.setdefault(host, threading.Lock())
+
+    # Read from cfg on every use so a config.yaml reload applies to the next call
+    @property
+    def host(self):
+        return cfg.SBC_HOSTS
+
+    @property
+    def username(self):
+        return cfg.SBC_USER
+
+    @property
+    def password(self):
+        # Read on first login rather than at construction, so building the
+        # client does not decrypt the credentials file
+        return cfg.SBC_PASS
     
     def login(self, host):
         """Performs the login action to establish a session."""
         try:
-            url = f"https://{host}/rest/login"
+            url = f"{_base_url(host)}/login"
             auth = {"Username": self.username, "Password": self.password}
             headers = {"Content-Type": "application/x-www-form-urlencoded; charset=utf-8"}
             
-            response = self.session.post(url, data=auth, headers=headers)
+            with timing.span('sbc.login', host):
+                response = self._session(host).post(url, data=auth, headers=headers, timeout=cfg.SBC_TIMEOUT)
             response.raise_for_status()
             
             # The SBC returns XML with the status code
@@ -40,25 +146,68 @@ class PyRibbonClient:
             print(f"Login failed for {host}: {e}")
             raise ConnectionError(f"Login failed for {host}: {e}")
 
+    def logout(self, host):
+        """Ends the host's session. Failures are only logged."""
+        self._logged_in.pop(host, None)
+        try:
+            with timing.span('sbc.logout', host):
+                self._session(host).post(f"{_base_url(host)}/logout", timeout=cfg.SBC_TIMEOUT)
+            logging.info(f"Logged out of {host}")
+        except Exception as e:
+            logging.warning(f"Failed to logout of {host}: {e}")
+
+    def _keeps_session(self, host):
+        return cfg.SBC_KEEP_SESSIONS or self._held.get(host, 0) > time.monotonic()
+
+    def _ensure_login(self, host):
+        """Logs in to host unless its session is still fresh. Returns True if the session was reused."""
+        last_used = self._logged_in.get(host)
+        if self._keeps_session(host) and last_used is not None and time.monotonic() - last_used < cfg.SBC_SESSION_IDLE:
+            return True
+        self.login(host)
+        self._logged_in[host] = time.monotonic()
+        return False
+
+    def _release(self, host, ok):
+        """Keeps the session for the next call after a successful operation, otherwise logs out."""
+        if self._keeps_session(host) and ok:
+            self._logged_in[host] = time.monotonic()
+        else:
+            self.logout(host)
+
+    def _request(self, host, method, url, expect_entry=True, **kwargs):
+        """
+        Sends one request over the host's logged-in session. If a reused
+        session gets a 401/403, or (with expect_entry) a reply without the
+        transformation entry, the SBC has probably expired it: log in again
+        and repeat the request once.
+        """
+        session = self._session(host)
+        reused = self._ensure_login(host)
+        with timing.span(f'sbc.{method.lower()}', host):
+            response = session.request(method, url, timeout=cfg.SBC_TIMEOUT, **kwargs)
+        if reused and (response.status_code in (401, 403) or (expect_entry and not self.check_api_status(response.text))):
+            logging.info(f"Session to {host} was not accepted, logging in again")
+            self._logged_in.pop(host, None)
+            self._ensure_login(host)
+            with timing.span(f'sbc.{method.lower()}', host):
+                response = session.request(method, url, timeout=cfg.SBC_TIMEOUT, **kwargs)
+        return response
+
     def check_oncall(self, host):
         """Checks the on-call number on a single SBC."""
         print("check_oncall called")
         sbc_number = None
-        sbc_name = host.split('.')[0]
-        base_url = f"https://{host}/rest"
+        ok = False
+        base_url = _base_url(host)
 
-        if sbc_name == 'pernetgw01':
-            q_resource = "transformationtable/20/transformationentry/9"
-        elif sbc_name == 'parnetgw01':
-            q_resource = "transformationtable/17/transformationentry/9"
-        else:
+        q_resource = cfg.SBC_RESOURCES.get(host)
+        if not q_resource:
             return {'host': host, 'status': 'error', 'message': 'Invalid host specified.'}
 
         try:
-            self.login(host)
-            
             print(f"Checking on-call number for host: {host}")
-            get_response = self.session.get(f"{base_url}/{q_resource}")
+            get_response = self._request(host, 'GET', f"{base_url}/{q_resource}")
             get_response.raise_for_status()
 
             # Check for API status code in the XML response
@@ -66,7 +215,7 @@ class PyRibbonClient:
                 response_text = get_response.text.strip()
                 sbc_number = self.extract_outputfield_value(response_text)
                 print(f"Extracted on-call number: {sbc_number} from host: {host}")
-                
+                ok = True
                 return {
                     'host': host,
                     'status': 'success',
@@ -79,11 +228,7 @@ class PyRibbonClient:
             print(f"Failed to retrieve on-call number for host {host}: {e}")
             return {'host': host, 'status': 'error', 'message': f'Failed to retrieve on-call number: {e}'}
         finally:
-            try:
-                self.session.post(f"https://{host}/rest/logout")
-                print(f"Logged out of {host}")
-            except Exception as e:
-                print(f"Failed to logout of {host}: {e}")
+            self._release(host, ok)
 
     # Helper function to check for the XML status code
     def check_api_status(self, xml_string):
@@ -106,31 +251,28 @@ class PyRibbonClient:
         """Updates the on-call number on a single SBC."""
         print(f"Updating on-call number for {host} to {new_mobile_number}")
         
-        # Prepare the new mobile number
-        clean_number = new_mobile_number.replace(" ", "")
-        
         # Determine the correct API resource based on the host
-        sbc_name = host.split('.')[0]
-        if sbc_name == 'pernetgw01':
-            q_resource = "transformationtable/20/transformationentry/9"
-        elif sbc_name == 'parnetgw01':
-            q_resource = "transformationtable/17/transformationentry/9"
-        else:
+        q_resource = cfg.SBC_RESOURCES.get(host)
+        if not q_resource:
             return {'host': host, 'status': 'error', 'message': 'Invalid host specified.'}
 
-        # Check for empty mobile number
-        if not clean_number:
+        # The SBC holds the number in E.164 form
+        if not new_mobile_number:
             return {'host': host, 'status': 'error', 'message': 'Mobile number cannot be blank.'}
+        try:
+            number = normalize_mobile(new_mobile_number)
+        except ValueError as e:
+            return {'host': host, 'status': 'error', 'message': str(e)}
 
         # Create the data payload for the POST request
-        resource_data = {'OutputFieldValue': f'+{clean_number}'}
-        base_url = f"https://{host}/rest"
+        resource_data = {'OutputFieldValue': number}
+        base_url = _base_url(host)
+        ok = False
 
         try:
-            self.login(host) # Log in to the SBC
-            
-            # Perform the update
-            update_response = self.session.post(
+            # Perform the update (logging in first unless the session is still open)
+            update_response = self._request(
+                host, 'POST',
                 f"{base_url}/{q_resource}",
                 data=resource_data,
                 headers={'Content-Type': 'application/x-www-form-urlencoded'}
@@ -142,8 +284,9 @@ class PyRibbonClient:
                 # Optionally, re-check the number to confirm the update
                 confirmed_number = self.extract_outputfield_value(update_response.text)
                 
-                if confirmed_number == f'+{clean_number}':
+                if confirmed_number == number:
                     print(f"Successfully updated on-call number for {host}")
+                    ok = True
                     return {
                         'host': host,
                         'status': 'success',
@@ -163,11 +306,9 @@ class PyRibbonClient:
             print(f"Failed to update on-call number for host {host}: {e}")
             return {'host': host, 'status': 'error', 'message': f'Failed to update on-call number: {e}'}
         finally:
-            try:
-                self.session.post(f"https://{host}/rest/logout")
-                print(f"Logged out of {host}")
-            except Exception as e:
-                print(f"Failed to logout of {host}: {e}")
+            # A pre-staged session was held for this update only
+            self._held.pop(host, None)
+            self._release(host, ok)
 
     def extract_outputfield_value(self, xml_string):
         """Extracts the output field value from the XML response."""
@@ -194,26 +335,258 @@ class PyRibbonClient:
             print(f"Error extracting value: {e}")
             return None
 
-    def sbc_interaction(self, action, mobile=None):
+    def download_config(self, host, kind):
+        """
+        Reads configuration from one SBC: kind 'snapshot' is the on-call
+        transformation entry as XML, 'backup' the SBC's full configuration
+        backup archive. The data is returned as bytes in 'content'.
+        """
+        if kind == 'snapshot':
+            q_resource = cfg.SBC_RESOURCES.get(host)
+            if not q_resource:
+                return {'host': host, 'status': 'error', 'message': 'Invalid host specified.'}
+            method, url, expect_entry = 'GET', f"{_base_url(host)}/{q_resource}", True
+        else:
+            method, url, expect_entry = 'POST', f"{_base_url(host)}/system?action=backup", False
+        ok = False
+        try:
+            response = self._request(host, method, url, expect_entry=expect_entry)
+            response.raise_for_status()
+            if expect_entry and not self.check_api_status(response.text):
+                return {'host': host, 'status': 'error', 'message': f'API error: Invalid response for {host}'}
+            ok = True
+            return {'host': host, 'status': 'success', 'kind': kind, 'content': response.content}
+        except (ConnectionError, requests.exceptions.RequestException) as e:
+            logging.warning(f"Failed to download {kind} from host {host}: {e}")
+            return {'host': host, 'status': 'error', 'message': f'Failed to download {kind}: {e}'}
+        finally:
+            self._release(host, ok)
+
+    def download_hosts(self, kind, hosts, wait=None):
+        """download_config for each host concurrently, taking a rate-limit token per host as updates do."""
+        self._acquire_hosts(hosts, cfg.RATE_LIMIT_SBC_MAX_WAIT if wait is None else wait)
+        futures = [timing.submit(_host_pool, self._on_host, host, self.download_config, host, kind) for host in hosts]
+        return [future.result() for future in futures]
+
+    def check_hosts(self, hosts=None):
+        """Checks the hosts (default all) concurrently; results keep the order of hosts."""
+        futures = [timing.submit(_host_pool, self._check_host, host) for host in hosts or cfg.SBC_HOSTS]
+        return [future.result() for future in futures]
+
+    def sbc_interaction(self, action, mobile=None, wait=None):
         """
         Interacts with all SBCs based on the specified action.
-        This replaces the old sbc_interaction function.
+        The hosts are handled concurrently; results keep the order of cfg.SBC_HOSTS.
         """
         print(f"sbc_interaction called with action: {action}") # Add this line
         hosts = cfg.SBC_HOSTS
-        results = []
 
         if action == "check":
-            for host in hosts:
-                result = self.check_oncall(host)
-                results.append(result)
+            return self.check_hosts(hosts)
         elif action == "update":
             if not mobile:
                 return {'status': 'error', 'message': 'Mobile number is required for update.'}
-            for host in hosts:
-                # Add logic to update the on-call number
-                result = self.update_oncall(host, mobile)
-                results.append(result)
-                print(f"Update result for {host}: {result}")
+            return self.update_hosts(mobile, hosts, wait=wait)
+        return []
+
+    def update_hosts(self, mobile, hosts, on_result=None, wait=None):
+        """
+        Updates the given hosts concurrently. on_result(host, result) is called
+        as each host finishes; the results are returned in the order of hosts.
+        Waits up to `wait` seconds (default RATE_LIMIT.SBC_MAX_WAIT_SECONDS) for
+        the hosts' rate limits, then raises RateLimited without touching any SBC.
+        """
+        self._acquire_hosts(hosts, cfg.RATE_LIMIT_SBC_MAX_WAIT if wait is None else wait)
+        futures = {timing.submit(_host_pool, self._on_host, host, self.update_oncall, host, mobile): host for host in hosts}
+        results = {}
+        for future in as_completed(futures):
+            host = futures[future]
+            results[host] = future.result()
+            logging.info(f"Update result for {host}: {results[host]}")
+            if on_result:
+                on_result(host, results[host])
+        return [results[host] for host in hosts]
+
+    def _check_host(self, host):
+        """Checks one host, answering from its last known status if its rate limit is used up."""
+        retry_after = self._bucket(host).try_acquire()
+        if not retry_after:
+            return self._on_host(host, self.check_oncall, host)
+        known = self._known(host)
+        if known:
+            return dict(known[1], cached=True, stale=True, age=round(known[0], 1))
+        return {'host': host, 'status': 'error', 'retry_after': round(retry_after, 1),
+                'message': f'Rate limited, retry in {retry_after:.0f}s'}
+
+    def _known(self, host):
+        """(age in seconds, result) of the newest successful result any worker process has for host, or None."""
+        local = self._last_status.get(host)
+        known = (time.monotonic() - local[0], local[1]) if local else None
+        shared = sharedcache.get_entry(_status_key(host))
+        if shared and (known is None or shared[1] < known[0]):
+            known = (shared[1], shared[0])
+        return known
+
+    def last_known_status(self):
+        """Last successful result for every host, or None if any host has none yet."""
+        results = []
+        for host in cfg.SBC_HOSTS:
+            known = self._known(host)
+            if not known:
+                return None
+            results.append(dict(known[1], cached=True, age=round(known[0], 1)))
         return results
-    
\ No newline at end of file
+
+    def _on_host(self, host, func, *args):
+        """Runs one SBC operation under the host's lock and remembers a successful on-call result."""
+        with self._lock:
+            if self._closing:
+                return {'host': host, 'status': 'error', 'message': 'Server is shutting down.'}
+            self._inflight += 1
+        try:
+            with timing.span(f'sbc.{func.__name__}', host):
+                with timing.span('sbc.wait', host):
+                    lock = self._host_lock(host)
+                    lock.acquire()
+                try:
+                    result = func(*args)
+                finally:
+                    lock.release()
+        finally:
+            with self._lock:
+                self._inflight -= 1
+                self._idle.notify_all()
+        # Config downloads succeed too, but only results with a number are a status
+        if result.get('status') == 'success' and 'number' in result:
+            self._last_status[host] = (time.monotonic(), result)
+            sharedcache.put(_status_key(host), result, STATUS_TTL)
+        return result
+
+    @property
+    def draining(self):
+        return self._closing
+
+    def probe(self, host, timeout):
+        """
+        Reachability check for the readiness endpoint: opens and closes a TLS
+        connection (plain TCP with SBC.SCHEME http) to the SBC without logging
+        in or taking a rate-limit token.
+        """
+        address = urlsplit(f"//{host}")
+        secure = cfg.SBC_SCHEME == 'https'
+        port = address.port or (443 if secure else 80)
+        with socket.create_connection((address.hostname, port), timeout=timeout) as sock:
+            if secure:
+                context = ssl.create_default_context()
+                # Same as session.verify = False for the REST calls
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+                with context.wrap_socket(sock, server_hostname=address.hostname):
+                    pass
+        last_used = self._logged_in.get(host)
+        fresh = last_used is not None and time.monotonic() - last_used < cfg.SBC_SESSION_IDLE
+        return {'session': 'open' if fresh else 'closed'}
+
+    def warm(self, hosts=None):
+        """
+        Opens a logged-in session to each host before it is needed. Each login
+        takes a rate-limit token; a host over its limit is skipped. Returns
+        {host: None, or the reason it could not be warmed}.
+        """
+        hosts = hosts or cfg.SBC_HOSTS
+
+        def warm_host(host):
+            if self._bucket(host).try_acquire():
+                return 'rate limited'
+            with self._host_lock(host):
+                try:
+                    self._ensure_login(host)
+                except ConnectionError as e:
+                    return str(e)
+                if not cfg.SBC_KEEP_SESSIONS:
+                    # Only the TLS connection is kept for the next call
+                    self.logout(host)
+            return None
+
+        return dict(zip(hosts, _host_pool.map(warm_host, hosts)))
+
+    def prestage(self, hold, hosts=None):
+        """
+        Gets every host ready for an update due in about `hold` seconds: logs
+        in (or reuses the open session), which also proves the SBC reachable,
+        and reads the current on-call number. The session is then kept for
+        the update, with or without SBC.KEEP_SESSIONS, so at the due time
+        only the POST is left. Returns the read results in host order; a host
+        over its rate limit comes back stale from the last known status.
+        """
+        hosts = hosts or cfg.SBC_HOSTS
+        until = time.monotonic() + hold
+        for host in hosts:
+            self._held[host] = until
+        futures = [_host_pool.submit(self._check_host, host) for host in hosts]
+        return [future.result() for future in futures]
+
+    def drain(self, timeout):
+        """
+        Refuses new SBC operations, waits up to timeout seconds for the ones in
+        flight, then logs out of every idle SBC. Returns the number still running.
+        """
+        with self._lock:
+            self._closing = True
+            self._idle.wait_for(lambda: self._inflight == 0, timeout)
+            remaining = self._inflight
+        if remaining:
+            logging.warning(f"{remaining} SBC operation(s) still running after {timeout}s drain")
+        for host in list(self._logged_in):
+            lock = self._host_lock(host)
+            if lock.acquire(blocking=False):
+                try:
+                    self.logout(host)
+                finally:
+                    lock.release()
+        return remaining
+
+    def cached_status(self, max_age):
+        """
+        Current on-call numbers, reusing results up to max_age seconds old.
+        Only the hosts without a fresh enough result are queried.
+        """
+        hosts = cfg.SBC_HOSTS
+        results = {}
+        stale = []
+        for host in hosts:
+            known = self._known(host)
+            if known and known[0] <= max_age:
+                results[host] = dict(known[1], cached=True, age=round(known[0], 1))
+            else:
+                stale.append(host)
+        futures = {host: timing.submit(_host_pool, self._refresh_status, host, max_age) for host in stale}
+        for host, future in futures.items():
+            results[host] = future.result()
+        return [results[host] for host in hosts]
+
+    def _refresh_status(self, host, max_age):
+        """Checks host, unless another worker process is already doing so: then waits for its result."""
+        key = _status_key(host)
+        wait = cfg.SBC_TIMEOUT * 2
+        if not sharedcache.lease(key, wait):
+            with timing.span('sbc.shared_wait', host):
+                shared = sharedcache.wait_for(key, max_age, wait)
+            if shared:
+                return dict(shared[0], cached=True, age=round(shared[1], 1))
+        try:
+            return self._check_host(host)
+        finally:
+            sharedcache.release(key)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_sbc_client():
+    """Returns the PyRibbonClient shared by the web app and the scheduler."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = PyRibbonClient()
+    return _client
@@ -0,0 +1,231 @@
+#scheduler_service.py
+
+import heapq
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from config import cfg
+from db import get_db_connection
+from scheduler_task import prestage_handover, run_scheduled_updates
+import clock
+
+# Touched by notify() so that scheduler threads in other worker processes
+# (IIS FastCGI runs several) also reload without waiting for the safety poll.
+SIGNAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".schedule_changed")
+
+class SchedulerService:
+    """
+    Runs pending schedules at their due time instead of polling on an interval.
+
+    Pending schedules are held in a min-heap keyed on scheduled_datetime and the
+    worker thread sleeps until the earliest one is due. notify() wakes it to
+    reload after a schedule is created or deleted; a slow safety poll picks up
+    anything changed directly in the database. The thread wakes on the local
+    clock, but whether a schedule is due is decided by claim_due_jobs on the
+    database's GETDATE(); a run that finds nothing due (this clock ahead of
+    the server's) is retried after SCHEDULER.RETRY_DELAY_SECONDS.
+
+    SCHEDULER.PRESTAGE_SECONDS before the next schedule is due, the SBCs are
+    logged in to and read on a separate thread (see prestage_handover), so
+    the handover does not wait for DNS, TLS and login at the due time.
+
+    Due times, pre-staging and the retry delay follow clock.now(), so the
+    scheduler simulation can drive tick() on a simulated clock. The safety
+    poll is real elapsed time: it is about noticing other processes' edits.
+    """
+
+    def __init__(self, safety_poll=None, signal_interval=None, retry_delay=None):
+        # None means "use config.yaml", read each time so reloads apply
+        self._safety_poll = safety_poll
+        self._signal_interval = signal_interval
+        self._retry_delay = retry_delay
+        self._heap = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._signal_mtime = self._read_signal()
+        # Heap entry (due, schedule id) pre-staging was last started for
+        self._prestaged = None
+        self._reload_needed = True
+        self._last_reload = 0
+        # clock.now() before which a due schedule is not run again, and the
+        # heap entry the last run was started for
+        self._retry_at = None
+        self._ran = None
+
+    @property
+    def safety_poll(self):
+        return self._safety_poll or cfg.SCHEDULER_SAFETY_POLL
+
+    @property
+    def signal_interval(self):
+        return self._signal_interval or cfg.SCHEDULER_SIGNAL_INTERVAL
+
+    @property
+    def retry_delay(self):
+        return self._retry_delay or cfg.SCHEDULER_RETRY_DELAY
+
+    def start(self):
+        """Starts the background thread (no-op if already running)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="scheduler-service", daemon=True)
+        self._thread.start()
+        logging.info(f"Scheduler service started (safety poll {self.safety_poll}s)")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        logging.info("Scheduler service stopped")
+
+    def notify(self):
+        """Wakes the thread so it reloads the pending schedules."""
+        self._wake.set()
+
+    def next_due(self):
+        """Returns the earliest pending scheduled_datetime, or None."""
+        return self._heap[0][0] if self._heap else None
+
+    def reload(self):
+        """Loads all pending schedules into the heap. Returns False if the DB is unreachable."""
+        conn = get_db_connection()
+        if conn is None:
+            return False
+        try:
+            cursor = conn.cursor()
+            # A claimed schedule only needs attention again if its lease runs out
+            cursor.execute("""
+                SELECT id, CASE WHEN status = 'in_progress' THEN lease_expires ELSE scheduled_datetime END
+                FROM OnCallSchedules
+                WHERE status IN ('pending', 'in_progress')
+            """)
+            # SQLite returns the CASE as text: only table columns get their declared type
+            heap = [
+                (datetime.fromisoformat(due) if isinstance(due, str) else due, schedule_id)
+                for schedule_id, due in cursor.fetchall()
+            ]
+        except Exception as e:
+            logging.error(f"Scheduler service failed to load schedules: {e}")
+            return False
+        finally:
+            conn.close()
+        heapq.heapify(heap)
+        self._heap = heap
+        self._signal_mtime = self._read_signal()
+        logging.info(f"Scheduler service loaded {len(heap)} pending schedules, next due {self.next_due()}")
+        return True
+
+    def _read_signal(self):
+        try:
+            return os.stat(SIGNAL_FILE).st_mtime
+        except OSError:
+            return None
+
+    def _prestage_at(self):
+        """When to pre-stage the next schedule, or None if there is nothing (left) to pre-stage."""
+        lead = cfg.SCHEDULER_PRESTAGE_SECONDS
+        if not lead or not self._heap or self._heap[0] == self._prestaged:
+            return None
+        return self._heap[0][0] - timedelta(seconds=lead)
+
+    def _prestage(self):
+        self._prestaged = due, schedule_id = self._heap[0]
+        logging.info(f"Pre-staging SBC sessions for schedule ID {schedule_id} due {due}")
+
+        def run():
+            try:
+                prestage_handover(schedule_id, due)
+            except Exception as e:
+                logging.error(f"Pre-staging for schedule ID {schedule_id} failed: {e}")
+
+        threading.Thread(target=run, name="scheduler-prestage", daemon=True).start()
+
+    def _run_due(self):
+        try:
+            run_scheduled_updates()
+        except Exception as e:
+            logging.error(f"Scheduler service run failed: {e}")
+
+    def tick(self):
+        """
+        One pass of the service loop at clock.now(): reloads the heap if
+        needed, starts pre-staging and runs what is due. Returns the seconds
+        (of clock time) until the next pass is needed, or None if nothing
+        is pending; the loop waits that long unless notify() comes first.
+        """
+        while True:
+            if self._reload_needed or time.monotonic() - self._last_reload >= self.safety_poll:
+                if self.reload():
+                    self._reload_needed = False
+                    # The retry delay only holds back a run that left its
+                    # schedule where it was; the next handover goes on time
+                    if self._ran is not None and (not self._heap or self._heap[0] != self._ran):
+                        self._retry_at = None
+                    self._ran = None
+                self._last_reload = time.monotonic()
+
+            now = clock.now()
+            due = self.next_due()
+            prestage_at = self._prestage_at()
+            # Overdue schedules are run straight away, there is nothing to get ahead of
+            if not self._reload_needed and prestage_at is not None and prestage_at <= now < due:
+                self._prestage()
+                prestage_at = None
+            # _retry_at stops a job that stays pending (e.g. DB write failed,
+            # or not yet due by GETDATE()) from being re-run in a tight loop
+            if (not self._reload_needed and due is not None and due <= now
+                    and (self._retry_at is None or now >= self._retry_at)):
+                self._ran = self._heap[0]
+                self._run_due()
+                self._retry_at = now + timedelta(seconds=self.retry_delay)
+                self._reload_needed = True
+                continue
+
+            if self._reload_needed:
+                return self.retry_delay
+            if due is None:
+                return None
+            wait = (due - now).total_seconds()
+            if self._retry_at is not None:
+                wait = max(wait, (self._retry_at - now).total_seconds())
+            if prestage_at is not None and prestage_at > now:
+                wait = min(wait, (prestage_at - now).total_seconds())
+            return max(wait, 0)
+
+    def _run(self):
+        self._reload_needed = True
+        while not self._stop.is_set():
+            wait = self.tick()
+            # Woken at least every signal interval to check the signal file,
+            # and in time for the safety poll
+            timeout = min(self.signal_interval, self.safety_poll - (time.monotonic() - self._last_reload))
+            if wait is not None:
+                timeout = min(timeout, wait)
+            if self._wake.wait(max(timeout, 0)):
+                self._wake.clear()
+                self._reload_needed = True
+            elif self._read_signal() != self._signal_mtime:
+                self._reload_needed = True
+
+_service = SchedulerService()
+
+def start():
+    """Starts the process-wide scheduler service."""
+    _service.start()
+
+def stop(timeout=None):
+    _service.stop(timeout)
+
+def notify():
+    """Tells scheduler services in this and other worker processes that schedules changed."""
+    try:
+        with open(SIGNAL_FILE, 'a'):
+            os.utime(SIGNAL_FILE, None)
+    except OSError as e:
+        logging.warning(f"Could not touch scheduler signal file: {e}")
+    _service.notify()
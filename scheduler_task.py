@@ -1,135 +1,255 @@
 #scheduler_task.py
 
-import pyodbc
 import logging
 import os
+import socket
 import sys
-import smtplib
-from datetime import datetime
+import uuid
+from datetime import timedelta
 from config import cfg
-from sbcutils import PyRibbonClient
-from email.message import EmailMessage
+from sbcutils import get_sbc_client
+from db import get_db_connection, is_sqlite
+import notifications
+import history
+import changes
+import clock
 
 #Setup Log File
-logfile = os.path.join(os.path.dirname(__file__), "audssoncall_scheduler.log")
-if not os.path.exists(logfile):
-    open(logfile, 'a').close()
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(logfile),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-logging.info("Scheduler task module loaded.")
-
-#Function to Email User when schedule executed
-def send_email_notification(user_name, mobile, scheduled_date):
-    """Sends an email notification for a new schedule."""
-    if not cfg.SMTP_SERVER:
-        logging.warning("SMTP server not configured. Skipping email notification.")
-        return
+def setup_logging():
+    """Configures the scheduler log when running standalone.
 
-    msg = EmailMessage()
-    msg.set_content(
-        f"Hi you have been set as AUDSS on-call :\n\n"
-        f"User: {user_name}\n"
-        f"Mobile: {mobile}\n"
-        f"Start of on Call Date: {scheduled_date.strftime('%Y-%m-%d %H:%M')}\n"
+    Not done at import time, otherwise importing this module from the web app
+    (see scheduler_service.py) would send the app log to the scheduler file.
+    """
+    logfile = os.path.join(os.path.dirname(__file__), "audssoncall_scheduler.log")
+    if not os.path.exists(logfile):
+        open(logfile, 'a').close()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(logfile),
+            logging.StreamHandler(sys.stdout)
+        ]
     )
-    msg['Subject'] = 'You are on Call for AUDSS'
-    msg['From'] = cfg.FROM_PERSON
-    msg['To'] = user_name + "@transalta.com"
-    msg['Cc'] = cfg.TO_PERSON
-    logging.info(f"Emailing {msg['To']}")
+    logging.info("Scheduler task module loaded.")
+
+# Identifies this process in OnCallSchedules.claimed_by
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def claim_due_jobs(cursor, owner, now=None, lease_seconds=None):
+    """
+    Atomically moves due schedules to 'in_progress' under this worker's lease.
+
+    Pending schedules and in_progress ones whose lease has expired (the worker
+    died mid-run) are claimed in a single UPDATE, so two scheduler processes
+    can never pick up the same schedule. Returns (id, name, mobile,
+    scheduled_datetime) rows, oldest first.
 
+    Due times and leases are judged on the database's GETDATE(), so web
+    servers and the scheduler daemon agree however far their clocks drift.
+    Pass `now` only to override it (the scheduler simulation does).
+    """
+    lease_seconds = lease_seconds or cfg.SCHEDULER_LEASE_SECONDS
+    if now is None:
+        current, now_params = "GETDATE()", []
+    else:
+        current, now_params = "?", [now]
+    due = f"""
+        s.scheduled_datetime <= {current}
+        AND (s.status = 'pending' OR (s.status = 'in_progress' AND s.lease_expires < {current}))
+    """
+    if is_sqlite():
+        # No DATEADD in SQLite; keep the stand-in's 'YYYY-MM-DD HH:MM:SS.fff' text format
+        params = [owner] + now_params + [f"+{lease_seconds} seconds"] + now_params * 2
+        # SQLite's RETURNING cannot reference joined tables, so fetch the
+        # user details for the claimed rows separately
+        cursor.execute(f"""
+            UPDATE OnCallSchedules AS s
+            SET status = 'in_progress', claimed_by = ?,
+                lease_expires = strftime('%Y-%m-%d %H:%M:%f', {current}, ?)
+            WHERE {due}
+            RETURNING id
+        """, params)
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return []
+        placeholders = ", ".join("?" for _ in ids)
+        cursor.execute(f"""
+            SELECT s.id, u.name, u.mobile, s.scheduled_datetime
+            FROM OnCallSchedules s
+            JOIN OnCallUsers u ON s.user_id = u.id
+            WHERE s.id IN ({placeholders})
+        """, ids)
+    else:
+        params = [owner, lease_seconds] + now_params * 3
+        cursor.execute(f"""
+            UPDATE s
+            SET s.status = 'in_progress', s.claimed_by = ?,
+                s.lease_expires = DATEADD(second, ?, {current})
+            OUTPUT inserted.id, u.name, u.mobile, inserted.scheduled_datetime
+            FROM OnCallSchedules s
+            JOIN OnCallUsers u ON s.user_id = u.id
+            WHERE {due}
+        """, params)
+    return sorted(cursor.fetchall(), key=lambda row: (row[3], row[0]))
+
+def set_schedule_statuses(cursor, statuses, owner=None):
+    """
+    Writes a {schedule_id: status} mapping back in a single UPDATE.
+    With an owner, only rows still claimed by that worker are touched.
+    """
+    if not statuses:
+        return
+    ids = list(statuses)
+    cases = " ".join("WHEN ? THEN ?" for _ in ids)
+    placeholders = ", ".join("?" for _ in ids)
+    params = [value for schedule_id in ids for value in (schedule_id, statuses[schedule_id])]
+    params.extend(ids)
+    sql = f"UPDATE OnCallSchedules SET status = CASE id {cases} END WHERE id IN ({placeholders})"
+    if owner:
+        sql += " AND claimed_by = ?"
+        params.append(owner)
+    cursor.execute(sql, params)
+
+PRESTAGE_ALERT_SUBJECT = 'AUDSSONCALL: SBC not ready for the next on-call handover'
+
+def prestage_handover(schedule_id, due):
+    """
+    Readies the SBCs for the handover due at `due` (see
+    PyRibbonClient.prestage), ahead of time, so the handover itself only has
+    to POST the new number. Problems are emailed to MAIL.TO_PERSON now, while
+    there is time to act; the handover is still attempted when due.
+    Returns the per-host read results.
+    """
+    # Held until the scheduler's retry after a failed run, should that be needed
+    hold = max((due - clock.now()).total_seconds(), 0) + cfg.SCHEDULER_RETRY_DELAY
+    results = get_sbc_client().prestage(hold)
+    problems = []
+    for result in results:
+        if result.get('status') != 'success':
+            problems.append(f"{result['host']}: {result.get('message', 'unreachable')}")
+        elif result.get('stale'):
+            problems.append(f"{result['host']}: not checked, SBC rate limit reached")
+        else:
+            logging.info(f"Pre-staged {result['host']} for schedule ID {schedule_id}, currently {result.get('number')}")
+    if not problems:
+        return results
+
+    logging.error(f"Pre-staging for schedule ID {schedule_id} due {due} found problems: {problems}")
+    conn = get_db_connection()
+    if conn is None:
+        logging.error("Could not queue the pre-staging alert: database connection failed")
+        return results
     try:
-        with smtplib.SMTP(cfg.SMTP_SERVER, cfg.SMTP_PORT) as s:
-            s.starttls()
-            s.send_message(msg)
-        logging.info("Email notification sent successfully.")
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT u.name, u.mobile FROM OnCallSchedules s
+            JOIN OnCallUsers u ON s.user_id = u.id
+            WHERE s.id = ?
+        """, (schedule_id,))
+        user = cursor.fetchone()
+        handover = f"{user[0]} ({user[1]})" if user else f"schedule ID {schedule_id}"
+        body = (
+            f"The on-call handover to {handover} is due at {due:%Y-%m-%d %H:%M}, "
+            f"but these SBCs could not be prepared for it:\n\n"
+            + "\n".join(problems)
+            + "\n\nThe handover will still be attempted at the due time.\n"
+        )
+        # Every worker process pre-stages, so only the first one alerts
+        if not notifications.already_queued(cursor, PRESTAGE_ALERT_SUBJECT, body, due - timedelta(days=1)):
+            notifications.enqueue_email(cfg.TO_PERSON, PRESTAGE_ALERT_SUBJECT, body, cursor=cursor)
     except Exception as e:
-        logging.error(f"Failed to send email: {e}")
+        logging.error(f"Could not queue the pre-staging alert: {e}")
+    finally:
+        conn.close()
+    return results
 
 def run_scheduled_updates():
     """
     Checks the database for pending schedules and triggers the SBC update.
     This function is intended to be run periodically by a scheduler.
+    Returns {schedule id: final status} for the schedules it claimed.
     """
     logging.info("Running scheduled update check...")
     logging.info("Initialise SBC")
-    sbvc_client = PyRibbonClient()
+    sbvc_client = get_sbc_client()
     logging.info("SBC Object Initialised")
     logging.info(f"DATABASE Connect {cfg.DB_SERVER}...")
     
-    try:
-        conn = pyodbc.connect(
-            f'DRIVER={cfg.DB_DRIVER};'
-            f'SERVER={cfg.DB_SERVER};'
-            f'DATABASE={cfg.DB_NAME};'
-            f'TRUSTED_CONNECTION={cfg.DB_TRUSTEDCONNECTION};'
-        )
-        conn.autocommit = True
-        cursor = conn.cursor()
-    except Exception as e:
-        logging.error(f"Database connection failed: {e}")
-        return
+    conn = get_db_connection()
+    if conn is None:
+        logging.error("Database connection failed")
+        return {}
+    cursor = conn.cursor()
     
     logging.info("Connected to the database.")
-    # Find jobs that are due and pending
-    sql = """
-        SELECT s.id, u.mobile , s.scheduled_datetime
-        FROM OnCallSchedules s
-        JOIN OnCallUsers u ON s.user_id = u.id
-        WHERE s.scheduled_datetime <= GETDATE() AND s.status = 'pending'
-    """
-    cursor.execute(sql)
-    jobs_to_run = cursor.fetchall()
+    # Claim jobs that are due, oldest first. The SBCs carry a single on-call
+    # entry, so every schedule belongs to the same rota.
+    try:
+        jobs_to_run = claim_due_jobs(cursor, WORKER_ID)
+    except Exception as e:
+        logging.error(f"Failed to claim scheduled jobs: {e}")
+        conn.close()
+        return {}
     logging.info(f"Found {len(jobs_to_run)} scheduled jobs to run.")
     if not jobs_to_run:
         logging.info("No scheduled jobs to run.")
-        return
-    
-    for job in jobs_to_run:
-        schedule_id, mobile_number , scheduled_datetime = job
-        logging.info(f"Executing schedule ID {schedule_id} for number {mobile_number}")
-        
-        try:
-            # Clean the mobile number and perform the update
-            mobile = mobile_number.replace(" ", "")
-            results = sbvc_client.sbc_interaction("update", mobile)
-            logging.info(f"SBC update results for schedule ID {schedule_id}: {results}")
-            
-            # PATCH: Correctly iterate over the list to check for success
-            is_successful = all(result.get('status') == 'success' for result in results)
-            logging.info(f"All updates successful: {is_successful}")
-            
-            if is_successful:
-                status = 'completed'
-                print(f"Schedule ID {schedule_id} completed successfully.")
-                # Send email notification
-                cursor.execute("SELECT user_id FROM OnCallSchedules WHERE id = ?", schedule_id)
-                user_id = cursor.fetchone()[0]
-                cursor.execute("SELECT name FROM OnCallUsers WHERE id = ?", user_id)
-                name = cursor.fetchone()[0]
-                send_email_notification(name, mobile, scheduled_datetime)
-                logging.info(f"Schedule ID {schedule_id} completed and email sent.")
-            else:
-                status = 'failed'
-                print(f"Schedule ID {schedule_id} failed. Results: {results}")
-                logging.error(f"Schedule ID {schedule_id} failed. Results: {results}")
-
-            # Update the schedule status in the database
-            cursor.execute("UPDATE OnCallSchedules SET status = ? WHERE id = ?", status, schedule_id)
-            
-        except Exception as e:
-            print(f"An unexpected error occurred for schedule ID {schedule_id}: {e}")
-            logging.error(f"An unexpected error occurred for schedule ID {schedule_id}: {e}")
-            cursor.execute("UPDATE OnCallSchedules SET status = 'failed' WHERE id = ?", schedule_id)
-            
+        conn.close()
+        return {}
+    # Claimed schedules are no longer upcoming; open pages drop them via the change feed
+    changes.record(cursor, 'schedule', 'update', [job[0] for job in jobs_to_run])
+
+    # After downtime several handovers can be overdue. Only the most recent one
+    # decides who is on call now, so the older ones are skipped rather than
+    # pushed to the SBCs one after another.
+    *superseded, latest = jobs_to_run
+    statuses = {job[0]: 'skipped' for job in superseded}
+    if superseded:
+        logging.info(f"Skipping superseded schedule IDs {list(statuses)}")
+
+    schedule_id, name, mobile_number, scheduled_datetime = latest
+    logging.info(f"Executing schedule ID {schedule_id} for number {mobile_number}")
+
+    try:
+        # update_oncall normalises the number to E.164
+        mobile = mobile_number
+        results = sbvc_client.sbc_interaction("update", mobile)
+        logging.info(f"SBC update results for schedule ID {schedule_id}: {results}")
+        history.record_changes(results, 'scheduler', schedule_id=schedule_id, changed_by=WORKER_ID, cursor=cursor)
+
+        # PATCH: Correctly iterate over the list to check for success
+        is_successful = all(result.get('status') == 'success' for result in results)
+        logging.info(f"All updates successful: {is_successful}")
+
+        if is_successful:
+            statuses[schedule_id] = 'completed'
+            print(f"Schedule ID {schedule_id} completed successfully.")
+            notifications.notify_oncall_started(name, mobile, scheduled_datetime, cursor=cursor)
+            logging.info(f"Schedule ID {schedule_id} completed and email queued.")
+        else:
+            statuses[schedule_id] = 'failed'
+            print(f"Schedule ID {schedule_id} failed. Results: {results}")
+            logging.error(f"Schedule ID {schedule_id} failed. Results: {results}")
+
+    except Exception as e:
+        print(f"An unexpected error occurred for schedule ID {schedule_id}: {e}")
+        logging.error(f"An unexpected error occurred for schedule ID {schedule_id}: {e}")
+        statuses[schedule_id] = 'failed'
+
+    # Update the schedule statuses in the database
+    try:
+        set_schedule_statuses(cursor, statuses, owner=WORKER_ID)
+        changes.record(cursor, 'schedule', 'update', list(statuses))
+    except Exception as e:
+        logging.error(f"Failed to update schedule statuses {statuses}: {e}")
+
     conn.close()
+    return statuses
 
     #main
 if __name__ == "__main__":
+    setup_logging()
     run_scheduled_updates()
+    # No background sender in a standalone run, so deliver the queue now
+    notifications.flush()
@@ -0,0 +1,267 @@
+#schedules.py
+
+import bisect
+import logging
+import threading
+from datetime import datetime, timedelta
+from config import cfg
+import changes
+
+# Conflict checks for new schedules. A handover is a single point in time,
+# so the index is the pending schedules sorted by due time: the ones closer
+# than REPORTS.MIN_HANDOVER_MINUTES to a new time (the same threshold the
+# coverage report flags as overlapping) are found by bisecting to the edge of
+# that window. The index follows the ChangeLog (changes.py), so it is brought
+# up to date by reading only the schedules changed since it was last synced,
+# whichever worker process changed them.
+
+INPUT_FORMAT = '%d/%m/%Y %H:%M:%S'
+BULK_MAX_ROWS = 1000
+
+def parse_datetime(text):
+    """
+    Parses '20/10/2026 08:00:00' (the API format) or ISO 8601
+    ('2026-10-20T08:00', as sent by the page's datetime picker) to the
+    second; raises ValueError.
+    """
+    try:
+        return datetime.strptime(text, INPUT_FORMAT)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(text).replace(microsecond=0, tzinfo=None)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{text}' is not a valid date and time")
+
+def _window(entries, when, gap):
+    """The entries of a sorted (datetime, ...) list less than gap away from when."""
+    start = bisect.bisect_right(entries, (when - gap, float('inf')))
+    end = bisect.bisect_left(entries, (when + gap,), lo=start)
+    return entries[start:end]
+
+def _describe(entry, when, key='id'):
+    scheduled, entry_id, user_id, name = entry
+    return {
+        key: entry_id, 'user_id': user_id, 'name': name,
+        'scheduled_datetime': scheduled.strftime(INPUT_FORMAT),
+        'minutes_apart': round(abs((scheduled - when).total_seconds()) / 60, 1),
+    }
+
+class ScheduleIndex:
+    """Pending schedules as (scheduled_datetime, id, user_id, name), sorted."""
+
+    def __init__(self):
+        self._entries = []
+        self._by_id = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _load(self, cursor):
+        # Version first: anything changed while loading is replayed next sync
+        version = changes.current_version(cursor)
+        cursor.execute("""
+            SELECT s.scheduled_datetime, s.id, s.user_id, u.name
+            FROM OnCallSchedules s
+            JOIN OnCallUsers u ON s.user_id = u.id
+            WHERE s.status = 'pending'
+        """)
+        self._entries = sorted(tuple(row) for row in cursor.fetchall())
+        self._by_id = {entry[1]: entry for entry in self._entries}
+        self._version = version
+        logging.info(f"Schedule index loaded {len(self._entries)} pending schedules at version {version}")
+
+    def _remove(self, schedule_id):
+        entry = self._by_id.pop(schedule_id, None)
+        if entry is not None:
+            del self._entries[bisect.bisect_left(self._entries, entry)]
+
+    def sync(self, cursor):
+        """Applies the schedule changes logged since the last sync (everything the first time)."""
+        with self._lock:
+            if self._version is None:
+                self._load(cursor)
+                return
+            version, changed = changes.changed_since(cursor, self._version)
+            if changed is None:
+                self._load(cursor)
+                return
+            ids = [entity_id for _, entity, entity_id, _ in changed if entity == 'schedule']
+            for schedule_id in ids:
+                self._remove(schedule_id)
+            if ids:
+                placeholders = ", ".join("?" for _ in ids)
+                cursor.execute(f"""
+                    SELECT s.scheduled_datetime, s.id, s.user_id, u.name
+                    FROM OnCallSchedules s
+                    JOIN OnCallUsers u ON s.user_id = u.id
+                    WHERE s.status = 'pending' AND s.id IN ({placeholders})
+                """, ids)
+                for row in cursor.fetchall():
+                    entry = tuple(row)
+                    bisect.insort(self._entries, entry)
+                    self._by_id[entry[1]] = entry
+            self._version = version
+
+    def conflicts(self, when, gap=None):
+        """Pending schedules less than gap (default REPORTS.MIN_HANDOVER_MINUTES) from when, nearest first."""
+        gap = gap or timedelta(minutes=cfg.REPORTS_MIN_HANDOVER_MINUTES)
+        with self._lock:
+            found = [_describe(entry, when) for entry in _window(self._entries, when, gap)]
+        return sorted(found, key=lambda conflict: conflict['minutes_apart'])
+
+_index = ScheduleIndex()
+
+def is_duplicate(conflicts, user_id, when):
+    """True if conflicts include the same user at exactly the same time."""
+    stamp = when.strftime(INPUT_FORMAT)
+    return any(c['user_id'] == user_id and c['scheduled_datetime'] == stamp for c in conflicts)
+
+def find_conflicts(cursor, when):
+    """Syncs the process-wide index and returns the conflicts for a schedule at when."""
+    _index.sync(cursor)
+    return _index.conflicts(when)
+
+# --- BULK CREATE ---
+def check_bulk(cursor, rows, allow_conflicts=False):
+    """
+    Validates bulk rows ({'user_id', 'scheduled_datetime'}, numbered from 1)
+    against the users, the pending schedules and each other. Returns
+    (valid, report rows): valid is [(row_no, user_id, datetime, name, mobile)]. A
+    conflict rejects the row unless allow_conflicts, which only flags it;
+    the same user at the same time twice is always rejected.
+    """
+    gap = timedelta(minutes=cfg.REPORTS_MIN_HANDOVER_MINUTES)
+    parsed, report = [], []
+    for row_no, row in enumerate(rows, start=1):
+        if not isinstance(row, dict) or not row.get('user_id') or not row.get('scheduled_datetime'):
+            report.append({'row': row_no, 'status': 'rejected', 'error': 'User ID and schedule datetime are required'})
+            continue
+        try:
+            user_id = int(row['user_id'])
+        except (TypeError, ValueError):
+            report.append({'row': row_no, 'status': 'rejected', 'error': 'Invalid user ID'})
+            continue
+        try:
+            parsed.append((row_no, user_id, parse_datetime(row['scheduled_datetime'])))
+        except (TypeError, ValueError) as e:
+            report.append({'row': row_no, 'status': 'rejected', 'error': str(e)})
+
+    user_ids = sorted({user_id for _, user_id, _ in parsed})
+    found_users = {}
+    if user_ids:
+        placeholders = ", ".join("?" for _ in user_ids)
+        cursor.execute(f"SELECT id, name, mobile FROM OnCallUsers WHERE id IN ({placeholders})", user_ids)
+        found_users = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    _index.sync(cursor)
+    # Rows accepted so far as (datetime, row_no, user_id, name), so the batch
+    # is also checked against itself
+    accepted = []
+    valid = []
+    for row_no, user_id, when in parsed:
+        entry = {'row': row_no, 'user_id': user_id, 'scheduled_datetime': when.strftime(INPUT_FORMAT)}
+        if user_id not in found_users:
+            report.append(dict(entry, status='rejected', error='User not found'))
+            continue
+        name, mobile = found_users[user_id]
+        nearby = _window(accepted, when, gap)
+        found = _index.conflicts(when, gap) + [_describe(other, when, key='row') for other in nearby]
+        duplicate = is_duplicate(found, user_id, when)
+        if found and (duplicate or not allow_conflicts):
+            report.append(dict(entry, status='rejected', conflicts=found,
+                               error='Duplicate schedule' if duplicate else 'Too close to other handovers'))
+            continue
+        bisect.insort(accepted, (when, row_no, user_id, name))
+        valid.append((row_no, user_id, when, name, mobile))
+        report.append(dict(entry, status='created', conflicts=found))
+    report.sort(key=lambda entry: entry['row'])
+    return valid, report
+
+def _recheck(cursor, valid, report, allow_conflicts):
+    """
+    Repeats check_bulk's conflict check against the table itself, locking
+    the pending schedules around the new times until the transaction ends.
+    Rows that conflict now are marked rejected in report; returns the rest.
+    """
+    from db import is_sqlite
+    gap = timedelta(minutes=cfg.REPORTS_MIN_HANDOVER_MINUTES)
+    times = [when for _, _, when, _, _ in valid]
+    # HOLDLOCK also locks the empty key range, so nobody can insert into it
+    # either; SQLite's BEGIN IMMEDIATE already holds the database write lock
+    hint = "" if is_sqlite() else " WITH (UPDLOCK, HOLDLOCK)"
+    cursor.execute(f"""
+        SELECT s.scheduled_datetime, s.id, s.user_id, u.name
+        FROM OnCallSchedules s{hint}
+        JOIN OnCallUsers u ON s.user_id = u.id
+        WHERE s.status = 'pending' AND s.scheduled_datetime > ? AND s.scheduled_datetime < ?
+    """, (min(times) - gap, max(times) + gap))
+    pending = sorted(tuple(row) for row in cursor.fetchall())
+    entries = {entry['row']: entry for entry in report}
+    kept = []
+    for item in valid:
+        row_no, user_id, when, _, _ = item
+        entry = entries[row_no]
+        found = [_describe(other, when) for other in _window(pending, when, gap)]
+        within_batch = [conflict for conflict in entry.get('conflicts', []) if 'row' in conflict]
+        duplicate = is_duplicate(found, user_id, when)
+        if found and (duplicate or not allow_conflicts):
+            entry.update(status='rejected', conflicts=found + within_batch,
+                         error='Duplicate schedule' if duplicate else 'Too close to other handovers')
+            continue
+        entry['conflicts'] = found + within_batch
+        kept.append(item)
+    if len(kept) < len(valid):
+        logging.info(f"{len(valid) - len(kept)} schedule(s) rejected at insert: conflicting handovers were added meanwhile")
+    return kept
+
+def insert_bulk(conn, valid, report, allow_conflicts=False):
+    """
+    Inserts the checked rows in one transaction and logs them in the
+    ChangeLog. Returns ({row_no: schedule id}, change version).
+
+    check_bulk checked the rows against this process's index, which a
+    concurrent request or another worker may have overtaken, so the check
+    is repeated inside the transaction against the table under a lock
+    (see _recheck). Rows that fail it are marked rejected in report and
+    left out.
+    """
+    from db import is_sqlite
+    cursor = conn.cursor()
+    if is_sqlite():
+        cursor.execute("BEGIN IMMEDIATE")
+    else:
+        conn.autocommit = False
+    try:
+        valid = _recheck(cursor, valid, report, allow_conflicts)
+        keys = {}
+        for start in range(0, len(valid), 500):
+            chunk = valid[start:start + 500]
+            values = ", ".join("(?, ?)" for _ in chunk)
+            params = [value for _, user_id, when, _, _ in chunk for value in (user_id, when)]
+            if is_sqlite():
+                cursor.execute(f"INSERT INTO OnCallSchedules (user_id, scheduled_datetime) VALUES {values} "
+                               "RETURNING id, user_id, scheduled_datetime", params)
+            else:
+                cursor.execute(f"INSERT INTO OnCallSchedules (user_id, scheduled_datetime) "
+                               f"OUTPUT inserted.id, inserted.user_id, inserted.scheduled_datetime VALUES {values}", params)
+            # Neither engine promises the order of the returned rows
+            for schedule_id, user_id, when in cursor.fetchall():
+                if isinstance(when, str):
+                    when = datetime.fromisoformat(when)
+                keys[(user_id, when)] = schedule_id
+        ids = {row_no: keys[(user_id, when)] for row_no, user_id, when, _, _ in valid}
+        version = changes.record(cursor, 'schedule', 'insert', list(ids.values()))
+        if is_sqlite():
+            cursor.execute("COMMIT")
+        else:
+            conn.commit()
+    except Exception:
+        if is_sqlite():
+            cursor.execute("ROLLBACK")
+        else:
+            conn.rollback()
+        raise
+    finally:
+        if not is_sqlite():
+            conn.autocommit = True
+    return ids, version
@@ -0,0 +1,102 @@
+#serve.py
+"""
+Production entry point: serves the app with waitress instead of the Werkzeug
+debug server that `python app.py` starts.
+
+    python serve.py [--host 0.0.0.0] [--port 8080] [--threads 8] [--connection-limit 100]
+
+Defaults come from the SERVER section of config.yaml. The database and the
+SBC sessions are warmed up before the port is opened. On Ctrl+C / SIGTERM
+the SBC operations in flight get up to SERVER.DRAIN_SECONDS to finish (new
+ones are refused) before the server stops; a second Ctrl+C stops at once.
+"""
+import argparse
+import logging
+import signal
+import threading
+import _thread
+from waitress.server import create_server
+
+from app import app
+from config import cfg
+from db import prewarm
+from sbcutils import get_sbc_client
+import notifications
+import reconcile
+import scheduler_service
+
+def warm_up():
+    """Connects to the database and logs in to the SBCs so the first requests are not slowed down."""
+    if prewarm():
+        logging.info("Database connection warmed up")
+    else:
+        logging.warning("Database not reachable during warm-up")
+    for host, error in get_sbc_client().warm().items():
+        if error:
+            logging.warning(f"Could not warm up SBC session to {host}: {error}")
+        else:
+            logging.info(f"SBC session to {host} warmed up")
+
+def drain(timeout):
+    """Stops the background workers and waits for the SBC operations still running."""
+    logging.info(f"Draining, waiting up to {timeout}s for SBC operations in flight")
+    scheduler_service.stop(timeout)
+    reconcile.stop(timeout)
+    remaining = get_sbc_client().drain(timeout)
+    notifications.stop(timeout)
+    if remaining:
+        logging.warning(f"Stopping with {remaining} SBC operation(s) still running")
+    else:
+        logging.info("Drain complete")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve AUDSSONCALL with waitress")
+    parser.add_argument('--host', default=cfg.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=cfg.SERVER_PORT)
+    parser.add_argument('--threads', type=int, default=cfg.SERVER_THREADS)
+    parser.add_argument('--connection-limit', type=int, default=cfg.SERVER_CONNECTION_LIMIT)
+    parser.add_argument('--drain-seconds', type=float, default=cfg.SERVER_DRAIN_SECONDS)
+    parser.add_argument('--no-warm-up', action='store_true', help="skip the DB/SBC warm-up")
+    args = parser.parse_args()
+
+    if not args.no_warm_up:
+        warm_up()
+
+    server = create_server(
+        app,
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        connection_limit=args.connection_limit,
+        channel_timeout=cfg.SERVER_CHANNEL_TIMEOUT,
+        ident='audssoncall',
+    )
+    stopping = threading.Event()
+
+    def drain_then_stop():
+        drain(args.drain_seconds)
+        # Runs handle_signal again in the main thread, which now stops the loop
+        _thread.interrupt_main()
+
+    def handle_signal(signum, frame):
+        if stopping.is_set():
+            raise KeyboardInterrupt
+        stopping.set()
+        logging.info(f"Received signal {signum}, shutting down")
+        threading.Thread(target=drain_then_stop, name="drain", daemon=True).start()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+    if hasattr(signal, 'SIGBREAK'):
+        # Ctrl+Break / service stop on Windows
+        signal.signal(signal.SIGBREAK, handle_signal)
+
+    logging.info(f"Serving on http://{args.host}:{args.port}/audssoncall/ with {args.threads} threads, "
+                 f"connection limit {args.connection_limit}")
+    # Returns once handle_signal raises KeyboardInterrupt; waitress then lets
+    # the requests being handled finish before its worker threads exit
+    server.run()
+    logging.info("Server stopped")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#sharedcache.py
+
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from config import cfg
+
+# Cache shared by the worker processes on this machine (IIS FastCGI runs
+# several), kept in a small SQLite database in WAL mode next to the app:
+# readers never block each other and a write is a few microseconds, so a
+# cache read is much cheaper than the SBC or SQL Server round-trip it saves.
+#
+#   get/put          JSON values with a TTL, plus the time they were stored
+#   generation/bump  counters that invalidate derived entries everywhere:
+#                    put them in the key (see users.py)
+#   lease/release    "I am refreshing this" markers, so when an entry goes
+#                    stale one process refreshes it and the others wait for
+#                    its result instead of all refreshing at once
+#   take_token       token buckets shared by all processes (see ratelimit.py)
+#
+# Every call degrades to a miss (and put/bump to a no-op) if the file cannot
+# be used, so the cache can only make things faster, never break them.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS generations (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# Expired entries are deleted on every PURGE_EVERY-th put, and buckets
+# unused for BUCKET_IDLE_SECONDS (long since full again) on every
+# PURGE_EVERY-th token taken
+PURGE_EVERY = 200
+BUCKET_IDLE_SECONDS = 3600
+
+_local = threading.local()
+_puts = 0
+_takes = 0
+# Identifies this process in leases.owner
+OWNER = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def _path():
+    path = cfg.CACHE_PATH
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+    return path
+
+def _connection():
+    """This thread's connection to the cache file, or None if it cannot be opened."""
+    path = _path()
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.path == path:
+        return conn
+    try:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+    except sqlite3.Error as e:
+        logging.warning(f"Shared cache {path} unavailable: {e}")
+        return None
+    _local.conn, _local.path = conn, path
+    return conn
+
+def _run(default, func):
+    if not cfg.CACHE_ENABLED:
+        return default
+    conn = _connection()
+    if conn is None:
+        return default
+    try:
+        return func(conn)
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        logging.warning(f"Shared cache error: {e}")
+        return default
+
+# --- ENTRIES ---
+def get_entry(key):
+    """(value, age in seconds) of an unexpired entry, or None."""
+    def read(conn):
+        row = conn.execute(
+            "SELECT value, stored_at FROM entries WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return (json.loads(row[0]), time.time() - row[1]) if row else None
+    return _run(None, read)
+
+def get(key):
+    entry = get_entry(key)
+    return entry[0] if entry else None
+
+def put(key, value, ttl):
+    """Stores a JSON-serialisable value for ttl seconds."""
+    global _puts
+    _puts += 1
+    purge = _puts % PURGE_EVERY == 0
+
+    def write(conn):
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value, default=str), now, now + ttl)
+        )
+        if purge:
+            conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+        return True
+    return _run(False, write)
+
+def delete(key):
+    def remove(conn):
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        return True
+    return _run(False, remove)
+
+# --- GENERATIONS ---
+def generation(name):
+    def read(conn):
+        row = conn.execute("SELECT value FROM generations WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+    return _run(None, read)
+
+def bump(name):
+    """Moves the named generation on, in every process. Returns the new value."""
+    def write(conn):
+        conn.execute("INSERT OR IGNORE INTO generations (name, value) VALUES (?, 0)", (name,))
+        conn.execute("UPDATE generations SET value = value + 1 WHERE name = ?", (name,))
+        return conn.execute("SELECT value FROM generations WHERE name = ?", (name,)).fetchone()[0]
+    return _run(None, write)
+
+# --- REFRESH LEASES ---
+def lease(key, seconds):
+    """
+    True if this thread may refresh key: nobody else holds an unexpired
+    lease on it. Also True when the cache is unavailable, since then every
+    process has to refresh for itself.
+    """
+    owner = f"{OWNER}:{threading.get_ident()}"
+
+    def take(conn):
+        now = time.time()
+        conn.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, now))
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)", (key, owner, now + seconds)
+        )
+        return cursor.rowcount == 1
+    return _run(True, take)
+
+def release(key):
+    owner = f"{OWNER}:{threading.get_ident()}"
+    _run(None, lambda conn: conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner)))
+
+def wait_for(key, max_age, timeout, poll=0.05):
+    """
+    Waits up to timeout seconds for another process to store a value for key
+    no older than max_age. Returns (value, age) or None.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        entry = get_entry(key)
+        if entry is not None and entry[1] <= max_age:
+            return entry
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(poll)
+
+# --- TOKEN BUCKETS ---
+def take_token(key, rate, capacity):
+    """
+    Takes a token from the bucket key, refilled at rate tokens per second up
+    to capacity (a bucket not seen before is full). The refill and the take
+    happen in one write transaction, so processes cannot both spend the last
+    token. Returns 0 on success, otherwise the seconds until a token is
+    available; None if the cache is unavailable.
+    """
+    global _takes
+    _takes += 1
+    purge = _takes % PURGE_EVERY == 0
+
+    def take(conn):
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + max(now - row[1], 0) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / rate if rate > 0 else math.inf
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            if purge:
+                conn.execute("DELETE FROM buckets WHERE updated <= ?", (now - BUCKET_IDLE_SECONDS,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return retry_after
+    return _run(None, take)
+
+def refund_token(key, capacity):
+    """Gives back a token taken with take_token. Returns False if the cache is unavailable."""
+    def give(conn):
+        conn.execute("UPDATE buckets SET tokens = MIN(?, tokens + 1) WHERE key = ?", (capacity, key))
+        return True
+    return _run(False, give)
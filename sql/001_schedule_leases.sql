@@ -0,0 +1,19 @@
+-- Lease columns used by the scheduler to claim due schedules atomically
+-- (see claim_due_jobs in scheduler_task.py). A schedule moves
+-- pending -> in_progress (claimed_by / lease_expires set) -> completed,
+-- failed or skipped. An in_progress row whose lease has expired is
+-- reclaimed by the next scheduler run.
+
+IF COL_LENGTH('dbo.OnCallSchedules', 'claimed_by') IS NULL
+    ALTER TABLE dbo.OnCallSchedules ADD claimed_by NVARCHAR(100) NULL;
+GO
+
+IF COL_LENGTH('dbo.OnCallSchedules', 'lease_expires') IS NULL
+    ALTER TABLE dbo.OnCallSchedules ADD lease_expires DATETIME NULL;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_OnCallSchedules_status_due')
+    CREATE INDEX IX_OnCallSchedules_status_due
+        ON dbo.OnCallSchedules (status, scheduled_datetime)
+        INCLUDE (lease_expires);
+GO
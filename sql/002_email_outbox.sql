@@ -0,0 +1,24 @@
+-- Persistent queue for email notifications (see notifications.py).
+-- Web requests and the scheduler only INSERT here; a background sender
+-- delivers the messages over a reused SMTP connection. Rows are kept after
+-- delivery ('sent') or after MAX_ATTEMPTS failures ('dead').
+
+IF OBJECT_ID('dbo.EmailOutbox', 'U') IS NULL
+CREATE TABLE dbo.EmailOutbox (
+    id INT IDENTITY(1,1) PRIMARY KEY,
+    to_addr NVARCHAR(320) NOT NULL,
+    cc_addr NVARCHAR(320) NULL,
+    subject NVARCHAR(255) NOT NULL,
+    body NVARCHAR(MAX) NOT NULL,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at DATETIME NOT NULL,
+    last_error NVARCHAR(500) NULL,
+    created_at DATETIME NOT NULL DEFAULT GETDATE(),
+    sent_at DATETIME NULL
+);
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_EmailOutbox_status_next')
+    CREATE INDEX IX_EmailOutbox_status_next ON dbo.EmailOutbox (status, next_attempt_at);
+GO
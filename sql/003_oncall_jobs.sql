@@ -0,0 +1,14 @@
+-- Background on-call update jobs (see jobs.py). Polled through
+-- GET /api/jobs/<id>; results holds the per-host progress as JSON.
+
+IF OBJECT_ID('dbo.OnCallJobs', 'U') IS NULL
+CREATE TABLE dbo.OnCallJobs (
+    id CHAR(32) PRIMARY KEY,
+    action VARCHAR(20) NOT NULL,
+    mobile NVARCHAR(50) NOT NULL,
+    status VARCHAR(10) NOT NULL,
+    results NVARCHAR(MAX) NOT NULL,
+    created_at DATETIME NOT NULL,
+    updated_at DATETIME NOT NULL
+);
+GO
@@ -0,0 +1,31 @@
+-- Append-only record of every on-call number an SBC confirmed (see
+-- history.py). Written by the scheduler, the synchronous update routes and
+-- background jobs; read by GET /api/history. Rows are never updated or
+-- deleted, which the trigger enforces.
+
+IF OBJECT_ID('dbo.OnCallHistory', 'U') IS NULL
+CREATE TABLE dbo.OnCallHistory (
+    id BIGINT IDENTITY(1,1) PRIMARY KEY,
+    changed_at DATETIME NOT NULL DEFAULT GETDATE(),
+    host NVARCHAR(255) NOT NULL,
+    number NVARCHAR(50) NOT NULL,
+    source VARCHAR(20) NOT NULL,
+    schedule_id INT NULL,
+    job_id CHAR(32) NULL,
+    changed_by NVARCHAR(255) NULL
+);
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_OnCallHistory_changed_at')
+CREATE INDEX IX_OnCallHistory_changed_at ON dbo.OnCallHistory (changed_at, id);
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_OnCallHistory_host_changed_at')
+CREATE INDEX IX_OnCallHistory_host_changed_at ON dbo.OnCallHistory (host, changed_at, id);
+GO
+
+IF OBJECT_ID('dbo.TR_OnCallHistory_AppendOnly', 'TR') IS NULL
+EXEC('CREATE TRIGGER dbo.TR_OnCallHistory_AppendOnly ON dbo.OnCallHistory
+      INSTEAD OF UPDATE, DELETE
+      AS THROW 51000, ''OnCallHistory is append-only'', 1;');
+GO
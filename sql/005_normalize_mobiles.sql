@@ -0,0 +1,23 @@
+-- Rewrites OnCallUsers.mobile in E.164 form ("+61400111222"), as the app
+-- now stores it (see users.normalize_mobile). Spaces, dashes, dots and
+-- brackets are removed; a leading 00 becomes +, a single leading 0 is
+-- replaced by +61 (USERS.DEFAULT_COUNTRY_CODE), and bare digits get a +.
+-- Rows that still do not look like a number are left for manual review.
+
+UPDATE dbo.OnCallUsers
+SET mobile = REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(mobile, ' ', ''), '-', ''), '.', ''), '(', ''), ')', '');
+GO
+
+UPDATE dbo.OnCallUsers
+SET mobile = CASE
+        WHEN mobile LIKE '+%' THEN mobile
+        WHEN mobile LIKE '00%' THEN '+' + SUBSTRING(mobile, 3, 50)
+        WHEN mobile LIKE '0%' THEN '+61' + SUBSTRING(mobile, 2, 50)
+        ELSE '+' + mobile
+    END
+WHERE mobile NOT LIKE '%[^+0-9]%';
+GO
+
+SELECT id, name, mobile FROM dbo.OnCallUsers
+WHERE mobile NOT LIKE '+%' OR mobile LIKE '_%[^0-9]%' OR LEN(mobile) NOT BETWEEN 9 AND 16;
+GO
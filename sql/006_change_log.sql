@@ -0,0 +1,14 @@
+-- Change feed for the UI (see changes.py): one row per user or schedule
+-- inserted, updated or deleted. The id is the version clients pass to
+-- GET /api/changes?since=<version>; the clustered primary key is the only
+-- index the feed needs.
+
+IF OBJECT_ID('dbo.ChangeLog', 'U') IS NULL
+CREATE TABLE dbo.ChangeLog (
+    id BIGINT IDENTITY(1,1) PRIMARY KEY,
+    changed_at DATETIME NOT NULL DEFAULT GETDATE(),
+    entity VARCHAR(20) NOT NULL,
+    entity_id INT NOT NULL,
+    action VARCHAR(10) NOT NULL
+);
+GO
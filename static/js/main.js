@@ -18,6 +18,10 @@ document.addEventListener('DOMContentLoaded', () => {
     // State to keep track of the selected user
     let selectedUser = null;
 
+    // Change version the lists are current as of. After the first load they
+    // are patched in place from mutation responses and GET /api/changes.
+    let changeVersion = null;
+
     // --- Core Functions ---
 
     // Function to fetch and display users
@@ -26,22 +30,50 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch('/audssoncall/api/users');
             if (!response.ok) throw new Error('Failed to fetch users');
             const users = await response.json();
-            
-            userList.innerHTML = '';
-            users.forEach(user => {
-                const option = document.createElement('option');
-                option.value = user.id;
-                option.textContent = `${user.name} - ${user.mobile}`;
-                option.dataset.name = user.name;
-                option.dataset.mobile = user.mobile;
-                userList.appendChild(option);
-            });
+            renderUsers(users);
         } catch (error) {
             console.error('Error fetching users:', error);
             alert('Failed to load user list.');
         }
     }
 
+    function fillUserOption(option, user) {
+        option.value = user.id;
+        option.textContent = `${user.name} - ${user.mobile}`;
+        option.dataset.name = user.name;
+        option.dataset.mobile = user.mobile;
+        return option;
+    }
+
+    function renderUsers(users) {
+        userList.innerHTML = '';
+        users.forEach(user => {
+            userList.appendChild(fillUserOption(document.createElement('option'), user));
+        });
+    }
+
+    // Adds or updates one user, keeping the list sorted by name
+    function upsertUser(user) {
+        const existing = userList.querySelector(`option[value="${user.id}"]`);
+        if (existing) {
+            fillUserOption(existing, user);
+        } else {
+            const option = fillUserOption(document.createElement('option'), user);
+            const next = Array.from(userList.options).find(o => o.dataset.name.localeCompare(user.name) > 0);
+            userList.insertBefore(option, next || null);
+        }
+        if (selectedUser && String(selectedUser.id) === String(user.id)) {
+            selectedUser.mobile = user.mobile;
+        }
+    }
+
+    function removeUser(id) {
+        const existing = userList.querySelector(`option[value="${id}"]`);
+        if (existing) existing.remove();
+        scheduleList.querySelectorAll(`li[data-user-id="${id}"]`).forEach(li => removeSchedule(li.dataset.id));
+        if (selectedUser && String(selectedUser.id) === String(id)) clearSelection();
+    }
+
     // Function to select a user from the list
     function selectUser(user) {
         userIdInput.value = user.id;
@@ -78,10 +110,34 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // Function to fetch and display SBC on-call status
-    async function fetchSbcStatus() {
-        const perthStatus = document.getElementById('sbc-status-perth').querySelector('span');
-        const ppsStatus = document.getElementById('sbc-status-pps').querySelector('span');
+    const perthStatus = document.getElementById('sbc-status-perth').querySelector('span');
+    const ppsStatus = document.getElementById('sbc-status-pps').querySelector('span');
+
+    // The server resolves the number to the user holding it, when there is one
+    function describeOnCall(data) {
+        if (!data.number) return 'N/A';
+        return data.user ? `${data.user.name} (${data.number})` : data.number;
+    }
+
+    function renderSbcStatus(status) {
+        const perthData = status.find(item => item.host.startsWith('pernetgw01'));
+        const ppsData = status.find(item => item.host.startsWith('parnetgw01'));
+
+        perthStatus.textContent = perthData ? describeOnCall(perthData) : 'Error';
+        ppsStatus.textContent = ppsData ? describeOnCall(ppsData) : 'Error';
+        
+        perthStatus.className = perthData && perthData.number ? 'success' : 'error';
+        ppsStatus.className = ppsData && ppsData.number ? 'success' : 'error';
+    }
 
+    function renderSbcStatusError() {
+        perthStatus.textContent = 'Error';
+        ppsStatus.textContent = 'Error';
+        perthStatus.className = 'error';
+        ppsStatus.className = 'error';
+    }
+
+    async function fetchSbcStatus() {
         perthStatus.textContent = 'Checking...';
         ppsStatus.textContent = 'Checking...';
         
@@ -89,22 +145,10 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch('/audssoncall/api/oncall');
             if (!response.ok) throw new Error('Failed to fetch SBC status');
             const status = await response.json();
-            
-            const perthData = status.find(item => item.host.startsWith('pernetgw01'));
-            const ppsData = status.find(item => item.host.startsWith('parnetgw01'));
-
-            perthStatus.textContent = perthData ? perthData.number || 'N/A' : 'Error';
-            ppsStatus.textContent = ppsData ? ppsData.number || 'N/A' : 'Error';
-            
-            perthStatus.className = perthData && perthData.number ? 'success' : 'error';
-            ppsStatus.className = ppsData && ppsData.number ? 'success' : 'error';
-
+            renderSbcStatus(status);
         } catch (error) {
             console.error('Error fetching SBC status:', error);
-            perthStatus.textContent = 'Error';
-            ppsStatus.textContent = 'Error';
-            perthStatus.className = 'error';
-            ppsStatus.className = 'error';
+            renderSbcStatusError();
         }
     }
 
@@ -158,8 +202,10 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify({ name, mobile })
             });
             if (!response.ok) throw new Error('Failed to add user');
-            
-            await fetchUsers();
+            const result = await response.json();
+
+            upsertUser(result.user);
+            trackVersion(result.version);
             clearSelection();
             alert('User added successfully!');
         } catch (error) {
@@ -191,9 +237,10 @@ document.addEventListener('DOMContentLoaded', () => {
             alert(result.message);
             
             if (response.ok) {
-                await fetchUsers();
+                removeUser(id); // Also removes the user's schedules
+                result.deleted_schedules.forEach(removeSchedule);
+                trackVersion(result.version);
                 clearSelection();
-                await fetchSchedules(); // Also refresh the schedules list
             }
         } catch (error) {
             console.error('Error removing user:', error);
@@ -228,7 +275,8 @@ document.addEventListener('DOMContentLoaded', () => {
             alert(result.message);
             
             if (response.ok) {
-                await fetchUsers();
+                if (result.user) upsertUser(result.user);
+                trackVersion(result.version);
                 clearSelection();
             }
         } catch (error) {
@@ -251,14 +299,17 @@ document.addEventListener('DOMContentLoaded', () => {
         if (!confirmUpdate) return;
 
         try {
-            const response = await fetch('/audssoncall/api/oncall/update', {
+            // Runs as a background job on the server; poll until it finishes
+            const response = await fetch('/audssoncall/api/oncall/update?async=1', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ mobile: selectedUser.mobile })
             });
-            if (!response.ok) throw new Error('Failed to update on-call number');
-            const result = await response.json();
-            console.log('Update result:', result);
+            if (response.status !== 202) throw new Error('Failed to update on-call number');
+            const accepted = await response.json();
+            const job = await waitForJob(accepted.status_url);
+            console.log('Update result:', job);
+            if (job.status !== 'completed') throw new Error(`Update ${job.status}`);
             alert('On-Call number updated successfully!');
             fetchSbcStatus(); // Refresh SBC status
         } catch (error) {
@@ -267,6 +318,16 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    async function waitForJob(statusUrl) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            const response = await fetch(statusUrl);
+            if (!response.ok) throw new Error('Failed to fetch job status');
+            const job = await response.json();
+            if (job.done) return job;
+        }
+    }
+
     // Handle "Schedule" form submission
     scheduleForm.addEventListener('submit', async (e) => {
         e.preventDefault();
@@ -298,7 +359,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 const errorData = await response.json();
                 throw new Error(errorData.error || 'Failed to schedule update');
             }
-            await fetchSchedules(); // Refresh the schedule list
+            const result = await response.json();
+            if (result.schedule) upsertSchedule(result.schedule);
+            trackVersion(result.version);
             alert('Update scheduled successfully!');
         } catch (error) {
             console.error('Error scheduling update:', error);
@@ -344,32 +407,145 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch('/audssoncall/api/schedule');
             if (!response.ok) throw new Error('Failed to fetch schedules');
             const schedules = await response.json();
-            
-            scheduleList.innerHTML = '';
-            if (schedules.length === 0) {
-                const li = document.createElement('li');
-                li.textContent = 'No upcoming schedules.';
-                scheduleList.appendChild(li);
-                return;
-            }
-
-            schedules.forEach(schedule => {
-                const li = document.createElement('li');
-                const scheduledDateTime = new Date(schedule.scheduled_datetime).toLocaleString();
-                li.innerHTML = `
-                    <span>
-                        ${schedule.name} scheduled for ${scheduledDateTime}
-                    </span>
-                    <button class="delete-schedule-btn" data-id="${schedule.id}">X</button>
-                `;
-                scheduleList.appendChild(li);
-            });
+            renderSchedules(schedules);
         } catch (error) {
             console.error('Error fetching schedules:', error);
             alert('Failed to load schedules.');
         }
     }
 
+    // The API sends schedule times as 'dd/mm/yyyy hh:mm:ss'
+    function parseScheduleTime(text) {
+        const [date, time] = text.split(' ');
+        const [day, month, year] = date.split('/').map(Number);
+        const [hours, minutes, seconds] = time.split(':').map(Number);
+        return new Date(year, month - 1, day, hours, minutes, seconds);
+    }
+
+    function buildScheduleItem(schedule) {
+        const li = document.createElement('li');
+        const scheduledAt = parseScheduleTime(schedule.scheduled_datetime);
+        li.dataset.id = schedule.id;
+        li.dataset.userId = schedule.user_id;
+        li.dataset.time = scheduledAt.getTime();
+        li.innerHTML = `
+            <span>
+                ${schedule.name} scheduled for ${scheduledAt.toLocaleString()}
+            </span>
+            <button class="delete-schedule-btn" data-id="${schedule.id}">X</button>
+        `;
+        return li;
+    }
+
+    function showNoSchedules() {
+        const li = document.createElement('li');
+        li.className = 'no-schedules';
+        li.textContent = 'No upcoming schedules.';
+        scheduleList.appendChild(li);
+    }
+
+    function renderSchedules(schedules) {
+        scheduleList.innerHTML = '';
+        if (schedules.length === 0) {
+            showNoSchedules();
+            return;
+        }
+        schedules.forEach(schedule => scheduleList.appendChild(buildScheduleItem(schedule)));
+    }
+
+    // Adds or replaces one schedule, keeping the list in time order
+    function upsertSchedule(schedule) {
+        const li = buildScheduleItem(schedule);
+        const existing = scheduleList.querySelector(`li[data-id="${schedule.id}"]`);
+        if (existing) existing.remove();
+        const placeholder = scheduleList.querySelector('li.no-schedules');
+        if (placeholder) placeholder.remove();
+        const next = Array.from(scheduleList.querySelectorAll('li[data-id]'))
+            .find(item => Number(item.dataset.time) > Number(li.dataset.time));
+        scheduleList.insertBefore(li, next || null);
+    }
+
+    function removeSchedule(id) {
+        const existing = scheduleList.querySelector(`li[data-id="${id}"]`);
+        if (existing) existing.remove();
+        if (!scheduleList.querySelector('li[data-id]') && !scheduleList.querySelector('li.no-schedules')) {
+            showNoSchedules();
+        }
+    }
+
+    // --- Change feed ---
+    function applyChange(change) {
+        if (change.entity === 'user') {
+            if (change.action === 'delete') removeUser(change.id); else upsertUser(change.data);
+        } else if (change.entity === 'schedule') {
+            if (change.action === 'delete') removeSchedule(change.id); else upsertSchedule(change.data);
+        }
+    }
+
+    // Reloads both lists, continuing from the version read before them
+    async function reloadLists() {
+        const response = await fetch('/audssoncall/api/changes');
+        if (!response.ok) throw new Error('Failed to fetch change version');
+        const { version } = await response.json();
+        await Promise.all([fetchUsers(), fetchSchedules()]);
+        changeVersion = version;
+    }
+
+    let syncing = null;
+    // Applies what changed since changeVersion (made here or by anyone else)
+    function syncChanges() {
+        if (!syncing) {
+            syncing = (async () => {
+                try {
+                    if (changeVersion === null) return await reloadLists();
+                    const response = await fetch(`/audssoncall/api/changes?since=${changeVersion}`);
+                    if (!response.ok) throw new Error('Failed to fetch changes');
+                    const feed = await response.json();
+                    if (feed.reset) return await reloadLists();
+                    feed.changes.forEach(applyChange);
+                    changeVersion = feed.version;
+                } catch (error) {
+                    console.error('Error syncing changes:', error);
+                } finally {
+                    syncing = null;
+                }
+            })();
+        }
+        return syncing;
+    }
+
+    // Called with the version returned by our own change, already applied
+    // locally: if it is not the next one, someone else changed something too
+    function trackVersion(version) {
+        if (version != null && changeVersion !== null && version === changeVersion + 1) {
+            changeVersion = version;
+        } else {
+            syncChanges();
+        }
+    }
+
+    // --- Load users, schedules and SBC status in one request ---
+    // Sections the server could not load in time come back as null and are
+    // fetched again individually.
+    async function loadDashboard() {
+        try {
+            const response = await fetch('/audssoncall/api/dashboard');
+            if (!response.ok) throw new Error('Failed to load dashboard');
+            const dashboard = await response.json();
+            console.log('Dashboard timings (ms):', dashboard.timings);
+            changeVersion = dashboard.version ?? null;
+
+            if (dashboard.users) renderUsers(dashboard.users); else fetchUsers();
+            if (dashboard.schedules) renderSchedules(dashboard.schedules); else fetchSchedules();
+            if (dashboard.sbc_status) renderSbcStatus(dashboard.sbc_status); else fetchSbcStatus();
+        } catch (error) {
+            console.error('Error loading dashboard:', error);
+            fetchUsers();
+            fetchSbcStatus();
+            fetchSchedules();
+        }
+    }
+
     // --- New Event Listener for Schedule Deletion ---
     scheduleList.addEventListener('click', async (e) => {
         if (e.target.classList.contains('delete-schedule-btn')) {
@@ -390,8 +566,10 @@ document.addEventListener('DOMContentLoaded', () => {
                     throw new Error(errorData.error || 'Failed to delete schedule');
                 }
 
+                const result = await response.json();
+                removeSchedule(scheduleId);
+                trackVersion(result.version);
                 alert('Scheduled job deleted successfully!');
-                fetchSchedules(); // Refresh the list
             } catch (error) {
                 console.error('Error deleting schedule:', error);
                 alert('Failed to delete schedule: ' + error.message);
@@ -399,9 +577,15 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Pick up changes made elsewhere when the tab is shown again, and every minute while it is visible
+    document.addEventListener('visibilitychange', () => {
+        if (!document.hidden) syncChanges();
+    });
+    setInterval(() => {
+        if (!document.hidden) syncChanges();
+    }, 60000);
+
     // Initial data load on page load
-    fetchUsers();
-    fetchSbcStatus();
-    fetchSchedules();
+    loadDashboard();
     setDefaultScheduleTime(); 
 });
\ No newline at end of file
@@ -0,0 +1,72 @@
+#conftest.py
+"""
+The tests run against the SQLite stand-in (DATABASE.ENGINE: sqlite) with a
+copy of config.yaml in a temporary directory, so no SQL Server, SBC or SMTP
+server is needed. Background services (scheduler, drift monitor) are off.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TMPDIR = tempfile.mkdtemp(prefix="audssoncall-tests-")
+DB_PATH = os.path.join(TMPDIR, 'test.db')
+
+def write_test_config():
+    with open(os.path.join(ROOT, 'config.yaml')) as f:
+        config = yaml.safe_load(f)
+    config['DATABASE'].update(ENGINE='sqlite', SQLITE_PATH=DB_PATH)
+    config['SCHEDULER'] = dict(config.get('SCHEDULER') or {}, ENABLED=False)
+    config['RECONCILE'] = dict(config.get('RECONCILE') or {}, ENABLED=False)
+    config['CACHE'] = dict(config.get('CACHE') or {}, PATH=os.path.join(TMPDIR, 'cache.db'))
+    config['MAIL'].update(SMTP_SERVER='127.0.0.1', STARTTLS=False, TIMEOUT_SECONDS=2)
+    path = os.path.join(TMPDIR, 'config.yaml')
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return path
+
+# Before anything imports config.py
+os.environ['AUDSSONCALL_CONFIG'] = write_test_config()
+
+import pytest
+
+@pytest.fixture(autouse=True)
+def fresh_db():
+    """Every test starts with an empty database (the schema is created on connect)."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(DB_PATH + suffix):
+            os.remove(DB_PATH + suffix)
+    yield
+
+@pytest.fixture
+def conn():
+    from db import get_db_connection
+    conn = get_db_connection()
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def client():
+    """Test client for the blueprint, without app.py's background services."""
+    from flask import Flask
+    from routes import bp
+    app = Flask(__name__)
+    app.register_blueprint(bp, url_prefix='/audssoncall')
+    return app.test_client()
+
+def add_user(cursor, name='Alice', mobile='+61400000001'):
+    cursor.execute("INSERT INTO OnCallUsers (name, mobile) VALUES (?, ?) RETURNING id", (name, mobile))
+    return cursor.fetchone()[0]
+
+def add_schedule(cursor, user_id, when, status='pending'):
+    cursor.execute("INSERT INTO OnCallSchedules (user_id, scheduled_datetime, status) VALUES (?, ?, ?) RETURNING id",
+                   (user_id, when, status))
+    return cursor.fetchone()[0]
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TMPDIR, ignore_errors=True)
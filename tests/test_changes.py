@@ -0,0 +1,52 @@
+#test_changes.py
+
+from datetime import datetime, timedelta
+
+import changes
+import clock
+
+def log(cursor, change_id, entity_id):
+    cursor.execute("INSERT INTO ChangeLog (id, entity, entity_id, action) VALUES (?, 'user', ?, 'update')",
+                   (change_id, entity_id))
+
+def test_out_of_order_commits_are_not_skipped(conn):
+    """
+    Transaction A takes id 2 and commits late; transaction B takes id 3 and
+    commits first. SQLite serialises writers, so the interleaving is
+    reproduced by inserting B's row before A's.
+    """
+    cursor = conn.cursor()
+    start = datetime(2030, 1, 1, 9, 0)
+    with clock.frozen(start):
+        log(cursor, 1, 10)
+        version, changed = changes.changed_since(cursor, 0)
+        assert (version, [row[0] for row in changed]) == (1, [1])
+        log(cursor, 3, 30)                  # B commits
+        version, changed = changes.changed_since(cursor, 1)
+        assert (version, changed) == (1, [])  # held back until A commits
+        assert changes.current_version(cursor) == 1
+        log(cursor, 2, 20)                  # A commits
+        version, changed = changes.changed_since(cursor, 1)
+        assert (version, [row[0] for row in changed]) == (3, [2, 3])
+
+def test_rolled_back_id_stops_holding_the_feed(conn):
+    cursor = conn.cursor()
+    start = datetime(2030, 1, 1, 9, 0)
+    with clock.frozen(start):
+        log(cursor, 1, 10)
+        log(cursor, 3, 30)                  # id 2 was rolled back
+        assert changes.changed_since(cursor, 1) == (1, [])
+    with clock.frozen(start + timedelta(seconds=changes.SETTLE_SECONDS + 1)):
+        version, changed = changes.changed_since(cursor, 1)
+        assert (version, [row[0] for row in changed]) == (3, [3])
+
+def test_feed_stops_before_the_first_missing_id(conn):
+    cursor = conn.cursor()
+    with clock.frozen(datetime(2030, 1, 1, 9, 0)):
+        log(cursor, 1, 10)
+        log(cursor, 4, 40)
+        assert changes.changed_since(cursor, 0)[0] == 1
+        log(cursor, 2, 20)
+        assert changes.changed_since(cursor, 0)[0] == 2
+        log(cursor, 3, 30)
+        assert changes.changed_since(cursor, 0)[0] == 4
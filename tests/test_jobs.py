@@ -0,0 +1,45 @@
+#test_jobs.py
+
+import json
+from datetime import datetime, timedelta
+
+import clock
+import jobs
+from config import cfg
+
+STARTED = datetime(2031, 6, 1, 9, 0)
+
+def add_job(cursor, job_id, status, results):
+    cursor.execute(
+        "INSERT INTO OnCallJobs (id, action, mobile, status, results, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (job_id, 'update', '+61400000001', status, json.dumps(results), STARTED, STARTED)
+    )
+
+def test_job_left_running_by_a_stopped_process_is_failed(conn):
+    add_job(conn.cursor(), 'gone', 'running', [
+        {'host': 'sbc1', 'status': 'success', 'attempts': 1},
+        {'host': 'sbc2', 'status': 'running', 'attempts': 1},
+    ])
+    add_job(conn.cursor(), 'queued', 'queued', [{'host': 'sbc1', 'status': 'pending', 'attempts': 0}])
+
+    with clock.frozen(STARTED + timedelta(seconds=cfg.JOBS_STALE_SECONDS - 1)):
+        assert jobs.get_job('gone')['done'] is False
+    with clock.frozen(STARTED + timedelta(seconds=cfg.JOBS_STALE_SECONDS + 1)):
+        job = jobs.get_job('gone')
+        assert (job['status'], job['done']) == ('partial', True)
+        assert [result['status'] for result in job['results']] == ['success', 'error']
+        assert jobs.get_job('queued')['status'] == 'failed'
+    # Recorded, not only reported
+    assert jobs.get_job('gone')['status'] == 'partial'
+
+def test_job_that_cannot_be_stored_is_a_json_error(conn, client, monkeypatch):
+    add_job(conn.cursor(), 'taken', 'completed', [])
+    # The INSERT fails on the duplicate id
+    monkeypatch.setattr(jobs.uuid, 'uuid4', lambda: type('FixedId', (), {'hex': 'taken'})())
+    submitted = []
+    monkeypatch.setattr(jobs._executor, 'submit', lambda *args: submitted.append(args))
+    assert jobs.submit_update('+61400000001') is None
+    response = client.post('/audssoncall/api/oncall?async=1', json={'mobile': '+61400000001'})
+    assert response.status_code == 500
+    assert response.get_json() == {'error': 'Could not record the update job'}
+    assert submitted == []
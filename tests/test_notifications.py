@@ -0,0 +1,104 @@
+#test_notifications.py
+
+import smtplib
+import socket
+from datetime import datetime, timedelta
+
+import clock
+import notifications
+from config import cfg
+
+class FakeSMTP:
+    """Records every connection; the first `timeouts` messages time out and leave their session unusable."""
+    connections = []
+    timeouts = 0
+
+    def __init__(self, host, port, timeout=None):
+        self.sent = []
+        self.broken = False
+        self.closed = False
+        FakeSMTP.connections.append(self)
+
+    def send_message(self, msg):
+        if self.broken:
+            raise smtplib.SMTPResponseException(503, b'Bad sequence of commands')
+        if FakeSMTP.timeouts:
+            FakeSMTP.timeouts -= 1
+            self.broken = True
+            raise socket.timeout('timed out')
+        self.sent.append(msg['To'])
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+def test_timeout_resets_the_connection_for_the_rest_of_the_batch(conn, monkeypatch):
+    monkeypatch.setattr(notifications.smtplib, 'SMTP', FakeSMTP)
+    FakeSMTP.connections, FakeSMTP.timeouts = [], 1
+    cursor = conn.cursor()
+    notifications.enqueue_email('first@example.com', 'one', 'body', cursor=cursor)
+    notifications.enqueue_email('second@example.com', 'two', 'body', cursor=cursor)
+
+    sender = notifications.OutboxSender()
+    assert sender.flush() == 1
+
+    first, second = FakeSMTP.connections
+    assert first.closed and first.sent == []
+    assert second.sent == ['second@example.com']
+    cursor.execute("SELECT to_addr, status, attempts FROM EmailOutbox ORDER BY id")
+    assert cursor.fetchall() == [('first@example.com', 'pending', 1), ('second@example.com', 'sent', 1)]
+
+def test_refused_recipient_keeps_the_connection(conn, monkeypatch):
+    class Refusing(FakeSMTP):
+        def send_message(self, msg):
+            if msg['To'] == 'nobody@example.com':
+                raise smtplib.SMTPRecipientsRefused({'nobody@example.com': (550, b'No such user')})
+            super().send_message(msg)
+
+    monkeypatch.setattr(notifications.smtplib, 'SMTP', Refusing)
+    FakeSMTP.connections, FakeSMTP.timeouts = [], 0
+    cursor = conn.cursor()
+    notifications.enqueue_email('nobody@example.com', 'one', 'body', cursor=cursor)
+    notifications.enqueue_email('second@example.com', 'two', 'body', cursor=cursor)
+
+    assert notifications.OutboxSender().flush() == 1
+    assert len(FakeSMTP.connections) == 1
+    assert FakeSMTP.connections[0].sent == ['second@example.com']
+
+def test_sent_messages_are_recorded_when_the_batch_fails_later(conn, monkeypatch):
+    monkeypatch.setattr(notifications.smtplib, 'SMTP', FakeSMTP)
+    FakeSMTP.connections, FakeSMTP.timeouts = [], 0
+    cursor = conn.cursor()
+    notifications.enqueue_email('first@example.com', 'one', 'body', cursor=cursor)
+    notifications.enqueue_email('second@example.com', 'two', 'body', cursor=cursor)
+
+    sender = notifications.OutboxSender()
+    real_send = sender._send
+    def send(to, cc, subject, body):
+        if to == 'second@example.com':
+            raise socket.timeout('timed out')
+        real_send(to, cc, subject, body)
+    def record_failure(*args):
+        raise RuntimeError('lock timeout')
+    monkeypatch.setattr(sender, '_send', send)
+    monkeypatch.setattr(sender, '_record_failure', record_failure)
+    sender.flush()
+
+    cursor.execute("SELECT to_addr, status FROM EmailOutbox ORDER BY id")
+    assert cursor.fetchall() == [('first@example.com', 'sent'), ('second@example.com', 'sending')]
+
+def test_sending_lease_is_on_the_database_clock(conn):
+    start = datetime(2031, 6, 1, 9, 0)
+    cursor = conn.cursor()
+    with clock.frozen(start):
+        notifications.enqueue_email('first@example.com', 'one', 'body', cursor=cursor)
+        assert len(notifications.claim_batch(cursor, 10)) == 1
+    lease = start + timedelta(seconds=cfg.MAIL_SEND_LEASE)
+    # Not claimed again until the lease has run out on GETDATE()
+    with clock.frozen(lease - timedelta(seconds=1)):
+        assert notifications.claim_batch(cursor, 10) == []
+    assert notifications.claim_batch(cursor, 10, now=lease - timedelta(seconds=1)) == []
+    with clock.frozen(lease + timedelta(seconds=1)):
+        assert len(notifications.claim_batch(cursor, 10)) == 1
@@ -0,0 +1,26 @@
+#test_ratelimit.py
+
+from flask import Flask, request
+
+import ratelimit
+from ratelimit import KeyedLimiter, client_id
+
+def test_shared_buckets_are_one_limit_across_limiters():
+    # Two limiters stand in for two worker processes using the same cache file
+    first, second = KeyedLimiter(namespace='test-shared'), KeyedLimiter(namespace='test-shared')
+    assert first.bucket('sbc1', 0.001, 2).try_acquire() == 0
+    assert second.bucket('sbc1', 0.001, 2).try_acquire() == 0
+    assert first.bucket('sbc1', 0.001, 2).try_acquire() > 0
+    second.bucket('sbc1', 0.001, 2).refund()
+    assert first.bucket('sbc1', 0.001, 2).try_acquire() == 0
+
+def test_client_id_prefers_user_then_trusted_forwarded_address(monkeypatch):
+    app = Flask(__name__)
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1'},
+                                  headers={'X-Forwarded-For': '6.6.6.6, 192.0.2.7'}):
+        assert client_id(request) == '10.0.0.1'
+        monkeypatch.setattr(ratelimit, 'cfg', type('Cfg', (), {'RATE_LIMIT_TRUSTED_PROXIES': 1}))
+        # Only the entry the proxy appended; the client wrote the rest
+        assert client_id(request) == '192.0.2.7'
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1', 'REMOTE_USER': 'CORP\\Alice'}):
+        assert client_id(request) == 'user:corp\\alice'
@@ -0,0 +1,23 @@
+#test_reports.py
+
+from datetime import datetime, timedelta
+
+from config import cfg
+
+def test_coverage_with_only_a_future_from(client):
+    start = datetime.now() + timedelta(days=cfg.REPORTS_DEFAULT_DAYS + 30)
+    response = client.get('/audssoncall/api/reports/coverage', query_string={'from': start.strftime('%Y-%m-%d')})
+    assert response.status_code == 200
+    window = response.get_json()['window']
+    assert window['from'] < window['to']
+    assert window['hours'] == cfg.REPORTS_DEFAULT_DAYS * 24
+
+def test_coverage_with_only_a_past_to(client):
+    end = datetime.now() - timedelta(days=cfg.REPORTS_DEFAULT_DAYS + 30)
+    response = client.get('/audssoncall/api/reports/coverage', query_string={'to': end.strftime('%Y-%m-%d')})
+    assert response.status_code == 200
+    assert response.get_json()['window']['hours'] == cfg.REPORTS_DEFAULT_DAYS * 24
+
+def test_coverage_rejects_an_empty_window(client):
+    response = client.get('/audssoncall/api/reports/coverage', query_string={'from': '2030-01-02', 'to': '2030-01-01'})
+    assert response.status_code == 400
@@ -0,0 +1,96 @@
+#test_scheduler_service.py
+
+import threading
+from datetime import datetime, timedelta
+
+import clock
+import scheduler_service
+from conftest import add_schedule, add_user
+from db import get_db_connection
+
+DUE = datetime(2031, 6, 1, 9, 0)
+
+def fake_run(runs, complete=True):
+    """Stands in for run_scheduled_updates: records clock.now() and (optionally) completes what is due."""
+    def run():
+        runs.append(clock.now())
+        if complete:
+            conn = get_db_connection()
+            conn.cursor().execute("UPDATE OnCallSchedules SET status = 'completed' WHERE scheduled_datetime <= ?",
+                                  (clock.now(),))
+            conn.close()
+        return {}
+    return run
+
+def test_tick_follows_the_frozen_clock(conn, monkeypatch):
+    add_schedule(conn.cursor(), add_user(conn.cursor()), DUE)
+    runs, prestaged = [], []
+    monkeypatch.setattr(scheduler_service, 'run_scheduled_updates', fake_run(runs))
+    monkeypatch.setattr(scheduler_service, 'prestage_handover', lambda schedule_id, due: prestaged.append(due))
+    service = scheduler_service.SchedulerService(retry_delay=60)
+    lead = scheduler_service.cfg.SCHEDULER_PRESTAGE_SECONDS
+
+    with clock.frozen(DUE - timedelta(hours=1)):
+        assert service.tick() == 3600 - lead
+    with clock.frozen(DUE - timedelta(seconds=lead)):
+        assert service.tick() == lead
+    for _ in range(50):
+        if prestaged:
+            break
+        threading.Event().wait(0.01)
+    assert prestaged == [DUE]
+    assert runs == []
+    with clock.frozen(DUE):
+        assert service.tick() is None
+    assert runs == [DUE]
+
+def test_retry_delay_is_clock_time(conn, monkeypatch):
+    add_schedule(conn.cursor(), add_user(conn.cursor()), DUE)
+    runs = []
+    # The schedule stays pending, as when the status write fails
+    monkeypatch.setattr(scheduler_service, 'run_scheduled_updates', fake_run(runs, complete=False))
+    service = scheduler_service.SchedulerService(retry_delay=60)
+    with clock.frozen(DUE):
+        assert service.tick() == 60
+    with clock.frozen(DUE + timedelta(seconds=30)):
+        assert service.tick() == 30
+    assert runs == [DUE]
+    with clock.frozen(DUE + timedelta(seconds=60)):
+        service.tick()
+    assert runs == [DUE, DUE + timedelta(seconds=60)]
+
+def test_service_thread_runs_when_the_clock_is_moved(conn, monkeypatch):
+    add_schedule(conn.cursor(), add_user(conn.cursor()), DUE)
+    runs = []
+    ran = threading.Event()
+    run = fake_run(runs)
+    monkeypatch.setattr(scheduler_service, 'run_scheduled_updates', lambda: (run(), ran.set()))
+    monkeypatch.setattr(scheduler_service, 'prestage_handover', lambda schedule_id, due: None)
+    now = [DUE - timedelta(days=1)]
+    clock.set_clock(lambda: now[0])
+    service = scheduler_service.SchedulerService()
+    try:
+        service.start()
+        assert not ran.wait(0.3)
+        now[0] = DUE + timedelta(seconds=1)
+        service.notify()
+        assert ran.wait(5)
+        assert runs == [DUE + timedelta(seconds=1)]
+    finally:
+        service.stop(5)
+        clock.set_clock(None)
+
+def test_next_handover_is_not_held_back_by_the_retry_delay(conn, monkeypatch):
+    user_id = add_user(conn.cursor())
+    second = DUE + timedelta(seconds=10)
+    add_schedule(conn.cursor(), user_id, DUE)
+    add_schedule(conn.cursor(), user_id, second)
+    runs = []
+    monkeypatch.setattr(scheduler_service, 'run_scheduled_updates', fake_run(runs))
+    monkeypatch.setattr(scheduler_service, 'prestage_handover', lambda schedule_id, due: None)
+    service = scheduler_service.SchedulerService(retry_delay=60)
+    with clock.frozen(DUE):
+        assert service.tick() == 10
+    with clock.frozen(second):
+        assert service.tick() is None
+    assert runs == [DUE, second]
@@ -0,0 +1,30 @@
+#test_scheduler_task.py
+
+from datetime import datetime, timedelta
+
+import clock
+from conftest import add_schedule, add_user
+from scheduler_task import claim_due_jobs
+
+def test_claim_uses_database_time_by_default(conn):
+    cursor = conn.cursor()
+    user = add_user(cursor)
+    moment = datetime(2030, 1, 1, 9, 0)
+    due = add_schedule(cursor, user, moment - timedelta(minutes=1))
+    add_schedule(cursor, user, moment + timedelta(minutes=1))
+    # The stand-in's GETDATE() follows clock.now()
+    with clock.frozen(moment):
+        claimed = claim_due_jobs(cursor, 'worker-a', lease_seconds=300)
+    assert [row[0] for row in claimed] == [due]
+    cursor.execute("SELECT status, claimed_by, lease_expires FROM OnCallSchedules WHERE id = ?", (due,))
+    assert cursor.fetchone() == ('in_progress', 'worker-a', moment + timedelta(seconds=300))
+
+def test_expired_lease_is_reclaimed(conn):
+    cursor = conn.cursor()
+    user = add_user(cursor)
+    moment = datetime(2030, 1, 1, 9, 0)
+    schedule = add_schedule(cursor, user, moment)
+    assert claim_due_jobs(cursor, 'worker-a', now=moment, lease_seconds=60)
+    assert claim_due_jobs(cursor, 'worker-b', now=moment + timedelta(seconds=30)) == []
+    claimed = claim_due_jobs(cursor, 'worker-b', now=moment + timedelta(seconds=61))
+    assert [row[0] for row in claimed] == [schedule]
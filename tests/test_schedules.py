@@ -0,0 +1,57 @@
+#test_schedules.py
+
+from datetime import datetime, timedelta
+
+import schedules
+from conftest import add_schedule, add_user
+
+WHEN = datetime(2031, 3, 1, 9, 0)
+
+def stale_index_conflict(conn):
+    """A user, and a pending schedule this process's index has not seen (as if another worker added it)."""
+    cursor = conn.cursor()
+    user = add_user(cursor)
+    schedules.find_conflicts(cursor, WHEN)
+    # No ChangeLog row, so the index does not pick it up on its next sync
+    add_schedule(cursor, user, WHEN + timedelta(minutes=10))
+    assert schedules.find_conflicts(cursor, WHEN) == []
+    return user
+
+def test_bulk_rejects_conflicts_missed_by_the_index(conn, client):
+    user = stale_index_conflict(conn)
+    response = client.post('/audssoncall/api/schedule/bulk', json=[
+        {'user_id': user, 'scheduled_datetime': WHEN.isoformat()},
+        {'user_id': user, 'scheduled_datetime': (WHEN + timedelta(days=1)).isoformat()},
+    ])
+    assert response.status_code == 207
+    report = response.get_json()
+    assert (report['created'], report['rejected']) == (1, 1)
+    assert report['rows'][0]['status'] == 'rejected'
+    assert report['rows'][0]['error'] == 'Too close to other handovers'
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM OnCallSchedules")
+    assert cursor.fetchone()[0] == 2
+
+def test_single_create_rejects_conflicts_missed_by_the_index(conn, client):
+    user = stale_index_conflict(conn)
+    response = client.post('/audssoncall/api/schedule', json={'user_id': user, 'scheduled_datetime': WHEN.isoformat()})
+    assert response.status_code == 409
+    assert response.get_json()['conflicts'][0]['minutes_apart'] == 10.0
+    response = client.post('/audssoncall/api/schedule', json={
+        'user_id': user, 'scheduled_datetime': WHEN.isoformat(), 'allow_conflicts': True})
+    assert response.status_code == 201
+    assert len(response.get_json()['conflicts']) == 1
+
+def test_invalid_user_id_is_a_400(conn, client):
+    response = client.post('/audssoncall/api/schedule', json={'user_id': 'abc', 'scheduled_datetime': WHEN.isoformat()})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid user ID'}
+    user = add_user(conn.cursor())
+    response = client.post('/audssoncall/api/schedule/bulk', json=[
+        {'user_id': 'abc', 'scheduled_datetime': WHEN.isoformat()},
+        {'user_id': str(user), 'scheduled_datetime': WHEN.isoformat()},
+    ])
+    assert response.status_code == 207
+    rows = response.get_json()['rows']
+    assert (rows[0]['status'], rows[0]['error']) == ('rejected', 'Invalid user ID')
+    assert rows[1]['status'] == 'created'
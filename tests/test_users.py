@@ -0,0 +1,27 @@
+#test_users.py
+
+import users
+
+def test_parse_import_rejects_names_that_differ_only_in_case_or_spacing():
+    valid, errors = users.parse_import([
+        {'name': 'Alice Smith', 'mobile': '0400 111 222'},
+        {'name': '  alice   SMITH ', 'mobile': '0400 111 333'},
+        {'name': 'ALICE\tSMITH', 'mobile': '0400 111 444'},
+        {'name': 'Bob', 'mobile': '0400 111 555'},
+    ])
+    assert [(row_no, name) for row_no, name, _ in valid] == [(1, 'Alice Smith'), (4, 'Bob')]
+    assert errors == [
+        {'row': 2, 'name': 'alice SMITH', 'error': 'Duplicate of row 1 in this import'},
+        {'row': 3, 'name': 'ALICE SMITH', 'error': 'Duplicate of row 1 in this import'},
+    ]
+
+def test_import_reports_duplicates_per_row(conn):
+    report = users.import_users(conn, [
+        {'name': 'Alice', 'mobile': '0400111222'},
+        {'name': 'ALICE', 'mobile': '0400111333'},
+    ])
+    assert report['inserted'] == 1
+    assert [error['row'] for error in report['errors']] == [2]
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, mobile FROM OnCallUsers")
+    assert cursor.fetchall() == [('Alice', '+61400111222')]
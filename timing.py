@@ -0,0 +1,188 @@
+#timing.py
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from config import cfg
+
+# Request-scoped timing spans, reported in the Server-Timing header (visible
+# in the browser dev tools under Network > Timing) and logged as a tree for
+# requests slower than TIMING.SLOW_REQUEST_MS.
+#
+# A trace only exists while a request is being handled (or inside traced()),
+# so span() costs nothing in the scheduler and other background threads.
+# Work handed to a thread pool stays attached to the request when submitted
+# through submit().
+
+_trace = ContextVar('timing_trace', default=None)
+_parent = ContextVar('timing_parent', default=None)
+
+class Trace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []  # [id, parent id, name, desc, start offset ms, duration ms]
+        self._lock = threading.Lock()
+
+    def begin(self, parent, name, desc):
+        with self._lock:
+            span_id = len(self.spans) + 1
+            self.spans.append([span_id, parent, name, desc, self.total_ms(), None])
+            return span_id
+
+    def end(self, span_id):
+        entry = self.spans[span_id - 1]
+        entry[5] = self.total_ms() - entry[4]
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def header(self):
+        """Server-Timing value: one entry per span name and description, durations summed."""
+        totals = {}
+        for _, _, name, desc, _, duration in self.spans:
+            if duration is None:
+                continue
+            key = (name, desc)
+            count, total = totals.get(key, (0, 0.0))
+            totals[key] = (count + 1, total + duration)
+        entries = []
+        for (name, desc), (count, total) in totals.items():
+            label = desc
+            if count > 1:
+                label = f"{desc} x{count}" if desc else f"x{count}"
+            entry = f"{name};dur={total:.1f}"
+            if label:
+                entry += f';desc="{label}"'
+            entries.append(entry)
+        entries.append(f"total;dur={self.total_ms():.1f}")
+        return ", ".join(entries)
+
+    def counts(self):
+        """Number of finished spans per name, e.g. {'db.query': 7, 'sbc.post': 2}."""
+        totals = {}
+        for _, _, name, _, _, duration in self.spans:
+            if duration is not None:
+                totals[name] = totals.get(name, 0) + 1
+        return totals
+
+    def tree(self):
+        """Indented span listing for the slow-request log."""
+        children = {}
+        for span in self.spans:
+            children.setdefault(span[1], []).append(span)
+        lines = []
+
+        def walk(parent, depth):
+            for span_id, _, name, desc, offset, duration in children.get(parent, []):
+                label = f" [{desc}]" if desc else ""
+                took = f"{duration:.1f}ms" if duration is not None else "unfinished"
+                lines.append(f"{'  ' * depth}+{offset:.0f}ms {name}{label} {took}")
+                walk(span_id, depth + 1)
+
+        walk(None, 1)
+        return "\n".join(lines)
+
+@contextmanager
+def span(name, desc=None):
+    """Times the enclosed block as a span of the current request (no-op outside one)."""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    span_id = trace.begin(_parent.get(), name, desc)
+    token = _parent.set(span_id)
+    try:
+        yield
+    finally:
+        _parent.reset(token)
+        trace.end(span_id)
+
+@contextmanager
+def traced():
+    """Traces the enclosed block as if it were a request (for scripts and benchmarks); yields the Trace."""
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+def submit(pool, func, *args):
+    """pool.submit(func, *args), keeping any spans func records inside the current request."""
+    return pool.submit(copy_context().run, func, *args)
+
+def active():
+    return _trace.get() is not None
+
+# --- DB INSTRUMENTATION ---
+class TimedCursor:
+    """Cursor wrapper recording a db.query span per execute/executemany."""
+
+    def __init__(self, cursor):
+        object.__setattr__(self, '_cursor', cursor)
+
+    def execute(self, *args):
+        with span('db.query'):
+            self._cursor.execute(*args)
+        return self
+
+    def executemany(self, *args):
+        with span('db.query', 'executemany'):
+            self._cursor.executemany(*args)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._cursor, name, value)
+
+class TimedConnection:
+    """Connection wrapper whose cursors are TimedCursors."""
+
+    def __init__(self, conn):
+        object.__setattr__(self, '_conn', conn)
+
+    def cursor(self):
+        return TimedCursor(self._conn.cursor())
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+# --- FLASK HOOKS ---
+def init_app(app):
+    """Traces every request when TIMING.ENABLED and adds the Server-Timing header."""
+    from flask import g, request
+
+    @app.before_request
+    def start_trace():
+        if cfg.TIMING_ENABLED:
+            g.timing_token = _trace.set(Trace())
+
+    @app.after_request
+    def add_header(response):
+        trace = _trace.get()
+        if trace is None:
+            return response
+        response.headers['Server-Timing'] = trace.header()
+        total = trace.total_ms()
+        if total >= cfg.TIMING_SLOW_REQUEST_MS:
+            logging.warning(f"Slow request {request.method} {request.path} took {total:.0f}ms:\n{trace.tree()}")
+        return response
+
+    @app.teardown_request
+    def end_trace(error=None):
+        token = g.pop('timing_token', None)
+        if token is not None:
+            _trace.reset(token)
@@ -0,0 +1,300 @@
+#users.py
+
+import csv
+import io
+import json
+import logging
+import re
+import threading
+import time
+from config import cfg
+import sharedcache
+
+# Mobiles are stored in E.164 ("+61400111222") so they can be compared with
+# what the SBCs hold. normalize_mobile() is applied once when a number is
+# written; the index below maps normalised numbers back to users.
+
+_SEPARATORS = re.compile(r"[\s\-().]")
+
+def normalize_mobile(raw):
+    """
+    Returns raw as an E.164 number, or raises ValueError.
+
+    '+61 400 111 222', '0061400111222' and '61400111222' are all taken as
+    international; a number with a single leading 0 ('0400 111 222') is a
+    national number in USERS.DEFAULT_COUNTRY_CODE.
+    """
+    number = _SEPARATORS.sub("", str(raw or ""))
+    if number.startswith('+'):
+        digits = number[1:]
+    elif number.startswith('00'):
+        digits = number[2:]
+    elif number.startswith('0'):
+        digits = str(cfg.USERS_DEFAULT_COUNTRY_CODE) + number[1:]
+    else:
+        digits = number
+    if not digits.isdigit() or not 8 <= len(digits) <= 15:
+        raise ValueError(f"'{raw}' is not a valid mobile number")
+    return '+' + digits
+
+def same_number(a, b):
+    """True if a and b are the same valid number, however they are formatted."""
+    try:
+        return normalize_mobile(a) == normalize_mobile(b)
+    except ValueError:
+        return False
+
+class UserIndex:
+    """
+    Normalised mobile -> {'id', 'name', 'mobile'} for every user.
+
+    Built with one query and rebuilt after invalidate(), in this process or
+    (through the shared 'users' generation, see sharedcache.py) in any other
+    worker process, or once USERS.INDEX_TTL_SECONDS have passed.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._built = 0
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._index = None
+
+    def _build(self):
+        # Imported here so sbcutils can use normalize_mobile without a DB layer
+        from db import get_db_connection
+        conn = get_db_connection()
+        if conn is None:
+            logging.error("Could not build user index: database connection failed")
+            return {}
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, name, mobile FROM OnCallUsers")
+            index = {}
+            for user_id, name, mobile in cursor.fetchall():
+                try:
+                    index[normalize_mobile(mobile)] = {'id': user_id, 'name': name, 'mobile': mobile}
+                except ValueError:
+                    logging.warning(f"User {user_id} has an invalid mobile number: {mobile}")
+            return index
+        finally:
+            conn.close()
+
+    def _stale(self, generation):
+        return (self._index is None or generation != self._generation
+                or time.monotonic() - self._built > cfg.USERS_INDEX_TTL)
+
+    def lookup(self, number):
+        """The user whose mobile is number, or None."""
+        generation = sharedcache.generation('users')
+        index = self._index
+        if self._stale(generation):
+            with self._lock:
+                index = self._index
+                if self._stale(generation):
+                    index = self._index = self._build()
+                    self._built = time.monotonic()
+                    self._generation = generation
+        try:
+            return index.get(normalize_mobile(number))
+        except ValueError:
+            return None
+
+_index = UserIndex()
+
+def lookup(number):
+    return _index.lookup(number)
+
+def invalidate():
+    """Drops the user index and the cached user lists, in every worker process."""
+    _index.invalidate()
+    sharedcache.bump('users')
+
+def annotate(results):
+    """Copies SBC status results, adding the on-call user ({'id', 'name'} or None) to each."""
+    annotated = []
+    for result in results:
+        user = lookup(result['number']) if result.get('number') else None
+        annotated.append(dict(result, user={'id': user['id'], 'name': user['name']} if user else None))
+    return annotated
+
+# --- BULK IMPORT / EXPORT ---
+IMPORT_COLUMNS = ('name', 'mobile')
+
+def _name_key(name):
+    # Names are matched case-insensitively, as by SQL Server's default
+    # collation and the COLLATE NOCASE in _upsert_sqlite
+    return name.casefold()
+
+def parse_import(rows):
+    """
+    Validates import rows ({'name', 'mobile'} dicts, numbered from 1).
+    Returns (valid, errors): valid is [(row_no, name, e164_mobile)], errors
+    is [{'row', 'name', 'error'}]. Runs of whitespace in a name are
+    collapsed to one space. A name repeated in the file (in any case) is an
+    error on every occurrence after the first: the upserts match on name,
+    and MERGE fails outright if two source rows match the same user.
+    """
+    valid, errors, seen = [], [], {}
+    for row_no, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({'row': row_no, 'name': None, 'error': 'Expected an object with name and mobile'})
+            continue
+        name = " ".join(str(row.get('name') or '').split())
+        if not name:
+            errors.append({'row': row_no, 'name': None, 'error': 'Name is required'})
+            continue
+        first = seen.get(_name_key(name))
+        if first is not None:
+            errors.append({'row': row_no, 'name': name, 'error': f'Duplicate of row {first} in this import'})
+            continue
+        try:
+            mobile = normalize_mobile(row.get('mobile'))
+        except ValueError as e:
+            errors.append({'row': row_no, 'name': name, 'error': str(e)})
+            continue
+        seen[_name_key(name)] = row_no
+        valid.append((row_no, name, mobile))
+    return valid, errors
+
+def _upsert_mssql(cursor, valid):
+    # DATABASE_DEFAULT: #tables otherwise take tempdb's collation, which may
+    # compare names differently from OnCallUsers
+    cursor.execute("""
+        CREATE TABLE #UserImport (
+            row_no INT,
+            name NVARCHAR(255) COLLATE DATABASE_DEFAULT,
+            mobile NVARCHAR(50) COLLATE DATABASE_DEFAULT
+        )
+    """)
+    # One round-trip for the whole staging insert
+    cursor.fast_executemany = True
+    cursor.executemany("INSERT INTO #UserImport (row_no, name, mobile) VALUES (?, ?, ?)", valid)
+    cursor.execute("""
+        MERGE OnCallUsers AS target
+        USING #UserImport AS source ON target.name = source.name
+        WHEN MATCHED AND target.mobile <> source.mobile THEN
+            UPDATE SET mobile = source.mobile
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT (name, mobile) VALUES (source.name, source.mobile)
+        OUTPUT source.row_no, $action, inserted.id;
+    """)
+    actions = {
+        row_no: ('inserted' if action == 'INSERT' else 'updated', user_id)
+        for row_no, action, user_id in cursor.fetchall()
+    }
+    cursor.execute("DROP TABLE #UserImport")
+    return actions
+
+def _upsert_sqlite(cursor, valid):
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS UserImport (row_no INTEGER, name TEXT, mobile TEXT)")
+    cursor.execute("DELETE FROM UserImport")
+    cursor.executemany("INSERT INTO UserImport (row_no, name, mobile) VALUES (?, ?, ?)", valid)
+    # SQLite has no MERGE: classify the rows first, then update and insert set-wise
+    cursor.execute("""
+        SELECT i.row_no, CASE WHEN MAX(u.id) IS NULL THEN 'inserted'
+                              WHEN MAX(u.mobile <> i.mobile) = 1 THEN 'updated' END
+        FROM UserImport i
+        LEFT JOIN OnCallUsers u ON u.name = i.name COLLATE NOCASE
+        GROUP BY i.row_no
+    """)
+    classified = {row_no: action for row_no, action in cursor.fetchall() if action}
+    cursor.execute("""
+        UPDATE OnCallUsers SET mobile = i.mobile
+        FROM UserImport i
+        WHERE OnCallUsers.name = i.name COLLATE NOCASE AND OnCallUsers.mobile <> i.mobile
+    """)
+    cursor.execute("""
+        INSERT INTO OnCallUsers (name, mobile)
+        SELECT i.name, i.mobile FROM UserImport i
+        WHERE NOT EXISTS (SELECT 1 FROM OnCallUsers u WHERE u.name = i.name COLLATE NOCASE)
+        ORDER BY i.row_no
+    """)
+    cursor.execute("""
+        SELECT i.row_no, MIN(u.id) FROM UserImport i
+        JOIN OnCallUsers u ON u.name = i.name COLLATE NOCASE
+        GROUP BY i.row_no
+    """)
+    actions = {row_no: (classified[row_no], user_id) for row_no, user_id in cursor.fetchall() if row_no in classified}
+    cursor.execute("DELETE FROM UserImport")
+    return actions
+
+def import_users(conn, rows):
+    """
+    Upserts users by name in a single transaction: new names are inserted,
+    existing ones get the new mobile. Invalid rows are skipped and reported.
+    Returns {'inserted', 'updated', 'unchanged', 'errors', 'rows', 'version'},
+    version being the change version after the import (None if nothing changed).
+    """
+    from db import is_sqlite
+    import changes
+    valid, errors = parse_import(rows)
+    report = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'errors': errors, 'rows': [], 'version': None}
+    if not valid:
+        return report
+    version = None
+
+    cursor = conn.cursor()
+    if is_sqlite():
+        # IMMEDIATE: the upsert reads before it writes, and a deferred
+        # transaction cannot wait for the write lock once it has read
+        cursor.execute("BEGIN IMMEDIATE")
+    else:
+        conn.autocommit = False
+    try:
+        actions = _upsert_sqlite(cursor, valid) if is_sqlite() else _upsert_mssql(cursor, valid)
+        # Logged last, just before the commit (see changes.py)
+        for result, action in (('inserted', 'insert'), ('updated', 'update')):
+            ids = [user_id for outcome, user_id in actions.values() if outcome == result]
+            version = changes.record(cursor, 'user', action, ids) or version
+        if is_sqlite():
+            cursor.execute("COMMIT")
+        else:
+            conn.commit()
+    except Exception:
+        if is_sqlite():
+            cursor.execute("ROLLBACK")
+        else:
+            conn.rollback()
+        raise
+    finally:
+        if not is_sqlite():
+            conn.autocommit = True
+    invalidate()
+
+    report['version'] = version
+    for row_no, name, mobile in valid:
+        action = actions.get(row_no, ('unchanged', None))[0]
+        report[action] += 1
+        report['rows'].append({'row': row_no, 'name': name, 'mobile': mobile, 'result': action})
+    logging.info(f"User import: {report['inserted']} inserted, {report['updated']} updated, "
+                 f"{report['unchanged']} unchanged, {len(errors)} rejected")
+    return report
+
+def export_users(conn, fmt, batch_size=500):
+    """Yields the user table as CSV or NDJSON chunks, batch_size rows at a time, then closes conn."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name, mobile FROM OnCallUsers ORDER BY id")
+        if fmt == 'csv':
+            writer.writerow(('id',) + IMPORT_COLUMNS)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for user_id, name, mobile in rows:
+                if fmt == 'csv':
+                    writer.writerow((user_id, name, mobile))
+                else:
+                    buffer.write(json.dumps({'id': user_id, 'name': name, 'mobile': mobile}) + "\n")
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        conn.close()